@@ -0,0 +1,112 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Child Usage
+#-------------------------------------------------------------------------------
+
+# Runs a command as the child of a small launcher process and writes the
+# resource usage of that child to a file. On Linux the peak RSS of a process
+# carries over from the process it was forked from, even across exec, so a
+# command forked directly from SCons reports the size of SCons. Forked from the
+# launcher it starts from the few MB of the launcher instead.
+#
+# The launcher is run as a script and so uses only the standard library.
+
+# Python Standard
+import os
+import sys
+import errno
+import signal
+import resource
+import tempfile
+
+
+_launcher = os.path.splitext( os.path.abspath( __file__ ) )[0] + '.py'
+
+
+def command( args_list ):
+    """Returns the command that runs args_list through the launcher, and the
+    path of the file the usage of args_list is written to"""
+    handle, usage_path = tempfile.mkstemp( prefix='cuppa_usage_' )
+    os.close( handle )
+    return [ sys.executable, '-S', _launcher, usage_path, '--' ] + list( args_list ), usage_path
+
+
+
+class Usage(object):
+    """The fields of an rusage that are written by the launcher"""
+
+    def __init__( self, ru_utime, ru_stime, ru_maxrss ):
+        self.ru_utime  = ru_utime
+        self.ru_stime  = ru_stime
+        self.ru_maxrss = ru_maxrss
+
+
+
+def read( usage_path ):
+    """Returns the Usage written to usage_path, and removes it, or None if the
+    launcher did not write one, such as when it was killed. Raises OSError if
+    the command could not be run, as subprocess.Popen() would have."""
+    try:
+        with open( usage_path ) as usage_file:
+            fields = usage_file.read().split( None, 2 )
+        if fields and fields[0] == 'error':
+            raise OSError( int( fields[1] ), fields[2].strip() )
+        return len( fields ) == 3 and Usage( float( fields[0] ), float( fields[1] ), int( fields[2] ) ) or None
+    except ( IOError, ValueError, IndexError ):
+        return None
+    finally:
+        try:
+            os.remove( usage_path )
+        except OSError:
+            pass
+
+
+
+def _launch( usage_path, args_list ):
+    # The launcher is in the process group of the command, so it ignores the
+    # signals sent to the group to stop the command and waits for it instead
+    stop_signals = [ signal.SIGTERM, signal.SIGINT, signal.SIGHUP ]
+    for signal_number in stop_signals:
+        signal.signal( signal_number, signal.SIG_IGN )
+
+    pid = os.fork()
+    if pid == 0:
+        for signal_number in stop_signals:
+            signal.signal( signal_number, signal.SIG_DFL )
+        try:
+            os.execvp( args_list[0], args_list )
+        except OSError, error:
+            with open( usage_path, 'w' ) as usage_file:
+                usage_file.write( "error {} {}\n".format( error.errno, error.strerror ) )
+        os._exit( 127 )
+
+    while True:
+        try:
+            pid, status, rusage = os.wait4( pid, 0 )
+            break
+        except OSError, error:
+            if error.errno != errno.EINTR:
+                raise
+
+    # If the command could not be run its error has been written instead
+    if not os.path.getsize( usage_path ):
+        with open( usage_path, 'w' ) as usage_file:
+            usage_file.write( "{!r} {!r} {}\n".format( rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss ) )
+
+    # End the same way as the command so that the caller sees how it ended
+    if os.WIFSIGNALED( status ):
+        signal_number = os.WTERMSIG( status )
+        resource.setrlimit( resource.RLIMIT_CORE, ( 0, 0 ) )
+        signal.signal( signal_number, signal.SIG_DFL )
+        os.kill( os.getpid(), signal_number )
+        os._exit( 128 + signal_number )
+    os._exit( os.WEXITSTATUS( status ) )
+
+
+if __name__ == '__main__':
+    _launch( sys.argv[1], sys.argv[3:] )
@@ -117,6 +117,8 @@ class Colouriser(object):
             return colorama.Fore.RED
         elif meaning == 'aborted':
             return colorama.Fore.RED
+        elif meaning == 'timeout':
+            return colorama.Fore.RED
         elif meaning == 'skipped':
             return colorama.Fore.BLACK
         elif meaning == 'notice':
@@ -147,6 +149,8 @@ class Colouriser(object):
             return colorama.Style.BRIGHT + colorama.Back.RED + colorama.Fore.WHITE
         elif meaning == 'aborted':
             return colorama.Style.BRIGHT + colorama.Back.RED + colorama.Fore.BLACK
+        elif meaning == 'timeout':
+            return colorama.Style.BRIGHT + colorama.Back.RED + colorama.Fore.BLACK
         elif meaning == 'skipped':
             return colorama.Style.BRIGHT + colorama.Back.BLACK + colorama.Fore.WHITE
         elif meaning == 'notice':
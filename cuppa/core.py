@@ -26,6 +26,13 @@ import cuppa.recursive_glob
 import cuppa.configure
 import cuppa.options
 import cuppa.version
+import cuppa.decider
+import cuppa.deduplicate
+import cuppa.test_schedule
+import cuppa.test_limits
+import cuppa.cpp.compile_time_trace
+import cuppa.cpp.include_cost
+import cuppa.cpp.syntax_check
 
 from cuppa.scms                   import *
 from cuppa.toolchains             import *
@@ -76,9 +83,83 @@ def add_base_options():
                             dest='runner',
                             help='The test runner to use for executing tests. The default is the process test runner' )
 
-#    SCons.Script.AddOption( '--decider', dest='decider', type='string', nargs=1, action='store',
-#                            help='The decider to use for determining if a dependency has changed',
-#                            default = 'MD5-timestamp' )
+    SCons.Script.AddOption( '--test-shards', dest='test_shards', type='int', nargs=1, action='store',
+                            help='Split the test cases of each test program that supports it, such as those'
+                                 ' run by the boost and gtest test runners, into TEST_SHARDS shards run at the'
+                                 ' same time' )
+
+    SCons.Script.AddOption( '--test-timeout', dest='test_timeout', type='float', nargs=1, action='store',
+                            help='Stop any test that has not finished after TEST_TIMEOUT seconds, unless the test'
+                                 ' has its own timeout' )
+
+    SCons.Script.AddOption( '--test-memory-limit', dest='test_memory_limit', type='int', nargs=1, action='store',
+                            help='Limit the address space of each test process to TEST_MEMORY_LIMIT MB' )
+
+    SCons.Script.AddOption( '--test-cpu-limit', dest='test_cpu_limit', type='int', nargs=1, action='store',
+                            help='Limit the CPU time of each test process to TEST_CPU_LIMIT seconds' )
+
+    SCons.Script.AddOption( '--test-tee', dest='test_tee', action='store_true',
+                            help='Show the output of tests run by the process test runner as they run, as well as'
+                                 ' writing it to their logs' )
+
+    SCons.Script.AddOption( '--test-regression-threshold', dest='test_regression_threshold', type='float', nargs=1,
+                            action='store',
+                            help='Fail any test whose wall time, CPU time or peak RSS is significantly above its'
+                                 ' median over recent runs by more than TEST_REGRESSION_THRESHOLD percent' )
+
+    SCons.Script.AddOption( '--bench-warmup', dest='bench_warmup', type='int', nargs=1, action='store',
+                            help='Run each benchmark BENCH_WARMUP times before it is timed. The default is 1' )
+
+    SCons.Script.AddOption( '--bench-repetitions', dest='bench_repetitions', type='int', nargs=1, action='store',
+                            help='Time each benchmark over BENCH_REPETITIONS runs. The default is 5' )
+
+    SCons.Script.AddOption( '--bench-cpus', dest='bench_cpus', type='string', nargs=1, action='store',
+                            help='Pin benchmarks to the comma separated list of CPUs BENCH_CPUS' )
+
+    SCons.Script.AddOption( '--bench-update-baseline', dest='bench_update_baseline', action='store_true',
+                            help='Store the results of each benchmark as the baseline later runs are compared with' )
+
+    SCons.Script.AddOption( '--depfiles', dest='depfiles', action='store_true',
+                            help='Have the compiler write dependency files and use them in place of scanning'
+                                 ' for implicit header dependencies where they exist' )
+
+    SCons.Script.AddOption( '--fast-link', dest='fast_link', action='store_true',
+                            help='Link with gold or lld where available, using a gdb index, split DWARF for dbg'
+                                 ' builds and thin archives for static libraries' )
+
+    SCons.Script.AddOption( '--batch-compile', dest='batch_size', type='int', nargs=1, action='store',
+                            help='Compile out-of-date sources that share the same flags and folder using one'
+                                 ' compiler call for up to BATCH_SIZE sources' )
+
+    SCons.Script.AddOption( '--shared-dev', dest='shared_dev', action='store_true',
+                            help='In dbg builds, build libraries created using BuildLibrary as shared libraries'
+                                 ' so that programs link against them dynamically and are not relinked when'
+                                 ' a library changes' )
+
+    SCons.Script.AddOption( '--compile-time-trace', dest='compile_time_trace', action='store_true',
+                            help='Time each compile using -ftime-trace (clang) or -ftime-report (gcc) and report'
+                                 ' the most expensive headers, template instantiations and phases of the build' )
+
+    SCons.Script.AddOption( '--include-cost', dest='include_cost', action='store_true',
+                            help='Preprocess every object to rank headers by the text they bring in, how many'
+                                 ' files include them directly and how many objects rebuild when they change' )
+
+    SCons.Script.AddOption( '--include-paths', dest='include_paths', type='choice', nargs=1, action='store',
+                            choices=[ 'report', 'trim' ],
+                            help='Record which include folders each object uses and report those it does not.'
+                                 ' With trim, also leave the unused folders off the command line of each object'
+                                 ' in later builds. Choices are: report, trim' )
+
+    SCons.Script.AddOption( '--deduplicate', dest='deduplicate', action='store_true',
+                            help='Compile identical compile commands, such as a shared source in several sconscripts'
+                                 ' or variants and toolchains with the same flags, only once and hard link the object' )
+
+    SCons.Script.AddOption( '--decider', dest='decider', type='choice', nargs=1, action='store',
+                            choices=cuppa.decider.names(),
+                            help='The decider to use for determining if a dependency has changed. The default'
+                                 ' is MD5-timestamp. The fast deciders keep a database of fast content signatures'
+                                 ' so unchanged files are never re-read. Choices are: '
+                                 + ", ".join( cuppa.decider.names() ) )
 
 
 
@@ -324,6 +405,49 @@ class Construct(object):
 
         test_runner = default_env.get_option( 'runner', default=default_runner and default_runner or 'process' )
         default_env['default_runner']  = test_runner
+        default_env['test_shards']     = default_env.get_option( 'test_shards' ) or 1
+        default_env['test_timeout']      = default_env.get_option( 'test_timeout' )
+        default_env['test_memory_limit'] = default_env.get_option( 'test_memory_limit' )
+        default_env['test_cpu_limit']    = default_env.get_option( 'test_cpu_limit' )
+        default_env['test_tee']          = default_env.get_option( 'test_tee' ) and True or False
+        default_env['test_regression_threshold'] = default_env.get_option( 'test_regression_threshold' )
+
+        bench_cpus = default_env.get_option( 'bench_cpus' )
+        default_env['bench_warmup']          = default_env.get_option( 'bench_warmup', default=1 )
+        default_env['bench_repetitions']     = default_env.get_option( 'bench_repetitions', default=5 )
+        default_env['bench_cpus']            = bench_cpus and [ int( cpu ) for cpu in bench_cpus.split(',') ] or None
+        default_env['bench_update_baseline'] = default_env.get_option( 'bench_update_baseline' ) and True or False
+
+        default_env['depfiles']        = default_env.get_option( 'depfiles' ) and True or False
+        default_env['fast_link']       = default_env.get_option( 'fast_link' ) and True or False
+        default_env['batch_size']      = default_env.get_option( 'batch_size' ) or 0
+        default_env['shared_dev']      = default_env.get_option( 'shared_dev' ) and True or False
+        default_env['compile_time_trace'] = default_env.get_option( 'compile_time_trace' ) and True or False
+        default_env['include_cost']    = default_env.get_option( 'include_cost' ) and True or False
+        default_env['include_paths']   = default_env.get_option( 'include_paths' )
+
+        # Traces and include analysis are made per object so objects are not batched
+        if default_env['compile_time_trace'] or default_env['include_cost'] or default_env['include_paths']:
+            default_env['batch_size'] = 0
+
+        decider = default_env.get_option( 'decider', default='MD5-timestamp' )
+        cuppa.decider.set_decider(
+                default_env,
+                decider,
+                os.path.join( default_env['build_root'], '.cuppa_signatures' ),
+                SCons.Script.GetOption( 'num_jobs' ) )
+
+        cuppa.test_schedule.install( default_env['build_root'] )
+        cuppa.test_limits.install()
+
+        if default_env.get_option( 'deduplicate' ):
+            cuppa.deduplicate.install( os.path.join( default_env['build_root'], '.cuppa_compiles' ) )
+
+        if default_env['compile_time_trace']:
+            cuppa.cpp.compile_time_trace.install_report( default_env['build_root'] )
+
+        if default_env['include_cost']:
+            cuppa.cpp.include_cost.install_report( default_env['build_root'] )
 
         self.add_variants   ( default_env )
         self.add_toolchains ( default_env )
@@ -456,10 +580,20 @@ class Construct(object):
             if not default_env['raw_output']:
                 cuppa.output_processor.Processor.install( variant_envs[ key ] )
 
+            # Also installed without tracing, to remove the traces of objects
+            # that are compiled again without it
+            cuppa.cpp.compile_time_trace.install_capture( variant_envs[ key ] )
+
+            if not variant_envs[ key ].has_key( 'variant_dir' ):
+                variant_envs[ key ]['variant_dir'] = key
+
             variant_envs[ key ]['toolchain'] = toolchain
             variant_envs[ key ]['variant'] = variant
             variant_envs[ key ]['variant_actions'] = self.get_active_actions_for_variant( default_env, active_variants, variant )
 
+            if variant_envs[ key ]['variant_actions'].has_key( 'check' ):
+                cuppa.cpp.syntax_check.install( variant_envs[ key ] )
+
         return variant_envs
 
 
@@ -509,7 +643,7 @@ class Construct(object):
                 variants = self.create_build_variants( toolchain, toolchain_env )
                 for variant, env in variants.items():
                     for sconscript in sconscripts:
-                        self.call_project_sconscript_files( toolchain.name(), variant, env, sconscript )
+                        self.call_project_sconscript_files( toolchain.name(), env['variant_dir'], env, sconscript )
 
             for project_generator in env[ self.project_generators_key ].itervalues():
                 for sconscript in sconscripts:
@@ -0,0 +1,242 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   BatchCompile
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import copy
+import subprocess
+
+# Scons
+import SCons.Action
+import SCons.Builder
+import SCons.Defaults
+import SCons.Errors
+import SCons.Executor
+import SCons.Subst
+import SCons.Util
+
+# Cuppa
+import cuppa.output_processor
+from cuppa.cpp.include_scanner import depfile_from_object
+
+
+class AbsoluteRDirs(SCons.Defaults.Variable_Method_Caller):
+    """Like RDirs but yields absolute paths so that a command can be run from
+    a folder other than the top of the build"""
+
+    def __init__( self ):
+        SCons.Defaults.Variable_Method_Caller.__init__( self, 'TARGET', 'RDirs' )
+
+
+    def __call__( self, *args, **kw ):
+        dirs = SCons.Defaults.Variable_Method_Caller.__call__( self, *args, **kw )
+        return dirs and [ directory.abspath for directory in dirs ]
+
+
+def _without_depfile_output( args ):
+    # The depfile named by -MF is per object so it cannot be used with several
+    # sources, instead -MD writes one beside each object and we move it later
+    filtered = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == '-MF':
+            skip = True
+        else:
+            filtered.append( arg )
+    return filtered
+
+
+def _compiler_env( env ):
+    compiler_env = {}
+    for key, value in SCons.Action.get_default_ENV( env ).items():
+        if SCons.Util.is_List( value ):
+            value = os.pathsep.join( map( str, SCons.Util.flatten( value ) ) )
+        compiler_env[key] = str( value )
+    return compiler_env
+
+
+
+class BatchCompileAction(SCons.Action.CommandAction):
+    """Compiles all out-of-date sources in a batch with one compiler call.
+
+    Objects are written by the compiler to its working folder so the call is
+    made from the folder holding the targets, which is why include paths and
+    sources are passed as absolute paths.
+    """
+
+    def __init__( self, command ):
+        SCons.Action.CommandAction.__init__(
+                self,
+                command + ' $CHANGED_SOURCES',
+                targets = '$CHANGED_TARGETS' )
+        self._flags   = command
+        self._batches = {}
+
+
+    def batch_key( self, env, target, source ):
+        key = ( id(self), id(env), target[0].dir )
+        count = self._batches.get( key, 0 )
+        self._batches[key] = count + 1
+        return key + ( count // env['batch_size'], )
+
+
+    def _changed( self, target, executor ):
+        if executor:
+            target = list( executor.get_action_targets() )
+        return [ ( node, node.sources[0].rfile() ) for node in target ]
+
+
+    def _command( self, target, source, env, executor, mode=SCons.Subst.SUBST_CMD ):
+        if executor:
+            command = env.subst_list( self._flags, mode, executor=executor )[0]
+        else:
+            command = env.subst_list( self._flags, mode, target, source )[0]
+        return _without_depfile_output( [ str( arg ) for arg in command ] )
+
+
+    def get_presig( self, target, source, env, executor=None ):
+        # Leave out the sources so that the signature of each object does not
+        # depend on which other objects happen to share its batch
+        return ' '.join( self._command( target, source, env, executor, SCons.Subst.SUBST_SIG ) )
+
+
+    def strfunction( self, target, source, env, executor=None ):
+        changed = self._changed( target, executor )
+        command = self._command( target, source, env, executor )
+        return "cd {} && {}".format(
+                changed[0][0].dir.abspath,
+                ' '.join( command + [ source.abspath for object, source in changed ] ) )
+
+
+    def execute( self, target, source, env, executor=None ):
+        changed = self._changed( target, executor )
+        if not changed:
+            return 0
+
+        directory = changed[0][0].dir.abspath
+        args = self._command( target, source, env, executor ) + [ source.abspath for object, source in changed ]
+
+        if env['raw_output']:
+            returncode = subprocess.call( args, cwd=directory, env=_compiler_env( env ) )
+        else:
+            returncode = cuppa.output_processor.Processor( env ).spawn(
+                    None, None, args[0], args, _compiler_env( env ), cwd=directory )
+
+        failed = []
+        for object, source in changed:
+            depfile = os.path.splitext( object.abspath )[0] + '.d'
+            if os.path.exists( depfile ):
+                os.rename( depfile, depfile_from_object( object.abspath ) )
+            if not os.path.exists( object.abspath ):
+                failed.append( str( object ) )
+
+        if returncode:
+            if failed:
+                print "cuppa: batch compile failed for [{}]".format( "], [".join( failed ) )
+            return SCons.Errors.BuildError(
+                    errstr  = "Batch compile failed",
+                    status  = returncode,
+                    action  = self,
+                    command = ' '.join( args ) )
+        return 0
+
+
+
+class BatchCompileGenerator(object):
+    """Selects the batch action where the compiler will name each object as
+    SCons expects, and the original action otherwise.
+
+    Batched sources are passed to the compiler using absolute paths, which are
+    then recorded in the objects. Variants that rely on the recorded paths,
+    such as coverage, turn batching off by setting batch_size to 0.
+    """
+
+    def __init__( self, action, batch_action, object_suffix ):
+        self._action        = action
+        self._batch_action  = batch_action
+        self._object_suffix = object_suffix
+
+
+    def batchable( self, target, source ):
+        if not target or len( target ) != len( source ):
+            return False
+        for object, source in zip( target, source ):
+            if object.name != os.path.splitext( source.name )[0] + self._object_suffix:
+                return False
+        return True
+
+
+    def __call__( self, target, source, env, for_signature ):
+        if env['batch_size'] < 2:
+            return self._action
+        if target and target[0] is not None and self.batchable( target, source ):
+            return self._batch_action
+        return self._action
+
+
+
+# Each object command with the object and source left out
+batch_commands = [
+    ( SCons.Defaults.CXXAction,   '$CXX -c $CXXFLAGS $CCFLAGS $_CPPFLAGS_BATCH' ),
+    ( SCons.Defaults.CAction,     '$CC -c $CFLAGS $CCFLAGS $_CPPFLAGS_BATCH' ),
+    ( SCons.Defaults.ShCXXAction, '$SHCXX -c $SHCXXFLAGS $SHCCFLAGS $_CPPFLAGS_BATCH' ),
+    ( SCons.Defaults.ShCAction,   '$SHCC -c $SHCFLAGS $SHCCFLAGS $_CPPFLAGS_BATCH' ),
+]
+
+
+def _batch_cmdgen( cmdgen ):
+    cmdgen = copy.copy( cmdgen )
+    for suffix, action in cmdgen.items():
+        for original, command in batch_commands:
+            if action is original:
+                batch_action = BatchCompileAction( command )
+                # The compiler always names its objects .o when given several sources
+                generator = BatchCompileGenerator( action, batch_action, '.o' )
+                cmdgen[suffix] = SCons.Action.CommandGeneratorAction( generator, {} )
+    return cmdgen
+
+
+def _batched_builder( builder ):
+    cmdgen = _batch_cmdgen( builder.cmdgen )
+    wrapped = copy.copy( builder.builder )
+    wrapped._memo = {}
+    wrapped.action = SCons.Action.CommandGeneratorAction( cmdgen, {} )
+    return SCons.Builder.CompositeBuilder( wrapped, cmdgen )
+
+
+_scan = SCons.Executor.Executor.scan
+
+def _scan_batches( executor, scanner, node_list ):
+    # Scan each batch on its own so that every object only depends on the
+    # headers its own source includes rather than those of the whole batch
+    if len( executor.batches ) < 2:
+        return _scan( executor, scanner, node_list )
+
+    batches = executor.batches
+    try:
+        for batch in batches:
+            executor.batches = [ batch ]
+            nodes = [ node for node in node_list if node in batch.sources or node in batch.targets ]
+            _scan( executor, scanner, nodes )
+    finally:
+        executor.batches = batches
+
+
+def install( env, include_flags ):
+    env['AbsoluteRDirs']   = AbsoluteRDirs()
+    env['_CPPFLAGS_BATCH'] = '$CPPFLAGS $_CPPDEFFLAGS ' + include_flags
+
+    for name in [ 'StaticObject', 'SharedObject' ]:
+        env['BUILDERS'][name] = _batched_builder( env['BUILDERS'][name] )
+
+    env['BUILDERS']['Object'] = env['BUILDERS']['StaticObject']
+
+    SCons.Executor.Executor.scan = _scan_batches
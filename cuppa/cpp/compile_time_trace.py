@@ -0,0 +1,303 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   CompileTimeTrace
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import re
+import json
+import atexit
+import threading
+
+# Cuppa
+from cuppa.output_processor import IncrementalSubProcess, SpawnedProcessor
+
+
+# Extensions of the per object reports, -ftime-report output is captured by
+# cuppa while -ftime-trace output is written by the compiler itself
+time_report_extension = '.time-report'
+time_trace_extension  = '.json'
+
+object_extensions = [ '.o', '.os', '.obj' ]
+
+
+def _object_of( args ):
+    for index, arg in enumerate( args ):
+        if arg == '-o' and index + 1 < len( args ):
+            return args[ index + 1 ]
+        if arg.startswith( '-o' ) and len( arg ) > 2:
+            return arg[2:]
+    return None
+
+
+def time_report_path( object_path ):
+    return object_path + time_report_extension
+
+
+def time_trace_path( object_path ):
+    return os.path.splitext( object_path )[0] + time_trace_extension
+
+
+def _is_time_trace( path ):
+    try:
+        with open( path ) as trace:
+            return '"traceEvents"' in trace.read( 64 )
+    except IOError:
+        return False
+
+
+def remove_traces( object_path ):
+    """Removes the reports of an earlier traced compile of an object so that
+    they are not taken for those of an object compiled without tracing"""
+    for path in [ time_report_path( object_path ), time_trace_path( object_path ) ]:
+        if os.path.exists( path ) and ( path.endswith( time_report_extension ) or _is_time_trace( path ) ):
+            os.remove( path )
+
+
+# The objects traced in this build, as only those are reported
+_traced_objects = set()
+_traced_lock    = threading.Lock()
+
+
+def _traced( object_path ):
+    with _traced_lock:
+        _traced_objects.add( os.path.abspath( object_path ) )
+
+
+
+class TimeReportFilter(object):
+    """Separates the -ftime-report section a compiler writes to stderr from its
+    other output so that it can be kept with the object rather than shown"""
+
+    _start = re.compile( r'^(Execution times|Time variable)' )
+    _entry = re.compile( r'^\s*\S.*?\s:\s' )
+    _total = re.compile( r'^\s*TOTAL\s*:' )
+
+    def __init__( self, processor=None ):
+        self._processor = processor
+        self._in_report = False
+        self.lines = []
+
+
+    def __call__( self, line ):
+        if self._start.match( line ):
+            self._in_report = True
+        if self._in_report and ( self._start.match( line ) or self._entry.match( line ) ):
+            self.lines.append( line )
+            if self._total.match( line ):
+                self._in_report = False
+            return None
+        self._in_report = False
+        if self._processor:
+            return self._processor( line )
+        return line
+
+
+
+class TimeReportSpawn(object):
+
+    def __init__( self, scons_env, spawn ):
+        self._scons_env = scons_env
+        self._spawn     = spawn
+
+
+    def __call__( self, sh, escape, cmd, args, env ):
+        arguments = [ arg.strip('"') for arg in args ]
+        object_path = _object_of( arguments )
+        if not object_path or os.path.splitext( object_path )[1] not in object_extensions:
+            return self._spawn( sh, escape, cmd, args, env )
+
+        remove_traces( object_path )
+
+        if '-ftime-trace' in arguments:
+            _traced( object_path )
+            return self._spawn( sh, escape, cmd, args, env )
+        elif '-ftime-report' not in arguments:
+            return self._spawn( sh, escape, cmd, args, env )
+
+        _traced( object_path )
+
+        processor = None
+        if not self._scons_env['raw_output']:
+            processor = SpawnedProcessor( self._scons_env )
+
+        stdout_filter = processor and processor.process or None
+        stderr_filter = TimeReportFilter( stdout_filter )
+
+        returncode = IncrementalSubProcess.Popen2(
+            stdout_filter,
+            stderr_filter,
+            arguments,
+            env=env
+        )
+
+        if processor:
+            summary = processor.summary( returncode )
+            if summary:
+                print summary
+
+        if stderr_filter.lines:
+            with open( time_report_path( object_path ), 'w' ) as report:
+                report.write( '\n'.join( stderr_filter.lines ) + '\n' )
+
+        return returncode
+
+
+
+def parse_time_report( text ):
+    """Returns the wall time in seconds of each entry of an -ftime-report, and
+    of the whole compile"""
+    entries = {}
+    total   = 0.0
+    for line in text.splitlines():
+        name, separator, times = line.partition( ':' )
+        name = name.strip()
+        if not separator or not name or name.startswith( 'Time variable' ) or name.startswith( 'Execution times' ):
+            continue
+        wall = re.search( r'([\d.]+)\s*\(\s*\d+%\)\s*wall', times )
+        if wall:
+            wall = float( wall.group(1) )
+        else:
+            # usr, sys and wall are the only columns with fractions
+            columns = re.findall( r'\d+\.\d+', times )
+            if len( columns ) < 3:
+                continue
+            wall = float( columns[2] )
+        if name == 'TOTAL':
+            total = wall
+        else:
+            entries[name] = entries.get( name, 0.0 ) + wall
+    return entries, total
+
+
+def parse_time_trace( trace ):
+    """Returns the phase, header and template instantiation times in seconds
+    recorded in a -ftime-trace, and the time of the whole compile"""
+    phases    = {}
+    headers   = {}
+    templates = {}
+    total     = 0.0
+    for event in trace.get( 'traceEvents', [] ):
+        if event.get( 'ph' ) != 'X':
+            continue
+        name     = event.get( 'name', '' )
+        duration = event.get( 'dur', 0 ) / 1000000.0
+        detail   = event.get( 'args', {} ).get( 'detail' )
+        if name.startswith( 'Total ' ):
+            phases[ name[6:] ] = phases.get( name[6:], 0.0 ) + duration
+            if name == 'Total ExecuteCompiler':
+                total = duration
+        elif name == 'Source' and detail:
+            headers[detail] = headers.get( detail, 0.0 ) + duration
+        elif name.startswith( 'Instantiate' ) and detail:
+            templates[detail] = templates.get( detail, 0.0 ) + duration
+    return phases, headers, templates, total
+
+
+
+class CompileTimeTrace(object):
+
+    _sections = [
+        ( 'units',     "Translation Units" ),
+        ( 'phases',    "Phases" ),
+        ( 'headers',   "Headers (inclusive parse time)" ),
+        ( 'templates', "Template Instantiations" ),
+    ]
+
+    def __init__( self, object_paths ):
+        self._object_paths = object_paths
+        self.units     = {}
+        self.phases    = {}
+        self.headers   = {}
+        self.templates = {}
+
+
+    @classmethod
+    def _add( cls, totals, times ):
+        for name, seconds in times.items():
+            entry = totals.setdefault( name, [ 0.0, 0 ] )
+            entry[0] += seconds
+            entry[1] += 1
+
+
+    def collect( self ):
+        for object_path in sorted( self._object_paths ):
+            if not os.path.exists( object_path ):
+                continue
+            if os.path.exists( time_report_path( object_path ) ):
+                with open( time_report_path( object_path ) ) as report:
+                    phases, total = parse_time_report( report.read() )
+                headers, templates = {}, {}
+            elif os.path.exists( time_trace_path( object_path ) ):
+                try:
+                    with open( time_trace_path( object_path ) ) as trace:
+                        phases, headers, templates, total = parse_time_trace( json.load( trace ) )
+                except ValueError:
+                    continue
+            else:
+                continue
+
+            self._add( self.units, { os.path.relpath( object_path ): total } )
+            self._add( self.phases, phases )
+            self._add( self.headers, headers )
+            self._add( self.templates, templates )
+        return self
+
+
+    def _sorted( self, totals ):
+        return sorted( totals.items(), key=lambda item: ( -item[1][0], item[0] ) )
+
+
+    def as_json( self ):
+        report = { 'translation_units': len( self.units ) }
+        for key, title in self._sections:
+            report[key] = [ { 'name': name, 'seconds': round( seconds, 6 ), 'count': count }
+                            for name, ( seconds, count ) in self._sorted( getattr( self, key ) ) ]
+        return report
+
+
+    def as_text( self, rows=25 ):
+        lines = [ "Compile time trace of {} translation units".format( len( self.units ) ) ]
+        for key, title in self._sections:
+            totals = getattr( self, key )
+            if not totals:
+                continue
+            lines += [ "", "{:<80} {:>12} {:>8}".format( title, "Wall (s)", "Count" ), "-" * 102 ]
+            for name, ( seconds, count ) in self._sorted( totals )[:rows]:
+                if len( name ) > 80:
+                    name = "..." + name[-77:]
+                lines.append( "{:<80} {:>12.3f} {:>8}".format( name, seconds, count ) )
+        return '\n'.join( lines ) + '\n'
+
+
+    def write( self, path ):
+        with open( path + '.txt', 'w' ) as text:
+            text.write( self.as_text() )
+        with open( path + '.json', 'w' ) as report:
+            json.dump( self.as_json(), report, indent=2, sort_keys=True )
+
+
+
+def install_capture( env ):
+    env['SPAWN'] = TimeReportSpawn( env, env['SPAWN'] )
+
+
+def install_report( build_root ):
+    path = os.path.join( build_root, 'compile-time-trace' )
+
+    def report():
+        with _traced_lock:
+            object_paths = set( _traced_objects )
+        trace = CompileTimeTrace( object_paths ).collect()
+        if not trace.units:
+            return
+        trace.write( path )
+        print "cuppa: compile time trace: {} translation units reported in [{}.txt] and [{}.json]".format(
+                len( trace.units ), os.path.relpath( path ), os.path.relpath( path ) )
+
+    atexit.register( report )
@@ -144,6 +144,7 @@ def get_build_identity_header( namespace_guard, namespaces ):
     lines += [ function_declaration_from_variable( 'product_version' ) ]
     lines += [ function_declaration_from_variable( 'product_revision' ) ]
     lines += [ function_declaration_from_variable( 'build_variant' ) ]
+    lines += [ function_declaration_from_variable( 'build_target' ) ]
     lines += [ function_declaration_from_variable( 'build_time' ) ]
     lines += [ function_declaration_from_variable( 'build_user' ) ]
     lines += [ function_declaration_from_variable( 'build_host' ) ]
@@ -202,6 +203,7 @@ class CreateVersionFileCpp:
             self.__revision = scm_system.revision( self.__location )
 
         self.__variant = self.__env['variant'].name()
+        self.__target  = self.__env.get( 'build_target', 'generic' )
 
 
     def __call__( self, target, source, env ):
@@ -285,6 +287,7 @@ class CreateVersionFileCpp:
                    '           "  +- Revision = " << identity::product_revision() << "\\n"\n'
                    '           "Build:\\n"\n'
                    '           "  |- Variant  = " << identity::build_variant()    << "\\n"\n'
+                   '           "  |- Target   = " << identity::build_target()     << "\\n"\n'
                    '           "  |- Time     = " << identity::build_time()       << "\\n"\n'
                    '           "  |- User     = " << identity::build_user()       << "\\n"\n'
                    '           "  +- Host     = " << identity::build_host()       << "\\n";\n'
@@ -358,6 +361,7 @@ class CreateVersionFileCpp:
         lines += [ self.function_definition_from_variable( 'product_revision', self.__revision ) ]
 
         lines += [ self.function_definition_from_variable( 'build_variant', self.__variant ) ]
+        lines += [ self.function_definition_from_variable( 'build_target', self.__target ) ]
         lines += [ self.function_definition_from_variable( 'build_time', build_time ) ]
         lines += [ self.function_definition_from_variable( 'build_user', build_user ) ]
         lines += [ self.function_definition_from_variable( 'build_host', build_host ) ]
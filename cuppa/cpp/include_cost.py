@@ -0,0 +1,288 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   IncludeCost
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import re
+import copy
+import json
+import atexit
+from subprocess import Popen, PIPE
+
+# Scons
+import SCons.Action
+import SCons.Builder
+
+
+includes_extension = '.includes'
+
+# Arguments that only make sense when producing an object, with the number of
+# values each takes
+object_only_args = {
+    '-c'             : 0,
+    '-o'             : 1,
+    '-MD'            : 0,
+    '-MMD'           : 0,
+    '-MP'            : 0,
+    '-MF'            : 1,
+    '-MT'            : 1,
+    '-MQ'            : 1,
+    '-ftime-report'  : 0,
+    '-ftime-trace'   : 0,
+}
+
+_linemarker = re.compile( r'^#\s+\d+\s+"((?:[^"\\]|\\.)*)"((?:\s+\d)*)\s*$' )
+
+
+def compile_command( object_node, env ):
+    """Returns the arguments of the command that compiles object_node. The
+    command is made again from the builder as the executor of an object is
+    released once it has been built."""
+    targets = [ object_node ]
+    sources = object_node.sources
+
+    action = object_node.builder.action
+    while isinstance( action, SCons.Action.CommandGeneratorAction ) and not isinstance( action, SCons.Action.LazyAction ):
+        action = action._generate( targets, sources, env, 0 )
+    if not isinstance( action, SCons.Action.CommandAction ):
+        return None
+
+    return [ str( arg ) for arg in action.process( targets, sources, env )[0][0] ]
+
+
+def without_object_args( command ):
+    """Removes the arguments of a compile command that only make sense when
+    producing an object"""
+    arguments = []
+    skip = 0
+    for arg in command:
+        if skip:
+            skip -= 1
+        elif arg in object_only_args:
+            skip = object_only_args[arg]
+        elif not arg.startswith( '-o' ):
+            arguments.append( arg )
+    return arguments
+
+
+def preprocess_command( object_node, env ):
+    """Turns the command that compiles object_node into one that writes its
+    preprocessed source to stdout"""
+    command = compile_command( object_node, env )
+    if not command:
+        return None
+    preprocess = without_object_args( command )
+    return preprocess[:1] + [ '-E' ] + preprocess[1:]
+
+
+def _is_file( path ):
+    return not path.startswith( '<' )
+
+
+def analyse_preprocessed( output ):
+    """Reads the linemarkers of preprocessed output to find, for each header,
+    the files that include it directly, the text it contributes itself and the
+    text it contributes together with everything it includes"""
+    headers = {}
+    stack   = []
+    total   = 0
+    source  = None
+
+    def header( path ):
+        return headers.setdefault( path, { 'self': 0, 'inclusive': 0, 'includers': set() } )
+
+    def leave():
+        path, start = stack.pop()
+        if path != source and _is_file( path ):
+            header( path )['inclusive'] += total - start
+
+    for line in output.splitlines( True ):
+        match = line.startswith( '#' ) and _linemarker.match( line )
+        if not match:
+            if stack and stack[-1][0] != source and _is_file( stack[-1][0] ):
+                header( stack[-1][0] )['self'] += len( line )
+            total += len( line )
+            continue
+
+        path  = match.group(1)
+        flags = match.group(2).split()
+        if _is_file( path ):
+            path = os.path.normpath( path )
+
+        if source is None:
+            source = path
+            stack.append( [ path, total ] )
+        elif '1' in flags:
+            parent = stack[-1][0]
+            stack.append( [ path, total ] )
+            if _is_file( path ):
+                header( path )['includers'].add( parent )
+        elif '2' in flags:
+            while len( stack ) > 1 and stack[-1][0] != path:
+                leave()
+        elif stack:
+            stack[-1][0] = path
+
+    while stack:
+        leave()
+
+    for details in headers.values():
+        details['includers'] = sorted( details['includers'] )
+    return { 'source': source, 'bytes': total, 'headers': headers }
+
+
+
+class AnalyseIncludes(object):
+
+    def __call__( self, target, source, env ):
+        command = preprocess_command( source[0], env )
+        if not command:
+            return None
+        try:
+            process = Popen( command, stdout=PIPE, stderr=PIPE )
+            output, errors = process.communicate()
+        except OSError, error:
+            print "cuppa: include cost: failed to preprocess [{}] with error [{}]".format( source[0], error )
+            return 1
+        if process.returncode != 0:
+            print "cuppa: include cost: failed to preprocess [{}]\n{}".format( source[0], errors )
+            return process.returncode
+
+        with open( target[0].abspath, 'w' ) as includes:
+            json.dump( analyse_preprocessed( output ), includes )
+        return None
+
+
+    @classmethod
+    def strfunction( cls, target, source, env ):
+        return "cuppa: include cost: [{}]".format( str( target[0] ) )
+
+
+
+class IncludeCostReport(object):
+
+    def __init__( self ):
+        self._includes = {}
+
+
+    def register( self, group, includes ):
+        self._includes.setdefault( group, set() ).add( includes )
+
+
+    @classmethod
+    def analyse( cls, paths ):
+        headers = {}
+        units = 0
+        for path in sorted( paths ):
+            if not os.path.exists( path ):
+                continue
+            with open( path ) as includes:
+                unit = json.load( includes )
+            units += 1
+            for name, details in unit['headers'].items():
+                entry = headers.setdefault( name, { 'units': 0, 'includers': set(), 'self': 0, 'inclusive': 0 } )
+                entry['units']     += 1
+                entry['self']      += details['self']
+                entry['inclusive'] += details['inclusive']
+                entry['includers'].update( details['includers'] )
+
+        ranked = []
+        for name, entry in headers.items():
+            ranked.append( {
+                'header'         : name,
+                'blast_radius'   : entry['units'],
+                'fan_in'         : len( entry['includers'] ),
+                'self_bytes'     : entry['self'] // entry['units'],
+                'inclusive_bytes': entry['inclusive'] // entry['units'],
+                'total_bytes'    : entry['inclusive'],
+            } )
+        ranked.sort( key=lambda entry: ( -entry['total_bytes'], entry['header'] ) )
+        return units, ranked
+
+
+    @classmethod
+    def as_text( cls, units, ranked ):
+        lines = [
+            "Include cost of {} translation units, ranked by the preprocessed text each header brings in".format( units ),
+            "",
+            "{:<70} {:>8} {:>7} {:>12} {:>12} {:>14}".format(
+                    "Header", "Rebuilds", "Fan-in", "Self (B)", "Per TU (B)", "Total (B)" ),
+            "-" * 128,
+        ]
+        for entry in ranked:
+            header = entry['header']
+            if len( header ) > 70:
+                header = "..." + header[-67:]
+            lines.append( "{:<70} {:>8} {:>7} {:>12} {:>12} {:>14}".format(
+                    header,
+                    entry['blast_radius'],
+                    entry['fan_in'],
+                    entry['self_bytes'],
+                    entry['inclusive_bytes'],
+                    entry['total_bytes'] ) )
+        return '\n'.join( lines ) + '\n'
+
+
+    def write( self, build_root ):
+        for ( toolchain, variant ), paths in sorted( self._includes.items() ):
+            units, ranked = self.analyse( paths )
+            if not units:
+                continue
+            path = os.path.join( build_root, "include-cost-{}-{}".format( toolchain, variant ) )
+            with open( path + '.txt', 'w' ) as text:
+                text.write( self.as_text( units, ranked ) )
+            with open( path + '.json', 'w' ) as report:
+                json.dump( { 'translation_units': units, 'headers': ranked }, report, indent=2, sort_keys=True )
+            print "cuppa: include cost: {} headers of {} translation units ranked in [{}.txt] and [{}.json]".format(
+                    len( ranked ), units, os.path.relpath( path ), os.path.relpath( path ) )
+
+
+
+_report = IncludeCostReport()
+
+
+class IncludeCostEmitter(object):
+
+    def __init__( self ):
+        self._action = SCons.Action.Action( AnalyseIncludes(), strfunction=AnalyseIncludes.strfunction )
+
+
+    def __call__( self, target, source, env ):
+        group = ( env['toolchain'].name(), env['variant_dir'] )
+        for object_node in target:
+            includes = env.Command( object_node.abspath + includes_extension, object_node, self._action )
+            _report.register( group, includes[0].abspath )
+        return target, source
+
+
+def _analysed_builder( builder, emitter ):
+    if isinstance( builder, SCons.Builder.CompositeBuilder ):
+        return SCons.Builder.CompositeBuilder(
+                _analysed_builder( builder.builder, emitter ),
+                builder.cmdgen
+        )
+    builder = copy.copy( builder )
+    builder._memo = {}
+    if builder.emitter:
+        builder.emitter = SCons.Builder.ListEmitter( [ builder.emitter, emitter ] )
+    else:
+        builder.emitter = emitter
+    return builder
+
+
+def install( env ):
+    emitter = IncludeCostEmitter()
+    for name in [ 'StaticObject', 'SharedObject' ]:
+        env['BUILDERS'][name] = _analysed_builder( env['BUILDERS'][name], emitter )
+
+    env['BUILDERS']['Object'] = env['BUILDERS']['StaticObject']
+
+
+def install_report( build_root ):
+    atexit.register( _report.write, build_root )
@@ -0,0 +1,294 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   IncludePaths
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import sys
+import copy
+import json
+import atexit
+import cPickle
+
+# Scons
+import SCons.Action
+import SCons.Builder
+import SCons.Node
+
+# Cuppa
+from cuppa.cpp.include_scanner import depfile_from_object, read_depfile, stable_include_dirs
+
+
+def _within( path, directory ):
+    return path == directory or path.startswith( os.path.join( directory, '' ) )
+
+
+def _caller_variable( variable ):
+    # Find a variable, such as TARGET, in the frames of the subst() that is
+    # expanding the include flags, as SCons.Defaults.Variable_Method_Caller does
+    frame = sys._getframe( 1 )
+    while frame:
+        if variable in frame.f_locals and frame.f_locals[variable]:
+            return frame.f_locals[variable]
+        frame = frame.f_back
+    return None
+
+
+
+class IncludePathUsage(object):
+    """Records, for each object, the include folders on its command line and
+    those holding a file it depends on. A folder that satisfied an include
+    holds the included file, so folders holding no dependencies are unused."""
+
+    def __init__( self, path ):
+        self._path         = os.path.abspath( path )
+        self._objects      = {}
+        self._include_dirs = {}
+        self._usage        = {}
+        try:
+            with open( self._path, 'rb' ) as usage:
+                self._usage = cPickle.load( usage )
+        except ( IOError, EOFError, cPickle.UnpicklingError ):
+            pass
+        # Trimming uses what was known when the build started so that the
+        # command for an object does not change part way through a build
+        self._recorded = dict( self._usage )
+        self._trimmed   = set()
+        self._untrimmed = set()
+
+
+    def register( self, object_node, env ):
+        self._objects[ object_node.abspath ] = env
+
+
+    def record_include_dirs( self, object_path, directories ):
+        # The include flags are expanded in parts, and more than once
+        recorded = self._include_dirs.setdefault( object_path, [] )
+        for directory in directories:
+            if directory.abspath not in recorded:
+                recorded.append( directory.abspath )
+
+
+    @classmethod
+    def dependencies( cls, object_node ):
+        dependencies = set( node.abspath for node in object_node.implicit or [] if hasattr( node, 'abspath' ) )
+        depfile = depfile_from_object( object_node.abspath )
+        if os.path.exists( depfile ):
+            dependencies.update( os.path.abspath( dependency ) for dependency in read_depfile( depfile ) )
+        return dependencies
+
+
+    def update( self ):
+        for path, env in self._objects.items():
+            object_node = env.fs.File( path )
+            if object_node.get_state() == SCons.Node.failed:
+                # Next time compile with every include folder again in case
+                # the failure was caused by a folder that has been trimmed
+                self._usage.pop( path, None )
+                continue
+            include_dirs = self._include_dirs.get( path )
+            if not include_dirs or object_node.implicit is None or not os.path.exists( path ):
+                continue
+
+            stable_dirs  = stable_include_dirs( env )
+            dependencies = self.dependencies( object_node )
+
+            used = []
+            for directory in include_dirs:
+                if any( _within( directory, stable ) for stable in stable_dirs ):
+                    used.append( directory )
+                elif any( _within( dependency, directory ) for dependency in dependencies ):
+                    used.append( directory )
+            self._usage[path] = ( include_dirs, used )
+
+
+    def trimmed( self, object_path, directories ):
+        if object_path not in self._recorded or object_path in self._untrimmed:
+            return directories
+        known, used = self._recorded[ object_path ]
+        known = set( known )
+        used  = set( used )
+        # Folders added since the usage was recorded are always kept
+        kept = [ directory for directory in directories if directory.abspath in used or directory.abspath not in known ]
+        if len( kept ) < len( directories ):
+            self._trimmed.add( object_path )
+        return kept
+
+
+    def untrim( self, object_paths ):
+        """Stops trimming the include folders of any of object_paths that were
+        trimmed, and returns whether there were any"""
+        trimmed = [ path for path in object_paths if path in self._trimmed and path not in self._untrimmed ]
+        self._untrimmed.update( trimmed )
+        return bool( trimmed )
+
+
+    def save( self ):
+        directory = os.path.dirname( self._path )
+        if directory and not os.path.exists( directory ):
+            os.makedirs( directory )
+        temporary = self._path + '.tmp'
+        with open( temporary, 'wb' ) as usage:
+            cPickle.dump( self._usage, usage, cPickle.HIGHEST_PROTOCOL )
+        os.rename( temporary, self._path )
+
+
+    def report( self, path ):
+        directories = {}
+        objects = []
+        top = os.getcwd()
+        for object_path, ( include_dirs, used ) in sorted( self._usage.items() ):
+            if object_path not in self._objects:
+                continue
+            unused = [ directory for directory in include_dirs if directory not in used ]
+            objects.append( {
+                'object' : os.path.relpath( object_path, top ),
+                'unused' : [ os.path.relpath( directory, top ) for directory in unused ],
+                'used'   : [ os.path.relpath( directory, top ) for directory in used ],
+            } )
+            for directory in include_dirs:
+                entry = directories.setdefault( os.path.relpath( directory, top ), [ 0, 0 ] )
+                entry[0] += 1
+                if directory not in used:
+                    entry[1] += 1
+
+        if not objects:
+            return
+
+        ranked = sorted( directories.items(), key=lambda item: ( -item[1][1], item[0] ) )
+        lines = [
+            "Include folders of {} objects, ranked by the number of objects that do not use them".format( len( objects ) ),
+            "",
+            "{:<90} {:>8} {:>8}".format( "Include folder", "Objects", "Unused" ),
+            "-" * 108,
+        ]
+        for directory, ( count, unused ) in ranked:
+            name = len( directory ) > 90 and "..." + directory[-87:] or directory
+            lines.append( "{:<90} {:>8} {:>8}".format( name, count, unused ) )
+
+        with open( path + '.txt', 'w' ) as text:
+            text.write( '\n'.join( lines ) + '\n' )
+        with open( path + '.json', 'w' ) as report:
+            json.dump( {
+                    'include_folders': [ { 'folder': directory, 'objects': count, 'unused': unused }
+                                         for directory, ( count, unused ) in ranked ],
+                    'objects': objects
+                }, report, indent=2, sort_keys=True )
+
+        unused = sum( entry[1] for entry in directories.values() )
+        total  = sum( entry[0] for entry in directories.values() )
+        print "cuppa: include paths: {} of {} include folders on the command lines of {} objects are unused, see [{}.txt] and [{}.json]".format(
+                unused, total, len( objects ), os.path.relpath( path ), os.path.relpath( path ) )
+
+
+
+class RecordedRDirs(object):
+    """Used in place of RDirs when expanding include flags to record the
+    include folders on the command line of each object and, when trimming, to
+    leave out those that the object was last seen not to use"""
+
+    def __init__( self, usage, trim ):
+        self._usage = usage
+        self._trim  = trim
+
+
+    def __call__( self, paths ):
+        target = _caller_variable( 'TARGET' )
+        if not target:
+            return paths
+        # TARGET is a substitution proxy whose abspath is a wrapped string
+        object_path = str( target.abspath )
+        directories = target.RDirs( paths )
+        self._usage.record_include_dirs( object_path, directories )
+        if self._trim:
+            return self._usage.trimmed( object_path, directories )
+        return directories
+
+
+
+class UntrimmedRetryAction(SCons.Action.CommandGeneratorAction):
+    """Compiles an object with its trimmed include folders and, if that fails,
+    compiles it again at once with all of them, in case a folder it now needs
+    was trimmed. It otherwise behaves, and is signed, as the action it wraps."""
+
+    def __init__( self, action, usage ):
+        self.__dict__.update( action.__dict__ )
+        self._usage = usage
+
+
+    def __call__( self, target, source, env, *args, **kwargs ):
+        status = SCons.Action.CommandGeneratorAction.__call__( self, target, source, env, *args, **kwargs )
+        # The executor passes itself rather than the targets it is building
+        executor = kwargs.get( 'executor' )
+        targets  = executor and executor.get_all_targets() or target
+        if status and self._usage.untrim( [ str( node.abspath ) for node in targets ] ):
+            print "cuppa: include paths: compiling [{}] again with every include folder".format(
+                    ", ".join( str( node ) for node in targets ) )
+            status = SCons.Action.CommandGeneratorAction.__call__( self, target, source, env, *args, **kwargs )
+        return status
+
+
+
+class IncludePathEmitter(object):
+
+    def __init__( self, usage ):
+        self._usage = usage
+
+
+    def __call__( self, target, source, env ):
+        for object_node in target:
+            self._usage.register( object_node, env )
+        return target, source
+
+
+def _recorded_builder( builder, emitter, usage, trim ):
+    if isinstance( builder, SCons.Builder.CompositeBuilder ):
+        return SCons.Builder.CompositeBuilder(
+                _recorded_builder( builder.builder, emitter, usage, trim ),
+                builder.cmdgen
+        )
+    builder = copy.copy( builder )
+    builder._memo = {}
+    if trim and isinstance( builder.action, SCons.Action.CommandGeneratorAction ):
+        builder.action = UntrimmedRetryAction( builder.action, usage )
+    if builder.emitter:
+        builder.emitter = SCons.Builder.ListEmitter( [ builder.emitter, emitter ] )
+    else:
+        builder.emitter = emitter
+    return builder
+
+
+_usage = None
+
+def usage( build_root ):
+    global _usage
+    if not _usage:
+        _usage = IncludePathUsage( os.path.join( build_root, '.cuppa_include_paths' ) )
+        report_path = os.path.join( build_root, 'include-paths' )
+
+        def update():
+            _usage.update()
+            _usage.save()
+            _usage.report( report_path )
+
+        atexit.register( update )
+    return _usage
+
+
+def install( env, recorded_include_flags ):
+    include_path_usage = usage( env['build_root'] )
+    trim = env['include_paths'] == 'trim'
+
+    emitter = IncludePathEmitter( include_path_usage )
+    for name in [ 'StaticObject', 'SharedObject' ]:
+        env['BUILDERS'][name] = _recorded_builder( env['BUILDERS'][name], emitter, include_path_usage, trim )
+
+    env['BUILDERS']['Object'] = env['BUILDERS']['StaticObject']
+
+    env['RecordedRDirs'] = RecordedRDirs( include_path_usage, trim )
+    env['_CPPINCFLAGS']  = recorded_include_flags
@@ -0,0 +1,177 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   IncludeScanner
+#-------------------------------------------------------------------------------
+
+# python standard library imports
+import os
+import re
+import copy
+
+# scons imports
+import SCons.Builder
+import SCons.Scanner
+import SCons.Node.Python
+import SCons.Tool
+
+
+def depfile_from_object( object_file ):
+    return object_file + '.d'
+
+
+def read_depfile( depfile ):
+    with open( depfile ) as dependency_file:
+        content = dependency_file.read()
+
+    content = content.replace( '\\\n', ' ' )
+    rule = content.split( ': ', 1 )
+    if len(rule) < 2:
+        return []
+
+    dependencies = []
+    for dependency in re.split( r'(?<!\\)\s+', rule[1].strip() ):
+        if dependency:
+            dependencies.append( dependency.replace( '\\ ', ' ' ).replace( '$$', '$' ) )
+    return dependencies
+
+
+def _within( path, directories ):
+    for directory in directories:
+        if path == directory or path.startswith( os.path.join( directory, '' ) ):
+            return True
+    return False
+
+
+def stable_include_dirs( env ):
+    return [ env.Dir( directory ).abspath for directory in env.get( 'STABLE_INCPATH', [] ) ]
+
+
+class FindUnstablePathDirs(object):
+
+    def __init__( self, variable ):
+        self._find_path_dirs = SCons.Scanner.FindPathDirs( variable )
+
+
+    def __call__( self, env, dir=None, target=None, source=None ):
+        stable_dirs = stable_include_dirs( env )
+        return tuple(
+            directory for directory in self._find_path_dirs( env, dir, target, source )
+                if not _within( directory.abspath, stable_dirs )
+        )
+
+
+class StampedScanner(object):
+
+    def __init__( self ):
+        self._stamps = {}
+
+
+    def stamps( self, env ):
+        stamps = []
+        for stamp in env.get( 'STABLE_INCPATH_STAMPS', [] ):
+            if stamp not in self._stamps:
+                self._stamps[stamp] = SCons.Node.Python.Value( stamp )
+            stamps.append( self._stamps[stamp] )
+        return stamps
+
+
+class HeaderScanner(SCons.Scanner.Base, StampedScanner):
+
+    def __init__( self ):
+        SCons.Scanner.Base.__init__(
+                self,
+                self._scan,
+                name          = "HeaderScanner",
+                path_function = FindUnstablePathDirs( 'CPPPATH' ),
+                node_class    = None )
+        StampedScanner.__init__( self )
+        self._include_scanner = SCons.Scanner.ClassicCPP(
+                "IncludeScanner",
+                "$CPPSUFFIXES",
+                "CPPPATH",
+                '^[ \t]*#[ \t]*(?:include|import)[ \t]*(<|")([^>"]+)(>|")' )
+
+
+    def _scan( self, node, env, path ):
+        # Return the whole closure in a canonical order so that switching to
+        # the depfile scanner once a depfile exists does not look like a change
+        dependencies = node.get_implicit_deps( env, self._include_scanner, path )
+        return sorted( dependencies, key=str ) + self.stamps( env )
+
+
+class DepfileScanner(SCons.Scanner.Base, StampedScanner):
+
+    def __init__( self, object_suffix ):
+        SCons.Scanner.Base.__init__(
+                self,
+                self._scan,
+                name          = "DepfileScanner",
+                path_function = FindUnstablePathDirs( 'CPPPATH' ),
+                node_class    = None )
+        StampedScanner.__init__( self )
+        self._object_suffix = object_suffix
+
+
+    def depfile( self, node ):
+        return depfile_from_object( os.path.splitext( node.path )[0] + self._object_suffix )
+
+
+    def _scan( self, node, env, path ):
+        source = node.srcnode().abspath
+        include_dirs = [ directory.abspath for directory in path ]
+        stable_dirs = stable_include_dirs( env )
+        top = env.fs.Top
+
+        dependencies = []
+        for dependency in read_depfile( self.depfile( node ) ):
+            if os.path.isabs( dependency ) and not _within( dependency, include_dirs ):
+                continue
+            dependency = env.fs.File( dependency, top )
+            if dependency.abspath != source and not _within( dependency.abspath, stable_dirs ):
+                dependencies.append( dependency )
+        return sorted( set( dependencies ), key=str ) + self.stamps( env )
+
+
+class IncludeScanner(object):
+
+    def __init__( self, source_scanner, object_suffix, use_depfiles ):
+        self._source_scanner  = source_scanner
+        self._header_scanner  = HeaderScanner()
+        self._depfile_scanner = use_depfiles and DepfileScanner( object_suffix ) or None
+
+
+    def select( self, node ):
+        scanner = self._source_scanner.select( node )
+        if scanner is SCons.Tool.CScanner:
+            if self._depfile_scanner and os.path.exists( self._depfile_scanner.depfile( node ) ):
+                return self._depfile_scanner
+            return self._header_scanner
+        return scanner
+
+
+def _scanned_builder( builder, object_suffix, use_depfiles ):
+    if isinstance( builder, SCons.Builder.CompositeBuilder ):
+        return SCons.Builder.CompositeBuilder(
+                _scanned_builder( builder.builder, object_suffix, use_depfiles ),
+                builder.cmdgen
+        )
+    builder = copy.copy( builder )
+    builder._memo = {}
+    builder.source_scanner = IncludeScanner( builder.source_scanner, object_suffix, use_depfiles )
+    return builder
+
+
+def install( env, use_depfiles ):
+    object_builders = [
+        ( 'StaticObject', '$OBJSUFFIX' ),
+        ( 'SharedObject', '$SHOBJSUFFIX' ),
+    ]
+
+    for name, suffix in object_builders:
+        env['BUILDERS'][name] = _scanned_builder( env['BUILDERS'][name], env.subst( suffix ), use_depfiles )
+
+    env['BUILDERS']['Object'] = env['BUILDERS']['StaticObject']
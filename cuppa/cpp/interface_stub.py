@@ -0,0 +1,123 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   InterfaceStub
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import re
+import hashlib
+from subprocess import Popen, PIPE
+
+# Scons
+import SCons.Node
+
+
+def _run( command ):
+    try:
+        process = Popen( command, stdout=PIPE, stderr=PIPE )
+        output = process.communicate()[0]
+        return process.returncode, output
+    except OSError:
+        return None, ""
+
+
+def _dynamic_section( path ):
+    returncode, output = _run( [ 'readelf', '--dynamic', '-W', path ] )
+    if returncode != 0:
+        return None
+    entries = []
+    for match in re.finditer( r'\((SONAME|NEEDED)\)\s+.*\[(.*)\]', output ):
+        entries.append( "{} {}".format( match.group(1), match.group(2) ) )
+    return entries
+
+
+def _dynamic_symbols( path ):
+    returncode, output = _run( [ 'readelf', '--dyn-syms', '-W', path ] )
+    if returncode != 0:
+        return None
+    symbols = []
+    for line in output.splitlines():
+        # Num: Value Size Type Bind Vis Ndx Name
+        fields = line.split()
+        if len( fields ) < 8 or not fields[0][:-1].isdigit() or fields[6] == 'UND':
+            continue
+        size, type, bind, name = fields[2], fields[3], fields[4], fields[7]
+        if type == 'OBJECT' or type == 'TLS':
+            # Programs can hold copies of data so their size is part of the interface
+            symbols.append( "{} {} {} {}".format( name, type, bind, size ) )
+        else:
+            symbols.append( "{} {} {}".format( name, type, bind ) )
+    return sorted( symbols )
+
+
+def interface_of( path ):
+    """Returns the lines that describe what programs linked against the shared
+    library at path depend on, or None if they cannot be read"""
+    dynamic_section = _dynamic_section( path )
+    dynamic_symbols = _dynamic_symbols( path )
+    if dynamic_section is None or dynamic_symbols is None:
+        return None
+    return dynamic_section + dynamic_symbols
+
+
+
+class WriteInterfaceStub(object):
+
+    def __call__( self, target, source, env ):
+        for stub, library in zip( target, source ):
+            interface = interface_of( library.abspath )
+            if interface is None:
+                # Without the interface every change to the library has to be
+                # treated as a change to its interface
+                interface = [ "CONTENT " + hashlib.md5( library.get_contents() ).hexdigest() ]
+            with open( stub.abspath, 'w' ) as stub_file:
+                stub_file.write( '\n'.join( interface ) + '\n' )
+        return None
+
+
+    @classmethod
+    def strfunction( cls, target, source, env ):
+        return "cuppa: interface stub: [{}]".format( str( target[0] ) )
+
+
+
+def add_interface_stub( env, library ):
+    """Generates an interface stub beside each shared library node so that
+    programs can depend on the interface of a library rather than its content"""
+    action = env.Action( WriteInterfaceStub(), strfunction=WriteInterfaceStub.strfunction )
+    for node in library:
+        stub = env.Command( node.abspath + '.abi', node, action )
+        node.attributes.interface_stub = stub[0]
+    return library
+
+
+def interface_stub_of( library ):
+    if isinstance( library, SCons.Node.Node ):
+        return getattr( library.attributes, 'interface_stub', None )
+    return None
+
+
+def link_through_interface_stubs( env, target, libraries ):
+    """Makes target depend on the interface stubs of the shared libraries it
+    links with so that it is only relinked when one of their interfaces
+    changes. Returns the libraries that were linked this way."""
+    stubbed = []
+    for library in libraries:
+        stub = interface_stub_of( library )
+        if stub:
+            env.Ignore( target, library )
+            env.Depends( target, stub )
+            stubbed.append( library )
+    for node in target:
+        node.attributes.stubbed_libraries = stubbed
+    return stubbed
+
+
+def stubbed_libraries_of( target ):
+    if isinstance( target, SCons.Node.Node ):
+        return getattr( target.attributes, 'stubbed_libraries', [] )
+    return []
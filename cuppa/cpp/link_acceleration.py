@@ -0,0 +1,91 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   LinkAcceleration
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import shutil
+import tempfile
+from subprocess import Popen, PIPE, STDOUT
+
+
+linker_signatures = {
+    'gold' : 'GNU gold',
+    'lld'  : 'LLD',
+}
+
+
+def _run( command, cwd=None ):
+    try:
+        process = Popen( command, stdout=PIPE, stderr=STDOUT, cwd=cwd )
+        output = process.communicate()[0]
+        return process.returncode, output
+    except OSError:
+        return None, ""
+
+
+def linker_available( cxx, linker ):
+    returncode, output = _run( [ cxx, '-fuse-ld=' + linker, '-Wl,--version' ] )
+    return returncode == 0 and linker_signatures[linker] in output
+
+
+def split_dwarf_available( cxx ):
+    working_dir = tempfile.mkdtemp()
+    try:
+        with open( os.path.join( working_dir, 'probe.cpp' ), 'w' ) as source:
+            source.write( "int probe() { return 0; }\n" )
+        returncode, output = _run( [ cxx, '-g', '-gsplit-dwarf', '-c', 'probe.cpp', '-o', 'probe.o' ], cwd=working_dir )
+        return returncode == 0 and os.path.exists( os.path.join( working_dir, 'probe.dwo' ) )
+    finally:
+        shutil.rmtree( working_dir, ignore_errors=True )
+
+
+def thin_archives_available( ar ):
+    returncode, output = _run( [ ar, '--version' ] )
+    return returncode == 0 and ( 'GNU ar' in output or 'LLVM' in output )
+
+
+
+class LinkAcceleration(object):
+
+    def __init__( self, cxx, linkers, ar='ar' ):
+        self.linker = None
+        for linker in linkers:
+            if linker_available( cxx, linker ):
+                self.linker = linker
+                break
+
+        self.split_dwarf   = split_dwarf_available( cxx )
+        self.thin_archives = thin_archives_available( ar )
+
+
+    def compile_flags( self ):
+        return self.split_dwarf and [ '-gsplit-dwarf' ] or []
+
+
+    def link_flags( self ):
+        if not self.linker:
+            return []
+        return [ '-fuse-ld=' + self.linker, '-Wl,--gdb-index' ]
+
+
+    def archive_flags( self ):
+        return self.thin_archives and 'rcT' or None
+
+
+    def description( self ):
+        settings = []
+        if self.linker:
+            settings.append( "the [{}] linker with a gdb index".format( self.linker ) )
+        else:
+            settings.append( "the default linker as neither of gold or lld is available" )
+        if self.split_dwarf:
+            settings.append( "split DWARF for dbg builds" )
+        if self.thin_archives:
+            settings.append( "thin archives" )
+        return ", ".join( settings )
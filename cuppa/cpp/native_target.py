@@ -0,0 +1,105 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   NativeTarget
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import re
+from subprocess import Popen, PIPE, STDOUT
+
+
+# Features required for each x86-64 micro-architecture level, using the names
+# reported in /proc/cpuinfo. Each level also requires all the previous ones.
+x86_64_levels = [
+    ( 'x86-64-v2', [ 'cx16', 'lahf_lm', 'popcnt', 'pni', 'sse4_1', 'sse4_2', 'ssse3' ] ),
+    ( 'x86-64-v3', [ 'avx', 'avx2', 'bmi1', 'bmi2', 'f16c', 'fma', 'abm', 'movbe', 'xsave' ] ),
+    ( 'x86-64-v4', [ 'avx512f', 'avx512bw', 'avx512cd', 'avx512dq', 'avx512vl' ] ),
+]
+
+
+def _run( command ):
+    try:
+        process = Popen( command, stdout=PIPE, stderr=STDOUT, stdin=PIPE )
+        output = process.communicate( "" )[0]
+        return process.returncode, output
+    except OSError:
+        return None, ""
+
+
+def cpu_features( cpuinfo='/proc/cpuinfo' ):
+    try:
+        with open( cpuinfo ) as info:
+            for line in info:
+                key, separator, value = line.partition( ':' )
+                if key.strip() in [ 'flags', 'Features' ]:
+                    return set( value.split() )
+    except IOError:
+        pass
+    return set()
+
+
+def isa_level( features ):
+    if 'lm' not in features:
+        return None
+    level = 'x86-64'
+    for name, required in x86_64_levels:
+        if not all( feature in features for feature in required ):
+            break
+        level = name
+    return level
+
+
+def _gcc_target( cxx ):
+    returncode, output = _run( [ cxx, '-march=native', '-Q', '--help=target' ] )
+    if returncode != 0:
+        return None, None
+    march = re.search( r'^\s+-march=\s+(\S+)', output, re.MULTILINE )
+    mtune = re.search( r'^\s+-mtune=\s+(\S+)', output, re.MULTILINE )
+    return march and march.group(1), mtune and mtune.group(1)
+
+
+def _clang_target( cxx ):
+    # clang does not support -Q --help=target so read the CPU that -march=native
+    # resolves to from the driver's job description instead
+    returncode, output = _run( [ cxx, '-march=native', '-###', '-E', '-x', 'c++', '-' ] )
+    if returncode != 0:
+        return None, None
+    cpu = re.search( r'"-target-cpu" "([^"]+)"', output )
+    return cpu and cpu.group(1), cpu and cpu.group(1)
+
+
+def compiler_target( cxx ):
+    march, mtune = _gcc_target( cxx )
+    if not march or march == 'native':
+        march, mtune = _clang_target( cxx )
+    return march, mtune
+
+
+
+class NativeTarget(object):
+
+    def __init__( self, cxx ):
+        self.march, self.mtune = compiler_target( cxx )
+        self.features = cpu_features()
+        self.level = isa_level( self.features ) or self.march
+
+
+    def available( self ):
+        return bool( self.march )
+
+
+    def compile_flags( self ):
+        # Use the resolved names rather than 'native' so the command line, and
+        # therefore the build signature, records exactly what was targeted
+        flags = [ '-march=' + self.march ]
+        if self.mtune:
+            flags.append( '-mtune=' + self.mtune )
+        return flags
+
+
+    def identity( self ):
+        return "{} (march={}, mtune={})".format( self.level, self.march, self.mtune or self.march )
@@ -0,0 +1,96 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   ProfileGuided
+#-------------------------------------------------------------------------------
+
+import os
+import glob
+import shutil
+
+
+def objects_of( program ):
+    return [ source for source in program[0].sources if source.has_builder() ]
+
+
+def _remove( paths ):
+    for path in paths:
+        if os.path.exists( path ):
+            os.remove( path )
+
+
+
+class RemoveProfiles(object):
+
+    def __init__( self, profiles ):
+        self._profiles = profiles
+
+
+    def __call__( self, target, source, env ):
+        for profiles in self._profiles:
+            _remove( glob.glob( profiles ) )
+        return None
+
+
+
+class CopyGcda(object):
+
+    def __init__( self, training_profiles ):
+        self._training_profiles = training_profiles
+
+
+    def __call__( self, target, source, env ):
+        for training_profile, profile in zip( self._training_profiles, target ):
+            if os.path.exists( training_profile ):
+                shutil.copyfile( training_profile, profile.abspath )
+            else:
+                # The object was never executed during training
+                _remove( [ profile.abspath ] )
+        return None
+
+
+
+class MergeGcda(object):
+
+    def __call__( self, env, training, training_program, program, profile_dir ):
+        training_profiles = []
+        profiles = []
+        for training_object, use_object in zip( objects_of( training_program ), objects_of( program ) ):
+            training_profiles.append( os.path.splitext( training_object.abspath )[0] + '.gcda' )
+            profiles.append( os.path.splitext( use_object.abspath )[0] + '.gcda' )
+            env.Depends( use_object, profiles[-1] )
+
+        env.AddPreAction( training, RemoveProfiles( training_profiles ) )
+
+        # Training output can be unchanged when the profiles are not, so always
+        # refresh them and let content signatures decide what to rebuild
+        profiles = env.Command( profiles, training, CopyGcda( training_profiles ) )
+        env.AlwaysBuild( profiles )
+        return profiles
+
+
+
+class MergeProfraw(object):
+
+    def __init__( self, profdata ):
+        self._profdata = profdata
+
+
+    def __call__( self, env, training, training_program, program, profile_dir ):
+        raw_profiles = os.path.join( profile_dir, '*.profraw' )
+        env.AddPreAction( training, RemoveProfiles( [ raw_profiles ] ) )
+
+        profile = env.Command(
+                env['PGO_PROFILE'],
+                training,
+                "{} merge -output=$TARGET {}".format( self._profdata, raw_profiles ) )
+
+        env.AlwaysBuild( profile )
+
+        for use_object in objects_of( program ):
+            env.Depends( use_object, profile )
+
+        return profile
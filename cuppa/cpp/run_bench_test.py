@@ -0,0 +1,400 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   RunBenchTest
+#-------------------------------------------------------------------------------
+
+import os
+import sys
+import re
+import json
+import math
+import atexit
+import cPickle
+import threading
+
+import cuppa.test_limits
+import cuppa.test_history
+from cuppa.output_processor import IncrementalSubProcess, write_atomically
+from cuppa.cpp.run_process_test import stdout_from_program, stderr_from_program
+
+
+def bench_report_from_program( program_file ):
+    return program_file + '.bench.json'
+
+
+
+class RunBenchTestEmitter:
+
+    def __init__( self, final_dir ):
+        self._final_dir = final_dir
+
+
+    def __call__( self, target, source, env ):
+        program_file = self._final_dir + os.path.split( source[0].path )[1]
+        target = []
+        target.append( stdout_from_program( program_file ) )
+        target.append( stderr_from_program( program_file ) )
+        target.append( bench_report_from_program( program_file ) )
+        return target, source
+
+
+
+def is_google_benchmark( executable ):
+    """Google Benchmark programs name their --benchmark_format flag in the
+    program itself"""
+    flag    = 'benchmark_format'
+    overlap = ''
+    try:
+        with open( executable, 'rb' ) as program:
+            for chunk in iter( lambda: program.read( 1024 * 1024 ), '' ):
+                if flag in overlap + chunk:
+                    return True
+                overlap = chunk[ -len( flag ): ]
+    except IOError:
+        pass
+    return False
+
+
+_time_units = {
+    'ns': 1,
+    'us': 1000,
+    'ms': 1000000,
+    's' : 1000000000,
+}
+
+
+def parse_google_benchmark( lines ):
+    """Returns the real time, in nanoseconds, of each benchmark in the JSON
+    output of a Google Benchmark program"""
+    results = {}
+    output  = json.loads( "\n".join( lines ) )
+    for benchmark in output.get( 'benchmarks', [] ):
+        # Aggregates, such as the mean of repetitions, are not runs, and runs
+        # that failed have no time
+        if benchmark.get( 'run_type', 'iteration' ) != 'iteration' or 'real_time' not in benchmark:
+            continue
+        unit = _time_units.get( benchmark.get( 'time_unit', 'ns' ), 1 )
+        results.setdefault( benchmark['name'], [] ).append( float( benchmark['real_time'] ) * unit )
+    return dict( ( name, sum( times ) / len( times ) ) for name, times in results.items() )
+
+
+_key_value = re.compile( r'^\s*(?P<key>[^=\s][^=]*?)\s*=\s*(?P<value>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$' )
+
+
+def parse_key_values( lines ):
+    """Returns the value of each line of the form 'name = value', where value
+    is a number, in the output of a benchmark"""
+    results = {}
+    for line in lines:
+        matches = _key_value.match( line )
+        if matches:
+            results[ matches.group('key') ] = float( matches.group('value') )
+    return results
+
+
+
+# The 97.5% quantile of Student's t distribution for 1 to 30 degrees of freedom
+_t_quantiles = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+     2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+     2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def t_quantile( degrees_of_freedom ):
+    degrees = int( degrees_of_freedom )
+    if degrees < 1:
+        return None
+    if degrees <= len( _t_quantiles ):
+        return _t_quantiles[ degrees - 1 ]
+    return 1.960
+
+
+def mean( samples ):
+    return float( sum( samples ) ) / len( samples )
+
+
+def variance( samples ):
+    if len( samples ) < 2:
+        return 0.0
+    centre = mean( samples )
+    return sum( ( sample - centre ) ** 2 for sample in samples ) / ( len( samples ) - 1 )
+
+
+def summarise( samples ):
+    """The mean of the samples with the half width of its 95% confidence
+    interval, which is None for a single sample"""
+    quantile = t_quantile( len( samples ) - 1 )
+    stddev   = math.sqrt( variance( samples ) )
+    return {
+        'runs'  : len( samples ),
+        'mean'  : mean( samples ),
+        'stddev': stddev,
+        'ci95'  : quantile and quantile * stddev / math.sqrt( len( samples ) ),
+    }
+
+
+def compare( samples, baseline ):
+    """Compares the mean of the samples with that of the baseline samples by
+    the 95% confidence interval of their difference, using Welch's t-test, as
+    fractions of the baseline mean. Benchmarks are taken to be costs, so a
+    larger value is slower."""
+    if len( samples ) < 2 or len( baseline ) < 2:
+        return None
+    current_mean  = mean( samples )
+    baseline_mean = mean( baseline )
+    if not baseline_mean:
+        return None
+
+    current_error  = variance( samples ) / len( samples )
+    baseline_error = variance( baseline ) / len( baseline )
+    error          = current_error + baseline_error
+    difference     = current_mean - baseline_mean
+
+    if error:
+        degrees = error ** 2 / (
+                current_error ** 2 / ( len( samples ) - 1 ) + baseline_error ** 2 / ( len( baseline ) - 1 ) )
+        half_width = t_quantile( degrees ) * math.sqrt( error )
+    else:
+        half_width = 0.0
+
+    low, high = difference - half_width, difference + half_width
+    if low > 0:
+        verdict = 'slower'
+    elif high < 0:
+        verdict = 'faster'
+    else:
+        verdict = 'unchanged'
+
+    return {
+        'change'     : difference / baseline_mean,
+        'change_ci95': [ low / baseline_mean, high / baseline_mean ],
+        'verdict'    : verdict,
+    }
+
+
+
+class BenchBaselines(object):
+    """The samples of each benchmark that later runs are compared with, kept
+    between builds for each toolchain and variant a benchmark is built with"""
+
+    def __init__( self, path ):
+        self._path      = os.path.abspath( path )
+        self._baselines = {}
+        self._changed   = False
+        self._lock      = threading.Lock()
+        try:
+            with open( self._path, 'rb' ) as baselines:
+                self._baselines = cPickle.load( baselines )
+        except ( IOError, EOFError, cPickle.UnpicklingError ):
+            pass
+
+
+    def get( self, key ):
+        with self._lock:
+            return self._baselines.get( key )
+
+
+    def set( self, key, samples ):
+        with self._lock:
+            self._baselines[key] = samples
+            self._changed = True
+
+
+    def save( self ):
+        with self._lock:
+            if not self._changed:
+                return
+            directory = os.path.dirname( self._path )
+            if directory and not os.path.exists( directory ):
+                os.makedirs( directory )
+            temporary = self._path + '.tmp'
+            with open( temporary, 'wb' ) as baselines:
+                cPickle.dump( self._baselines, baselines, cPickle.HIGHEST_PROTOCOL )
+            os.rename( temporary, self._path )
+            self._changed = False
+
+
+
+_baselines = None
+_baselines_lock = threading.Lock()
+
+
+def baselines( build_root ):
+    global _baselines
+    with _baselines_lock:
+        if not _baselines:
+            _baselines = BenchBaselines( os.path.join( build_root, '.cuppa_bench_baselines' ) )
+            atexit.register( _baselines.save )
+        return _baselines
+
+
+
+class BenchOutput:
+
+    def __init__( self, log ):
+        self.log   = log
+        self.lines = []
+
+
+    def __call__( self, line ):
+        self.log.write( line + '\n' )
+        self.lines.append( line )
+
+
+
+class RunBenchTest:
+
+    # Benchmarks are run on their own, after the tasks that can run before them
+    exclusive = True
+
+    def __init__( self, expected ):
+        self._expected = expected
+
+
+    def __call__( self, target, source, env ):
+
+        executable   = str( source[0].abspath )
+        working_dir  = os.path.split( executable )[0]
+        program_path = source[0].path
+        colouriser   = env['colouriser']
+
+        google       = is_google_benchmark( executable )
+        test_command = [ executable ] + ( google and [ '--benchmark_format=json' ] or [] )
+        parse        = google and parse_google_benchmark or parse_key_values
+
+        warmup      = max( env['bench_warmup'] or 0, 0 )
+        repetitions = max( env['bench_repetitions'] or 1, 1 )
+
+        write_atomically( "RunBenchTest: [{}] with {} warm-up and {} timed runs\n".format(
+                " ".join( test_command ), warmup, repetitions ) )
+
+        samples = {}
+        with open( stdout_from_program( program_path ), 'w' ) as stdout_log, \
+             open( stderr_from_program( program_path ), 'w' ) as stderr_log:
+
+            for run in range( warmup + repetitions ):
+                timed = run >= warmup
+                label = timed and "run {} of {}".format( run - warmup + 1, repetitions ) or "warm-up {} of {}".format( run + 1, warmup )
+                stdout_log.write( "--- {} ---\n".format( label ) )
+                stderr_log.write( "--- {} ---\n".format( label ) )
+
+                stdout = BenchOutput( stdout_log )
+                stderr = BenchOutput( stderr_log )
+                limits = cuppa.test_limits.TestLimits.from_env( env )
+                limits.cpus = env['bench_cpus']
+
+                try:
+                    return_code = IncrementalSubProcess.Popen2( stdout,
+                                                                stderr,
+                                                                test_command,
+                                                                cwd=working_dir,
+                                                                limits=limits )
+                except OSError, e:
+                    write_atomically( "Execution of [{}] failed with error: {}\n".format( " ".join( test_command ), e ), sys.stderr )
+                    return 1
+
+                if return_code != 0:
+                    write_atomically( "".join( line + '\n' for line in stderr.lines ), sys.stderr )
+                    if limits.exceeded( return_code ):
+                        write_atomically( limits.exceeded( return_code ) + "\n", sys.stderr )
+                    elif return_code < 0:
+                        write_atomically( "Benchmark was terminated by signal: {}\n".format( -return_code ), sys.stderr )
+                    else:
+                        write_atomically( "Benchmark returned with error code: {}\n".format( return_code ), sys.stderr )
+                    return return_code or 1
+
+                if timed:
+                    try:
+                        results = parse( stdout.lines )
+                    except ValueError, e:
+                        write_atomically( "Output of benchmark [{}] could not be read: {}\n".format( program_path, e ), sys.stderr )
+                        return 1
+                    for name, value in results.items():
+                        samples.setdefault( name, [] ).append( value )
+
+        key       = cuppa.test_history.key( env, os.path.split( executable )[1] )
+        stored    = baselines( env['build_root'] )
+        baseline  = stored.get( key ) or {}
+
+        benchmarks = []
+        for name in sorted( samples ):
+            benchmark = summarise( samples[name] )
+            benchmark['name']    = name
+            benchmark['unit']    = google and 'ns' or None
+            benchmark['samples'] = samples[name]
+            if name in baseline:
+                benchmark['baseline']   = summarise( baseline[name] )
+                benchmark['comparison'] = compare( samples[name], baseline[name] )
+            else:
+                benchmark['baseline']   = None
+                benchmark['comparison'] = None
+            benchmarks.append( benchmark )
+
+        # Benchmarks are compared with the first results stored for them until
+        # the baseline is updated
+        if env['bench_update_baseline']:
+            stored.set( key, samples )
+        elif set( samples ) - set( baseline ):
+            updated = dict( samples )
+            updated.update( baseline )
+            stored.set( key, updated )
+
+        report = {
+            'program'    : program_path,
+            'format'     : google and 'google-benchmark' or 'key-value',
+            'warmup'     : warmup,
+            'repetitions': repetitions,
+            'cpus'       : env['bench_cpus'],
+            'benchmarks' : benchmarks,
+        }
+        with open( bench_report_from_program( program_path ), 'w' ) as report_file:
+            json.dump( report, report_file, indent=2, sort_keys=True )
+
+        write_atomically( self._summary_text( colouriser, program_path, benchmarks ) )
+        return 0
+
+
+    @classmethod
+    def _value_text( cls, value, unit ):
+        if unit == 'ns':
+            for name, multiple in sorted( _time_units.items(), key=lambda item: -item[1] ):
+                if abs( value ) >= multiple or multiple == 1:
+                    return "{:.3f}{}".format( value / multiple, name )
+        return "{:.4g}".format( value )
+
+
+    @classmethod
+    def _summary_text( cls, colouriser, program_path, benchmarks ):
+        text = [ colouriser.emphasise( "\nBenchmarks [{}]".format( program_path ) ) + '\n' ]
+
+        if not benchmarks:
+            text.append( colouriser.colour( 'notice', " ( No Benchmarks Found )" ) + '\n' )
+
+        for benchmark in benchmarks:
+            unit = benchmark['unit']
+            line = " {} = {}".format( benchmark['name'], cls._value_text( benchmark['mean'], unit ) )
+            if benchmark['ci95'] is not None:
+                line += " +/- {}".format( cls._value_text( benchmark['ci95'], unit ) )
+            line += " ({} runs)".format( benchmark['runs'] )
+
+            comparison = benchmark['comparison']
+            if comparison:
+                low, high = comparison['change_ci95']
+                line += " vs baseline {}: {:+.1f}% [{:+.1f}%, {:+.1f}%] ".format(
+                        cls._value_text( benchmark['baseline']['mean'], unit ),
+                        comparison['change'] * 100, low * 100, high * 100 )
+                meaning = { 'slower': 'failed', 'faster': 'success' }.get( comparison['verdict'], 'notice' )
+                line += colouriser.highlight( meaning, " = {} = ".format( comparison['verdict'].upper() ) )
+            elif not benchmark['baseline']:
+                line += colouriser.colour( 'notice', " ( New Baseline )" )
+
+            text.append( line + '\n' )
+
+        text.append( '\n' )
+        return "".join( text )
@@ -8,7 +8,10 @@
 #-------------------------------------------------------------------------------
 #   RunBoostTest
 #-------------------------------------------------------------------------------
-from cuppa.output_processor import IncrementalSubProcess
+from cuppa.output_processor import IncrementalSubProcess, write_atomically, write_file_atomically
+import cuppa.timer
+import cuppa.test_limits
+import cuppa.test_schedule
 
 import os
 import sys
@@ -17,6 +20,10 @@ import time
 import re
 import cgi
 import datetime
+import json
+import threading
+import subprocess
+import collections
 
 
 class Notify:
@@ -26,16 +33,39 @@ class Notify:
         self.colouriser = scons_env['colouriser']
         self.master_suite = {}
         self.master_suite['status'] = 'success'
+        self._output = []
+        self._messages = None
+
+
+    def _write( self, text ):
+        # Output is kept until a test case or suite finishes and is then
+        # written in one go so that tests running at the same time do not
+        # interleave their reports
+        self._output.append( text )
+
+
+    def _write_messages( self ):
+        # The output of a test case is bounded as it is for its report
+        if self._messages is not None:
+            self._output.extend( line + "\n" for line in self._messages )
+            self._messages = None
+
+
+    def flush( self ):
+        self._write_messages()
+        if self._output:
+            write_atomically( "".join( self._output ) )
+            self._output = []
 
 
     def enter_suite(self, suite):
-        sys.stdout.write(
+        self._write(
             self.colouriser.emphasise( "\nStarting Test Suite [%s]\n" % suite )
         )
 
 
     def exit_suite(self, suite):
-        sys.stdout.write(
+        self._write(
             self.colouriser.emphasise( "\nTest Suite Finished [%s]\n" % suite['name'] )
         )
 
@@ -44,7 +74,7 @@ class Notify:
 
         store_durations( suite )
 
-        sys.stdout.write(
+        self._write(
             self.colouriser.highlight( meaning, " = %s = " % label )
         )
 
@@ -53,30 +83,34 @@ class Notify:
         total_tests       = int(suite['total_tests'])
         passed_tests      = int(suite['passed_tests'])
         failed_tests      = int(suite['failed_tests'])
-        expected_failures = int(suite['expected_failures'])
+        expected_failures = int(suite.get('expected_failures', 0))
         skipped_tests     = int(suite['skipped_tests'])
         aborted_tests     = int(suite['aborted_tests'])
-        total_assertions  = int(suite['total_assertions'])
-        passed_assertions = int(suite['passed_assertions'])
-        failed_assertions = int(suite['failed_assertions'])
-
-        if total_assertions > 0:
+        timeout_tests     = int(suite.get('timeout_tests', 0))
+        total_assertions  = int(suite.get('total_assertions', 0))
+        passed_assertions = int(suite.get('passed_assertions', 0))
+        failed_assertions = int(suite.get('failed_assertions', 0))
+
+        if 'total_assertions' not in suite:
+            # Not every test framework counts the assertions it checks
+            pass
+        elif total_assertions > 0:
             if suite['status'] == 'passed':
-                sys.stdout.write(
+                self._write(
                     self.colouriser.highlight(
                         meaning,
                         " ( %s of %s Assertions Passed )" % (passed_assertions, total_assertions)
                     )
                 )
             else:
-                sys.stdout.write(
+                self._write(
                     self.colouriser.highlight(
                         meaning,
                         " ( %s of %s Assertions Failed )" % (failed_assertions, total_assertions)
                     )
                 )
         else:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.colour(
                     'notice',
                     " ( No Assertions Checked )"
@@ -84,7 +118,7 @@ class Notify:
             )
 
         if suite['status'] == 'passed' and passed_tests > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.highlight(
                     meaning,
                     " ( %s %s Passed ) "
@@ -95,7 +129,7 @@ class Notify:
             self.master_suite['status'] = 'failed'
 
         if failed_tests > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.highlight(
                     meaning,
                     " ( %s %s Failed ) "
@@ -104,7 +138,7 @@ class Notify:
             )
 
         if expected_failures > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.highlight(
                     meaning,
                     " ( %s %s Expected ) "
@@ -113,7 +147,7 @@ class Notify:
             )
 
         if skipped_tests > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.highlight(
                     meaning,
                     " ( %s %s Skipped ) "
@@ -122,7 +156,7 @@ class Notify:
             )
 
         if aborted_tests > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.highlight(
                     meaning,
                     " ( %s %s Aborted ) "
@@ -130,32 +164,52 @@ class Notify:
                 )
             )
 
-        sys.stdout.write('\n\n')
+        if timeout_tests > 0:
+            self._write(
+                self.colouriser.highlight(
+                    meaning,
+                    " ( %s %s Timed Out ) "
+                    % (timeout_tests, timeout_tests > 1 and 'Test Cases' or 'Test Case')
+                )
+            )
+
+        self._write('\n\n')
+        self.flush()
 
 
     def enter_test(self, test):
         pass
-        sys.stdout.write(
+        self._write(
             self.colouriser.emphasise( "\nRunning Test Case [%s] ...\n" % test )
         )
+        self._messages = BoundedOutput()
 
 
     def exit_test( self, test ):
         label         = test['status']
         meaning       = test['status']
 
-        sys.stdout.write(
+        self._write_messages()
+        self._write(
             self.colouriser.highlight( meaning, " = %s = " % label )
         )
 
         self.__write_time( test )
 
+        if 'total' in test:
+            self.__write_assertions( test, meaning )
+
+        self._write('\n')
+        self.flush()
+
+
+    def __write_assertions( self, test, meaning ):
         assertions = int(test['total'])
         passed     = int(test['passed'])
         failed     = int(test['failed'])
 
         if test['status'] == 'passed' and passed > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.colour(
                     meaning,
                     " ( %s of %s Assertions Passed )" % ( passed, assertions )
@@ -163,7 +217,7 @@ class Notify:
             )
 
         if failed > 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.colour(
                     meaning,
                     " ( %s of %s Assertions Failed )" % ( failed, assertions )
@@ -171,24 +225,23 @@ class Notify:
             )
 
         if test['total'] == 0:
-            sys.stdout.write(
+            self._write(
                 self.colouriser.colour( 'notice'," ( No Assertions )" )
             )
 
-        sys.stdout.write('\n')
-
 
     def __write_time( self, results ):
-        sys.stdout.write( " Time:" )
+        self._write( " Time:" )
 
         if 'wall_duration' in results:
-            sys.stdout.write(
+            self._write(
                 " Wall [ %s ]" % self.colouriser.emphasise_time_by_digit( results['wall_duration'] )
             )
 
-        sys.stdout.write(
-            " CPU [ %s ]" % self.colouriser.emphasise_time_by_digit( results['cpu_duration'] )
-        )
+        if 'cpu_duration' in results:
+            self._write(
+                " CPU [ %s ]" % self.colouriser.emphasise_time_by_digit( results['cpu_duration'] )
+            )
 
         if 'wall_cpu_percent' in results:
             wall_cpu_percent = results['wall_cpu_percent'].upper()
@@ -196,14 +249,22 @@ class Notify:
             if wall_cpu_percent == "N/A":
                 format = "%5s  "
             wall_cpu_percent = format % wall_cpu_percent
-            sys.stdout.write(
+            self._write(
                 " CPU/Wall [ %s ]" % self.colouriser.colour( 'time', wall_cpu_percent )
             )
 
-    def message(self, line):
-        sys.stdout.write(
-            line + "\n"
-        )
+    def output( self, output ):
+        # The output of the current test case, already kept as a BoundedOutput
+        self._messages = output
+
+
+    def message( self, line, offset=None ):
+        if self._messages is not None:
+            self._messages.append( line, offset )
+        else:
+            self._write(
+                line + "\n"
+            )
 
 
 def stdout_from_program( program_file ):
@@ -258,10 +319,89 @@ class State:
     waiting, test_suite, test_case = range(3)
 
 
+# The most bytes of the output of each test case that are kept for its report
+output_budget = 64 * 1024
+
+
+class BoundedOutput(object):
+    """The output lines of a test case, keeping no more than a budget of bytes
+    of them, half as the first lines written and half as the last. The lines
+    left out between them are counted, along with where they are in the log,
+    so that they can still be found there."""
+
+    def __init__( self, budget=None ):
+        budget = budget is None and output_budget or budget
+        self._head_budget  = budget // 2
+        self._tail_budget  = budget - self._head_budget
+        self._head         = []
+        self._head_bytes   = 0
+        self._tail         = collections.deque()
+        self._tail_bytes   = 0
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.dropped_start = None
+        self.dropped_end   = None
+
+
+    def append( self, line, offset=None ):
+        """Adds a line, written to the log at offset if given"""
+        size = len( line ) + 1
+        if not self._tail and self._head_bytes + size <= self._head_budget:
+            self._head.append( line )
+            self._head_bytes += size
+            return
+
+        self._tail.append( ( line, offset ) )
+        self._tail_bytes += size
+        while self._tail_bytes > self._tail_budget:
+            dropped, dropped_offset = self._tail.popleft()
+            dropped_size = len( dropped ) + 1
+            self._tail_bytes   -= dropped_size
+            self.dropped_lines += 1
+            self.dropped_bytes += dropped_size
+            if dropped_offset is not None:
+                if self.dropped_start is None:
+                    self.dropped_start = dropped_offset
+                self.dropped_end = dropped_offset + dropped_size
+
+
+    def move( self, offset ):
+        """Moves the lines on by offset in the log, for when the log they were
+        written to is joined onto the end of another"""
+        if self.dropped_start is not None:
+            self.dropped_start += offset
+            self.dropped_end   += offset
+        self._tail = collections.deque(
+                ( line, line_offset is not None and line_offset + offset or line_offset ) for line, line_offset in self._tail )
+
+
+    def overflowed( self ):
+        return self.dropped_lines > 0
+
+
+    def overflow_text( self ):
+        text = "[ {} lines ({} bytes) of output left out".format( self.dropped_lines, self.dropped_bytes )
+        if self.dropped_start is not None:
+            text += ", see bytes {} to {} of the log".format( self.dropped_start, self.dropped_end )
+        return text + " ]"
+
+
+    def __iter__( self ):
+        for line in self._head:
+            yield line
+        if self.overflowed():
+            yield self.overflow_text()
+        for line, offset in self._tail:
+            yield line
+
+
+
 class ProcessStdout:
 
     def __init__( self, log, branch_root, notify ):
         self.log = open( log, "w" )
+        self.log_offset = 0
+        self.line_offset = 0
         self.branch_root = branch_root
         self.notify = notify
         self.state = State.waiting
@@ -269,6 +409,19 @@ class ProcessStdout:
         self.test_cases = {}
         self.test_suites = {}
         self.master_test_suite = 'Master Test Suite'
+        self.suite_path = []
+        self.module_entered = False
+
+    def __enter_suite_path( self, suite ):
+        # The first suite entered is the master suite, whose name is not part
+        # of the paths used to select test cases
+        if self.module_entered:
+            self.suite_path.append( suite )
+        self.module_entered = True
+
+    def __leave_suite_path( self, suite ):
+        if self.suite_path and self.suite_path[-1] == suite:
+            self.suite_path.pop()
 
     def entered_test_suite( self, line ):
         matches = re.match(
@@ -276,6 +429,9 @@ class ProcessStdout:
              'Entering test suite "(?P<suite>[a-zA-Z0-9(){}:&_<>/\-, ]+)"',
             line.strip() )
 
+        if matches:
+            self.__enter_suite_path( matches.group('suite') )
+
         if matches and matches.group('suite') != self.master_test_suite:
             self.suite = matches.group('suite')
             self.test_suites[self.suite] = {}
@@ -292,6 +448,7 @@ class ProcessStdout:
             self.test_suites[self.suite]['failed_tests']      = 0
             self.test_suites[self.suite]['skipped_tests']     = 0
             self.test_suites[self.suite]['aborted_tests']     = 0
+            self.test_suites[self.suite]['timeout_tests']     = 0
             self.test_suites[self.suite]['total_assertions']  = 0
             self.test_suites[self.suite]['passed_assertions'] = 0
             self.test_suites[self.suite]['failed_assertions'] = 0
@@ -307,6 +464,9 @@ class ProcessStdout:
              '(?: (?P<results>.*))?',
             line.strip() )
 
+        if matches:
+            self.__leave_suite_path( matches.group('suite') )
+
         if matches and matches.group('suite') != self.master_test_suite:
             suite = self.test_suites[matches.group('suite')]
 
@@ -335,7 +495,8 @@ class ProcessStdout:
             self.test_cases[ self.test ]['fixture']    = self.suite
             self.test_cases[ self.test ]['key']        = self.test
             self.test_cases[ self.test ]['name']       = name
-            self.test_cases[ self.test ]['stdout']     = []
+            self.test_cases[ self.test ]['path']       = '/'.join( self.suite_path + [ name ] )
+            self.test_cases[ self.test ]['stdout']     = BoundedOutput()
             self.test_cases[ self.test ]['file']       = matches.group('file')
             self.test_cases[ self.test ]['line']       = matches.group('line')
             self.test_cases[ self.test ]['cpu_time']   = 0
@@ -372,8 +533,8 @@ class ProcessStdout:
             self.notify.exit_test(test)
             return True
         else:
-            test['stdout'].append( line )
-            self.notify.message(line)
+            test['stdout'].append( line, self.line_offset )
+            self.notify.message( line, self.line_offset )
             return False
 
 
@@ -418,9 +579,29 @@ class ProcessStdout:
         results['elapsed'] = results['cpu_time']
 
 
+    def finish( self, status ):
+        # A test case that never finished, because the program crashed or was
+        # stopped, is reported with status as is the suite it was in
+        if self.state == State.test_case:
+            test = self.test_cases[self.test]
+            test['status'] = status
+            self.__capture_times( None, test )
+            self.test_suites[test['suite']][ status + '_tests' ] += 1
+            self.test_case_names.append( test['key'] )
+            self.notify.exit_test(test)
+            self.state = State.test_suite
+        if self.state == State.test_suite and self.suite in self.test_suites:
+            suite = self.test_suites[self.suite]
+            suite['status'] = status
+            self.notify.exit_suite(suite)
+            self.state = State.waiting
+
+
     def __call__( self, line ):
 
+        self.line_offset = self.log_offset
         self.log.write( line + '\n' )
+        self.log_offset += len( line ) + 1
 
         if self.state == State.waiting:
             if self.entered_test_suite( line ):
@@ -535,6 +716,241 @@ class ProcessStderr:
             self.log.close()
 
 
+def durations_from_program( program_file ):
+    return program_file + '.durations'
+
+
+def list_test_cases( executable, working_dir ):
+    """Returns the paths, in the order they run, of the test cases of a
+    Boost.Test program that run by default, or None if they cannot be listed"""
+    try:
+        process = subprocess.Popen( [ executable, '--list_content' ],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    cwd=working_dir )
+        output, errors = process.communicate()
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+
+    units = []
+    for line in ( errors + output ).splitlines():
+        if not line.strip():
+            continue
+        if line.strip().startswith( 'Test setup error' ):
+            return None
+        indent = len( line ) - len( line.lstrip( ' ' ) )
+        name = line.strip()
+        enabled = name.endswith( '*' )
+        units.append( ( indent // 4, name.rstrip( '*' ), enabled ) )
+
+    cases = []
+    path = []
+    for index, ( level, name, enabled ) in enumerate( units ):
+        del path[level:]
+        path.append( name )
+        is_suite = index + 1 < len( units ) and units[index + 1][0] > level
+        if not is_suite and enabled:
+            cases.append( '/'.join( path ) )
+    return cases
+
+
+def load_durations( path ):
+    try:
+        with open( path ) as durations:
+            return json.load( durations )
+    except ( IOError, ValueError ):
+        return {}
+
+
+def save_durations( path, durations, tests ):
+    for name, test in tests:
+        if 'path' in test:
+            durations[ test['path'] ] = test.get( 'wall_time' ) or test.get( 'cpu_time' ) or 0
+    with open( path, 'w' ) as durations_file:
+        json.dump( durations, durations_file, indent=2, sort_keys=True )
+
+
+def partition_test_cases( cases, shards, durations ):
+    """Assigns each test case to the shard with the least work so far, starting
+    with the longest test cases. Test cases without a recorded duration are
+    assumed to take the average time of those with one."""
+    known = [ durations[case] for case in cases if case in durations ]
+    default = known and float( sum( known ) ) / len( known ) or 1
+
+    order = dict( ( case, index ) for index, case in enumerate( cases ) )
+    loads = [ [ 0, [] ] for shard in range( min( shards, len( cases ) ) ) ]
+
+    for case in sorted( cases, key=lambda case: ( -durations.get( case, default ), order[case] ) ):
+        load = min( loads, key=lambda load: load[0] )
+        load[0] += durations.get( case, default )
+        load[1].append( case )
+
+    return [ sorted( shard, key=lambda case: order[case] ) for load, shard in loads ]
+
+
+def run_test_filter( selected, cases ):
+    """Returns the --run_test filter that selects exactly the selected test
+    cases, naming a whole suite where all of its test cases are selected"""
+    tree = {}
+    for case in cases:
+        node = tree
+        for name in case.split( '/' ):
+            node = node.setdefault( name, {} )
+
+    selected = set( selected )
+
+    def leaves( node, prefix ):
+        if not node:
+            return [ prefix ]
+        paths = []
+        for name, child in node.items():
+            paths.extend( leaves( child, prefix + [ name ] ) )
+        return paths
+
+    def filters( node, prefix ):
+        if prefix and all( '/'.join( path ) in selected for path in leaves( node, prefix ) ):
+            return [ '/'.join( prefix ) ]
+        paths = []
+        for name, child in node.items():
+            paths.extend( filters( child, prefix + [ name ] ) )
+        return paths
+
+    return ':'.join( filters( tree, [] ) )
+
+
+
+def run_shards( count, run_shard ):
+    """Calls run_shard with the index of each shard, all at the same time, and
+    returns the wall time each took once every shard has finished"""
+    walls = [ 0 ] * count
+
+    def timed_shard( shard ):
+        start = cuppa.timer.wall_time_nanosecs()
+        try:
+            run_shard( shard )
+        finally:
+            walls[shard] = cuppa.timer.wall_time_nanosecs() - start
+
+    shards = [ threading.Thread( target=timed_shard, args=( shard, ) ) for shard in range( count ) ]
+    for shard in shards:
+        shard.start()
+    for shard in shards:
+        shard.join()
+    return walls
+
+
+def merge_shard_logs( logs, count ):
+    """Joins the logs written by each shard, in shard order, into the log of
+    the whole run. Returns where the log of each shard starts in the log of
+    the whole run for each of the logs."""
+    starts = []
+    for log in logs:
+        starts.append( [] )
+        with open( log, 'w' ) as merged_log:
+            for shard in range( count ):
+                starts[-1].append( merged_log.tell() )
+                shard_log = "{}.{}".format( log, shard )
+                with open( shard_log ) as shard_output:
+                    for block in iter( lambda: shard_output.read( 1024 * 1024 ), '' ):
+                        merged_log.write( block )
+                os.remove( shard_log )
+    return starts
+
+
+def move_shard_output( shards, starts ):
+    """Moves the output kept for the test cases of each shard to where the log
+    of the shard starts in the log of the whole run"""
+    for shard, start in zip( shards, starts ):
+        for name, test in shard.tests():
+            test['stdout'].move( start )
+
+
+def shards_return_code( return_codes ):
+    for return_code in return_codes:
+        if isinstance( return_code, OSError ):
+            raise return_code
+    # A shard terminated by a signal says more about the run than one that failed
+    signalled = [ return_code for return_code in return_codes if return_code < 0 ]
+    return signalled and signalled[0] or max( return_codes )
+
+
+
+class ShardNotify(Notify):
+    """Keeps the notifications of a shard to itself. The merged results of all
+    the shards are reported once they have finished."""
+
+    def flush( self ):
+        self._output = []
+
+
+
+class MergedResults(object):
+
+    _counts = [
+        'cpu_time', 'wall_time', 'user_time', 'sys_time',
+        'total_tests', 'expected_failures', 'passed_tests', 'failed_tests', 'skipped_tests', 'aborted_tests',
+        'timeout_tests',
+        'total_assertions', 'passed_assertions', 'failed_assertions',
+    ]
+
+    def __init__( self, shards, cases ):
+        order = dict( ( case, index ) for index, case in enumerate( cases ) )
+
+        self.test_cases = {}
+        self.test_suites = {}
+
+        for shard in shards:
+            for name, test in shard.tests():
+                self.test_cases[name] = test
+            for name, suite in shard.test_suites.items():
+                self._merge_suite( name, suite )
+
+        self.test_case_names = sorted(
+                self.test_cases.keys(),
+                key=lambda name: order.get( self.test_cases[name].get( 'path' ), len( order ) ) )
+
+
+    def _merge_suite( self, name, suite ):
+        if name not in self.test_suites:
+            self.test_suites[name] = { 'name': name, 'status': 'passed' }
+        merged = self.test_suites[name]
+        for count in self._counts:
+            if count in suite:
+                merged[count] = merged.get( count, 0 ) + int( suite[count] )
+        if suite.get( 'status' ) == 'timeout':
+            merged['status'] = 'timeout'
+        elif suite.get( 'status' ) != 'passed' and merged['status'] != 'timeout':
+            merged['status'] = 'failed'
+
+
+    def tests( self ):
+        for name in self.test_case_names:
+            yield name, self.test_cases[ name ]
+
+
+    def report( self, notify ):
+        suites = []
+        for name, test in self.tests():
+            if test['suite'] not in suites:
+                suites.append( test['suite'] )
+        for name in sorted( self.test_suites.keys() ):
+            if name not in suites:
+                suites.append( name )
+
+        for suite in suites:
+            notify.enter_suite( suite )
+            for name, test in self.tests():
+                if test['suite'] == suite:
+                    notify.enter_test( name )
+                    notify.output( test['stdout'] )
+                    notify.exit_test( test )
+            if suite in self.test_suites:
+                notify.exit_suite( self.test_suites[suite] )
+
+
+
 class RunBoostTest:
 
     def __init__( self, expected ):
@@ -550,25 +966,53 @@ class RunBoostTest:
 
         test_command = executable + " --boost.test.log_format=hrf --boost.test.log_level=test_suite --boost.test.report_level=no"
 
-        print "RunBoostTest: [" + test_command + "]"
+        cases = None
+        if env['test_shards'] > 1:
+            cases = list_test_cases( executable, working_dir )
+            # Test case names holding filter separators cannot be selected
+            if cases and any( ':' in case or ',' in case for case in cases ):
+                cases = None
 
         try:
-            return_code, tests = self.__run_test( program_path,
-                                                  test_command,
-                                                  working_dir,
-                                                  env['branch_root'],
-                                                  notifier )
+            if cases and len( cases ) > 1:
+                write_atomically( "RunBoostTest: [{}] in {} shards\n".format( test_command, min( env['test_shards'], len( cases ) ) ) )
+                return_code, tests, exceeded = self.__run_shards( program_path,
+                                                        test_command,
+                                                        working_dir,
+                                                        env,
+                                                        notifier,
+                                                        cases,
+                                                        target[0] )
+            else:
+                write_atomically( "RunBoostTest: [" + test_command + "]\n" )
+                return_code, tests, exceeded = self.__run_test( program_path,
+                                                                test_command,
+                                                                working_dir,
+                                                                env,
+                                                                notifier )
+
+            tests = list( tests )
+            save_durations( durations_from_program( program_path ),
+                            load_durations( durations_from_program( program_path ) ),
+                            tests )
+
+            # Anything left over, such as a suite that did not finish
+            notifier.flush()
 
             self.generate_bitten_test_report( report_from_program( program_path ), tests )
 
-            if return_code < 0:
-                self.__write_file_to_stderr( stderr_from_program( program_path ) )
-                print >> sys.stderr, "Test was terminated by signal: ", -return_code
+            if exceeded:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( exceeded + "\n", sys.stderr )
+                return_code = return_code or 1
+            elif return_code < 0:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test was terminated by signal: {}\n".format( -return_code ), sys.stderr )
             elif return_code > 0:
-                self.__write_file_to_stderr( stderr_from_program( program_path ) )
-                print >> sys.stderr, "Test returned with error code: ", return_code
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test returned with error code: {}\n".format( return_code ), sys.stderr )
             elif notifier.master_suite['status'] != 'success':
-                print >> sys.stderr, "Not all test suites passed. "
+                write_atomically( "Not all test suites passed.\n", sys.stderr )
                 return_code = 1
             else:
                 return None
@@ -576,51 +1020,106 @@ class RunBoostTest:
             return return_code
 
         except OSError, e:
-            print >> sys.stderr, "Execution of [", test_command, "] failed with error: ", e
+            notifier.flush()
+            write_atomically( "Execution of [{}] failed with error: {}\n".format( test_command, e ), sys.stderr )
             return 1
 
 
-    def __run_test( self, program_path, test_command, working_dir,branch_root, notifier ):
-        process_stdout = ProcessStdout( stdout_from_program( program_path ), branch_root, notifier )
+    def __run_test( self, program_path, test_command, working_dir, env, notifier ):
+        process_stdout = ProcessStdout( stdout_from_program( program_path ), env['branch_root'], notifier )
         process_stderr = ProcessStderr( stderr_from_program( program_path ), notifier )
+        limits         = cuppa.test_limits.TestLimits.from_env( env )
 
-        return_code = IncrementalSubProcess.Popen2( process_stdout,
-                                                    process_stderr,
-                                                    shlex.split( test_command ),
-                                                    cwd=working_dir )
+        # Only the test log, on stdout, is read here. The program writes its
+        # stderr to the log directly.
+        try:
+            return_code = IncrementalSubProcess.Popen2( process_stdout,
+                                                        process_stderr.log,
+                                                        shlex.split( test_command ),
+                                                        cwd=working_dir,
+                                                        limits=limits )
+        finally:
+            process_stdout.log.close()
+            process_stderr.log.close()
+
+        process_stdout.finish( limits.timed_out and 'timeout' or 'aborted' )
+        return return_code, process_stdout.tests(), limits.exceeded( return_code )
+
+
+    def __run_shards( self, program_path, test_command, working_dir, env, notifier, cases, test_node ):
+        partitions = partition_test_cases( cases,
+                                           env['test_shards'],
+                                           load_durations( durations_from_program( program_path ) ) )
+
+        stdout_log = stdout_from_program( program_path )
+        stderr_log = stderr_from_program( program_path )
+        results    = [ None ] * len( partitions )
+
+        def run_shard( shard ):
+            shard_notifier = ShardNotify( env )
+            process_stdout = ProcessStdout( "{}.{}".format( stdout_log, shard ), env['branch_root'], shard_notifier )
+            process_stderr = ProcessStderr( "{}.{}".format( stderr_log, shard ), shard_notifier )
+            limits = cuppa.test_limits.TestLimits.from_env( env )
+            command = shlex.split( test_command ) + [ '--run_test=' + run_test_filter( partitions[shard], cases ) ]
+            try:
+                return_code = IncrementalSubProcess.Popen2( process_stdout,
+                                                            process_stderr.log,
+                                                            command,
+                                                            cwd=working_dir,
+                                                            limits=limits )
+                process_stdout.finish( limits.timed_out and 'timeout' or 'aborted' )
+                results[shard] = return_code, process_stdout, limits.exceeded( return_code )
+            except OSError, error:
+                results[shard] = error, process_stdout, None
+            finally:
+                process_stdout.log.close()
+                process_stderr.log.close()
+
+        walls = run_shards( len( partitions ), run_shard )
+        cuppa.test_schedule.record_shards( test_node, walls )
+        stdout_starts, stderr_starts = merge_shard_logs( [ stdout_log, stderr_log ], len( partitions ) )
+        move_shard_output( [ result[1] for result in results ], stdout_starts )
+
+        return_code = shards_return_code( [ result[0] for result in results ] )
+        exceeded    = [ result[2] for result in results if result[2] ]
+
+        merged = MergedResults( [ result[1] for result in results ], cases )
+        merged.report( notifier )
+
+        return return_code, merged.tests(), exceeded and exceeded[0] or None
 
-        return return_code, process_stdout.tests()
 
+    def generate_bitten_test_report( self, report_path, test_cases ):
+        generate_bitten_test_report( report_path, test_cases )
 
-    def __write_file_to_stderr( self, file_name ):
-        error_file = open( file_name, "r" )
-        for line in error_file:
-            print >> sys.stderr, line
-        error_file.close()
 
+def generate_bitten_test_report( report_path, test_cases ):
+    report = open( report_path, "w" )
+    report.write( '<report category="test">\n' )
 
-    def generate_bitten_test_report( self, report_path, test_cases ):
-        report = open( report_path, "w" )
-        report.write( '<report category="test">\n' )
+    for name, test in test_cases:
 
-        for name, test in test_cases:
+        report.write( '    <test>\n' )
 
-            report.write( '    <test>\n' )
+        for key, value in test.iteritems():
+            report.write( '        <%s>' % key )
+            if key == 'stdout':
+                lines = ( '<span class="line">' + cgi.escape(line) + '<br /></span>' for line in value )
+                report.write( '<![CDATA[' + "\n".join( lines ) + ']]>' )
+            else:
+                report.write( cgi.escape( str( value ) ) )
+            report.write( '</%s>\n' % key )
 
-            for key, value in test.iteritems():
-                report.write( '        <%s>' % key )
-                if key == 'stdout':
-                    value = ( '<span class="line">' + cgi.escape(line) + '<br /></span>' for line in value )
-                    value = '<![CDATA[' + "\n".join( value ) + ']]>'
-                else:
-                    value = cgi.escape( str( value ) )
-                report.write( value )
-                report.write( '</%s>\n' % key )
+            if key == 'stdout' and getattr( value, 'overflowed', None ) and value.overflowed():
+                report.write( '        <stdout_overflow lines="{}" bytes="{}"'.format( value.dropped_lines, value.dropped_bytes ) )
+                if value.dropped_start is not None:
+                    report.write( ' log_start="{}" log_end="{}"'.format( value.dropped_start, value.dropped_end ) )
+                report.write( ' />\n' )
 
-            report.write( '    </test>\n' )
+        report.write( '    </test>\n' )
 
-        report.write( '</report>\n' )
-        report.close()
+    report.write( '</report>\n' )
+    report.close()
 
 
 def nanosecs_from_time( time_in_seconds ):
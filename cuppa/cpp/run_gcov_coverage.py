@@ -15,13 +15,14 @@ import subprocess
 import re
 import itertools
 import glob
+import threading
 
 # scons imports
 from SCons.Script   import Glob, Flatten
 
 # construct imports
 import cuppa.sconscript_progress
-from cuppa.output_processor import IncrementalSubProcess, command_available
+from cuppa.output_processor import IncrementalSubProcess, command_available, write_atomically
 
 
 
@@ -63,7 +64,7 @@ class WriteToString(object):
 
 
 def run_command( command, working_dir ):
-    print "coverage: {}".format( command )
+    write_atomically( "coverage: {}\n".format( command ) )
     process_output = WriteToString()
     return_code = IncrementalSubProcess.Popen( process_output,
                                                shlex.split( command ),
@@ -75,12 +76,20 @@ def run_command( command, working_dir ):
 class CoverageSuite(object):
 
     suites = {}
+    _suites_lock = threading.Lock()
 
     @classmethod
     def create( cls, name, scons_env, final_dir ):
-        if not name in cls.suites:
-            cls.suites[name] = CoverageSuite( name, scons_env, final_dir )
-        return cls.suites[name]
+        with cls._suites_lock:
+            if not name in cls.suites:
+                cls.suites[name] = CoverageSuite( name, scons_env, final_dir )
+            return cls.suites[name]
+
+
+    @classmethod
+    def _remove( cls, name ):
+        with cls._suites_lock:
+            del cls.suites[name]
 
 
     def __init__( self, name, scons_env, final_dir ):
@@ -94,7 +103,7 @@ class CoverageSuite(object):
     def on_progress( self, progress, env, sconscript, target, source ):
         if progress == 'finished':
             self.exit_suite()
-            del self.suites[self._name]
+            self._remove( self._name )
 
 
     def exit_suite( self ):
@@ -105,7 +114,7 @@ class CoverageSuite(object):
     def _run_gcovr( self, build_dir, output_dir, working_dir, sconscript_id ):
         command = 'gcovr -h'
         if not command_available( command ):
-            print "coverage: skipping gcovr output as not available"
+            write_atomically( "coverage: skipping gcovr output as not available\n" )
             return
 
         base_name = coverage_base_name( sconscript_id )
@@ -125,9 +134,9 @@ class CoverageSuite(object):
             for coverage_file in coverage_files:
                 new_coverage_file = os.path.join( output_dir, str( coverage_file ) )
                 os.rename( str( coverage_file ), new_coverage_file )
-            print output
+            write_atomically( output + "\n" )
         else:
-            print output
+            write_atomically( output + "\n" )
 
 
 class RunGcovCoverageEmitter(object):
@@ -211,11 +220,11 @@ class RunGcovCoverage(object):
                 try:
                     os.rename( str(gcov_file), new_gcov_file )
                 except OSError:
-                    print "coverage: failed moving gcov file [{}] to [{}]".format( str(gcov_file), new_gcov_file )
+                    write_atomically( "coverage: failed moving gcov file [{}] to [{}]\n".format( str(gcov_file), new_gcov_file ) )
 
             with open( gcov_summary_path, 'w' ) as summary_file:
                 summary_file.write( output )
 
         else:
-            print output
+            write_atomically( output + "\n" )
 
@@ -0,0 +1,396 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   RunGtestTest
+#-------------------------------------------------------------------------------
+from cuppa.output_processor import IncrementalSubProcess, write_atomically, write_file_atomically
+from cuppa.cpp.run_boost_test import Notify, ShardNotify, MergedResults, ProcessStderr
+from cuppa.cpp.run_boost_test import stdout_from_program, stderr_from_program, report_from_program
+from cuppa.cpp.run_boost_test import durations_from_program, load_durations, save_durations
+from cuppa.cpp.run_boost_test import run_shards, merge_shard_logs, move_shard_output, shards_return_code
+from cuppa.cpp.run_boost_test import BoundedOutput
+from cuppa.cpp.run_boost_test import generate_bitten_test_report, store_durations
+import cuppa.test_limits
+import cuppa.test_schedule
+
+import os
+import sys
+import re
+import subprocess
+
+
+class RunGtestTestEmitter:
+
+    def __init__( self, final_dir ):
+        self.__final_dir = final_dir
+
+
+    def __call__( self, target, source, env ):
+        program_file = self.__final_dir + os.path.split( source[0].path )[1]
+
+        target = []
+        target.append( stdout_from_program( program_file ) )
+        target.append( stderr_from_program( program_file ) )
+        target.append( report_from_program( program_file ) )
+
+        return target, source
+
+
+class State:
+    waiting, test_suite, test_case = range(3)
+
+
+class ProcessStdout:
+    """Reads the output of a Google Test program into the same test case and
+    suite records as those of a Boost.Test program"""
+
+    _suite_start = re.compile( r'^\[-{10}\] \d+ tests? from (?P<suite>[^\s,]+)(?:, where .*)?$' )
+    _suite_end   = re.compile( r'^\[-{10}\] \d+ tests? from (?P<suite>\S+) \((?P<time>\d+) ms total\)$' )
+    _test_start  = re.compile( r'^\[ RUN      \] (?P<test>\S+)$' )
+    _test_end    = re.compile( r'^\[\s+(?P<status>OK|FAILED|SKIPPED)\s+\] (?P<test>[^\s,]+)(?:,.*?)?(?: \((?P<time>\d+) ms\))?$' )
+    _failure     = re.compile( r'^(?P<file>.+?)[:(](?P<line>\d+)\)?: (?:error: )?Failure$' )
+
+    _status = {
+        'OK'      : 'passed',
+        'FAILED'  : 'failed',
+        'SKIPPED' : 'skipped',
+    }
+
+    def __init__( self, log, branch_root, notify ):
+        self.log = open( log, "w" )
+        self.log_offset = 0
+        self.line_offset = 0
+        self.branch_root = branch_root
+        self.notify = notify
+        self.state = State.waiting
+        self.test_case_names = []
+        self.test_cases = {}
+        self.test_suites = {}
+        self.suite = None
+        self.test = None
+
+
+    def entered_test_suite( self, line ):
+        matches = self._suite_start.match( line )
+        if matches and not self._suite_end.match( line ):
+            self.__enter_suite( matches.group('suite') )
+            return True
+        return False
+
+
+    def entered_test_case_outside_suite( self, line ):
+        # A test case whose suite was not recognised is still recorded, in a
+        # suite named after the first part of its name
+        matches = self._test_start.match( line )
+        if matches:
+            self.__enter_suite( matches.group('test').partition( '.' )[0] )
+            return self.entered_test_case( line )
+        return False
+
+
+    def __enter_suite( self, suite ):
+        self.suite = suite
+        self.test_suites[self.suite] = {}
+
+        self.test_suites[self.suite]['name'] = self.suite
+
+        self.test_suites[self.suite]['wall_time']     = 0
+        self.test_suites[self.suite]['total_tests']   = 0
+        self.test_suites[self.suite]['passed_tests']  = 0
+        self.test_suites[self.suite]['failed_tests']  = 0
+        self.test_suites[self.suite]['skipped_tests'] = 0
+        self.test_suites[self.suite]['aborted_tests'] = 0
+        self.test_suites[self.suite]['timeout_tests'] = 0
+
+        self.notify.enter_suite(self.suite)
+
+
+    def leaving_test_suite( self, line ):
+        matches = self._suite_end.match( line )
+        if matches and matches.group('suite') in self.test_suites:
+            self.__exit_suite( self.test_suites[matches.group('suite')] )
+            return True
+        return False
+
+
+    def __exit_suite( self, suite ):
+        if suite['timeout_tests']:
+            suite['status'] = 'timeout'
+        elif suite['failed_tests'] or suite['aborted_tests']:
+            suite['status'] = 'failed'
+        else:
+            suite['status'] = 'passed'
+        self.notify.exit_suite(suite)
+
+
+    def entered_test_case( self, line ):
+        matches = self._test_start.match( line )
+        if matches:
+            path  = matches.group('test')
+            name  = path.partition( '.' )[2]
+            self.test = '[' + self.suite + '] ' + name
+            self.test_cases[ self.test ] = {}
+            self.test_cases[ self.test ]['suite']      = self.suite
+            self.test_cases[ self.test ]['fixture']    = self.suite
+            self.test_cases[ self.test ]['key']        = self.test
+            self.test_cases[ self.test ]['name']       = name
+            self.test_cases[ self.test ]['path']       = path
+            self.test_cases[ self.test ]['stdout']     = BoundedOutput()
+            self.test_cases[ self.test ]['file']       = None
+            self.test_cases[ self.test ]['line']       = None
+            self.test_cases[ self.test ]['branch_dir'] = None
+            self.test_cases[ self.test ]['wall_time']  = 0
+            self.notify.enter_test(self.test)
+            return True
+        return False
+
+
+    def leaving_test_case( self, line ):
+        test = self.test_cases[self.test]
+
+        matches = self._test_end.match( line )
+        if matches and matches.group('test') == test['path']:
+            if matches.group('time'):
+                test['wall_time'] = int( matches.group('time') ) * 1000000
+            self.__exit_test( test, self._status[ matches.group('status') ] )
+            return True
+        else:
+            failure = self._failure.match( line )
+            if failure and not test['file']:
+                # Google Test does not say where a test is defined, so use
+                # where it first failed
+                test['file']       = failure.group('file')
+                test['line']       = failure.group('line')
+                test['branch_dir'] = os.path.relpath( test['file'], self.branch_root )
+            test['stdout'].append( line, self.line_offset )
+            self.notify.message( line, self.line_offset )
+            return False
+
+
+    def __exit_test( self, test, status ):
+        test['status'] = status
+
+        # Google Test only reports the elapsed time of each test
+        store_durations( test )
+
+        ## For backward compatibility - remove later
+        test['elapsed'] = test['wall_time']
+
+        suite = self.test_suites[test['suite']]
+        suite['wall_time']   += test['wall_time']
+        suite['total_tests'] += 1
+        suite[ status + '_tests' ] += 1
+
+        self.test_case_names.append( test['key'] )
+        self.notify.exit_test(test)
+
+
+    def finish( self, status ):
+        # A test that crashed the program, or was stopped, never finishes
+        if self.state == State.test_case:
+            self.__exit_test( self.test_cases[self.test], status )
+            self.state = State.test_suite
+        if self.state == State.test_suite:
+            self.__exit_suite( self.test_suites[self.suite] )
+            self.state = State.waiting
+
+
+    def __call__( self, line ):
+
+        self.line_offset = self.log_offset
+        self.log.write( line + '\n' )
+        self.log_offset += len( line ) + 1
+
+        if self.state == State.waiting:
+            if self.entered_test_suite( line ):
+                self.state = State.test_suite
+            elif self.entered_test_case_outside_suite( line ):
+                self.state = State.test_case
+
+        elif self.state == State.test_suite:
+            if self.entered_test_case( line ):
+                self.state = State.test_case
+            elif self.leaving_test_suite( line ):
+                self.state = State.waiting
+
+        elif self.state == State.test_case:
+            if self.leaving_test_case( line ):
+                self.state = State.test_suite
+
+
+    def __exit__( self, type, value, traceback ):
+        if self.log:
+            self.log.close()
+
+
+    def tests( self ):
+        for name in self.test_case_names:
+            yield name, self.test_cases[ name ]
+
+
+
+def list_test_cases( executable, working_dir ):
+    """Returns the names, in the order they run, of the test cases of a Google
+    Test program that run by default, or None if they cannot be listed"""
+    try:
+        process = subprocess.Popen( [ executable, '--gtest_list_tests' ],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    cwd=working_dir )
+        output, errors = process.communicate()
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+
+    cases = []
+    suite = None
+    for line in output.splitlines():
+        # Type and value parameters follow the name as a comment
+        name = line.split( '#' )[0].strip()
+        if not name:
+            continue
+        if not line.startswith( ' ' ):
+            suite = name.endswith( '.' ) and name or None
+        elif suite and not suite.startswith( 'DISABLED_' ) and not name.startswith( 'DISABLED_' ):
+            cases.append( suite + name )
+    return cases
+
+
+
+class RunGtestTest:
+
+    def __init__( self, expected ):
+        self._expected = expected
+
+
+    def __call__( self, target, source, env ):
+
+        executable   = str( source[0].abspath )
+        working_dir  = os.path.split( executable )[0]
+        program_path = source[0].path
+        notifier     = Notify(env)
+
+        test_command = [ executable, '--gtest_color=no', '--gtest_print_time=1' ]
+
+        cases = None
+        if env['test_shards'] > 1:
+            cases = list_test_cases( executable, working_dir )
+
+        try:
+            if cases and len( cases ) > 1:
+                write_atomically( "RunGtestTest: [{}] in {} shards\n".format( " ".join( test_command ), min( env['test_shards'], len( cases ) ) ) )
+                return_code, tests, exceeded = self.__run_shards( program_path,
+                                                        test_command,
+                                                        working_dir,
+                                                        env,
+                                                        notifier,
+                                                        cases,
+                                                        target[0] )
+            else:
+                write_atomically( "RunGtestTest: [" + " ".join( test_command ) + "]\n" )
+                return_code, tests, exceeded = self.__run_test( program_path,
+                                                                test_command,
+                                                                working_dir,
+                                                                env,
+                                                                notifier )
+
+            tests = list( tests )
+            save_durations( durations_from_program( program_path ),
+                            load_durations( durations_from_program( program_path ) ),
+                            tests )
+
+            notifier.flush()
+
+            generate_bitten_test_report( report_from_program( program_path ), tests )
+
+            if exceeded:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( exceeded + "\n", sys.stderr )
+                return_code = return_code or 1
+            elif return_code < 0:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test was terminated by signal: {}\n".format( -return_code ), sys.stderr )
+            elif return_code > 0:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test returned with error code: {}\n".format( return_code ), sys.stderr )
+            elif notifier.master_suite['status'] != 'success':
+                write_atomically( "Not all test suites passed.\n", sys.stderr )
+                return_code = 1
+            else:
+                return None
+
+            return return_code
+
+        except OSError, e:
+            notifier.flush()
+            write_atomically( "Execution of [{}] failed with error: {}\n".format( " ".join( test_command ), e ), sys.stderr )
+            return 1
+
+
+    def __run_test( self, program_path, test_command, working_dir, env, notifier ):
+        process_stdout = ProcessStdout( stdout_from_program( program_path ), env['branch_root'], notifier )
+        process_stderr = ProcessStderr( stderr_from_program( program_path ), notifier )
+        limits         = cuppa.test_limits.TestLimits.from_env( env )
+
+        try:
+            return_code = IncrementalSubProcess.Popen2( process_stdout,
+                                                        process_stderr.log,
+                                                        test_command,
+                                                        cwd=working_dir,
+                                                        limits=limits )
+        finally:
+            process_stdout.log.close()
+            process_stderr.log.close()
+
+        process_stdout.finish( limits.timed_out and 'timeout' or 'aborted' )
+        return return_code, process_stdout.tests(), limits.exceeded( return_code )
+
+
+    def __run_shards( self, program_path, test_command, working_dir, env, notifier, cases, test_node ):
+        # Google Test selects the test cases of each shard itself
+        count = min( env['test_shards'], len( cases ) )
+
+        stdout_log = stdout_from_program( program_path )
+        stderr_log = stderr_from_program( program_path )
+        results    = [ None ] * count
+
+        def run_shard( shard ):
+            shard_notifier = ShardNotify( env )
+            process_stdout = ProcessStdout( "{}.{}".format( stdout_log, shard ), env['branch_root'], shard_notifier )
+            process_stderr = ProcessStderr( "{}.{}".format( stderr_log, shard ), shard_notifier )
+            shard_env = dict( os.environ )
+            shard_env['GTEST_TOTAL_SHARDS'] = str( count )
+            shard_env['GTEST_SHARD_INDEX']  = str( shard )
+            limits = cuppa.test_limits.TestLimits.from_env( env )
+            try:
+                return_code = IncrementalSubProcess.Popen2( process_stdout,
+                                                            process_stderr.log,
+                                                            test_command,
+                                                            cwd=working_dir,
+                                                            env=shard_env,
+                                                            limits=limits )
+                process_stdout.finish( limits.timed_out and 'timeout' or 'aborted' )
+                results[shard] = return_code, process_stdout, limits.exceeded( return_code )
+            except OSError, error:
+                results[shard] = error, process_stdout, None
+            finally:
+                process_stdout.log.close()
+                process_stderr.log.close()
+
+        walls = run_shards( count, run_shard )
+        cuppa.test_schedule.record_shards( test_node, walls )
+        stdout_starts, stderr_starts = merge_shard_logs( [ stdout_log, stderr_log ], count )
+        move_shard_output( [ result[1] for result in results ], stdout_starts )
+
+        return_code = shards_return_code( [ result[0] for result in results ] )
+        exceeded    = [ result[2] for result in results if result[2] ]
+
+        merged = MergedResults( [ result[1] for result in results ], cases )
+        merged.report( notifier )
+
+        return return_code, merged.tests(), exceeded and exceeded[0] or None
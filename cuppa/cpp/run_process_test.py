@@ -15,32 +15,46 @@ import time
 import re
 import cgi
 import datetime
+import threading
 
 import cuppa.timer
+import cuppa.test_limits
+import cuppa.test_history
 import cuppa.sconscript_progress
-from cuppa.output_processor import IncrementalSubProcess
+from cuppa.output_processor import IncrementalSubProcess, write_atomically, write_file_atomically
 
 
 class TestSuite:
 
     suites = {}
+    _suites_lock = threading.Lock()
 
     @classmethod
     def create( cls, name, scons_env ):
-        if not name in cls.suites:
-            cls.suites[name] = TestSuite( name, scons_env )
-        return cls.suites[name]
+        with cls._suites_lock:
+            if not name in cls.suites:
+                cls.suites[name] = TestSuite( name, scons_env )
+            return cls.suites[name]
+
+
+    @classmethod
+    def _remove( cls, name ):
+        with cls._suites_lock:
+            del cls.suites[name]
+
 
     def __init__( self, name, scons_env ):
         self._name = name
         self._scons_env = scons_env
         self._colouriser = scons_env['colouriser']
 
-        sys.stdout.write('\n')
-        sys.stdout.write(
-            self._colouriser.emphasise( "Starting Test Suite [{}]".format( name ) )
+        # Tests of a suite may run at the same time so the suite is only
+        # changed while holding its lock and each test is reported in one go
+        self._lock = threading.Lock()
+
+        write_atomically(
+            '\n' + self._colouriser.emphasise( "Starting Test Suite [{}]".format( name ) ) + '\n'
         )
-        sys.stdout.write('\n')
 
         cuppa.sconscript_progress.SconscriptProgress.register_callback( scons_env, self.on_progress )
 
@@ -51,6 +65,8 @@ class TestSuite:
         self._suite['expected_failures'] = 0
         self._suite['skipped_tests']     = 0
         self._suite['aborted_tests']     = 0
+        self._suite['timeout_tests']     = 0
+        self._suite['regressed_tests']   = 0
         self._suite['total_cpu_times']   = cuppa.timer.CpuTimes( 0, 0, 0, 0 )
 
         self._tests = []
@@ -59,45 +75,86 @@ class TestSuite:
     def on_progress( self, progress, env, sconscript, target, source ):
         if progress == 'finished':
             self.exit_suite()
-            del self.suites[sconscript]
+            self._remove( sconscript )
 
 
     def enter_test( self, test, expected='success' ) :
-        sys.stdout.write(
+        write_atomically(
             self._colouriser.emphasise( "\nTest [%s]..." % test ) + '\n'
         )
-        self._tests.append( {} )
-        test_case = self._tests[-1]
+        test_case = {}
         test_case['name']     = test
         test_case['expected'] = expected
         test_case['timer']    = cuppa.timer.Timer()
+        with self._lock:
+            self._tests.append( test_case )
+        return test_case
 
 
-    def exit_test( self, test, status='success' ):
-        test_case = self._tests[-1]
+    def exit_test( self, test_case, status='success' ):
         test_case['timer'].stop()
+        if status == 'success':
+            status = self._check_performance( test_case )
         test_case['status'] = status
 
-        self._write_test_case( test_case )
+        write_atomically(
+            self._colouriser.emphasise( "\nTest [%s]" % test_case['name'] ) + '\n'
+            + self._test_case_text( test_case )
+            + '\n\n'
+        )
 
-        self._suite['total_tests'] += 1
-        if status == 'success':
-            self._suite['passed_tests'] += 1
-        elif status == 'failed':
-            self._suite['failed_tests'] += 1
-        elif status == 'expected_failure':
-            self._suite['expected_failures'] += 1
-        elif status == 'aborted':
-            self._suite['aborted_tests'] += 1
-        elif status == 'skipped':
-            self._suite['skipped_tests'] += 1
+        with self._lock:
+            self._suite['total_tests'] += 1
+            if status == 'success':
+                self._suite['passed_tests'] += 1
+            elif status == 'failed':
+                self._suite['failed_tests'] += 1
+            elif status == 'expected_failure':
+                self._suite['expected_failures'] += 1
+            elif status == 'aborted':
+                self._suite['aborted_tests'] += 1
+            elif status == 'timeout':
+                self._suite['timeout_tests'] += 1
+            elif status == 'skipped':
+                self._suite['skipped_tests'] += 1
+
+            if test_case.get( 'regressions' ):
+                self._suite['regressed_tests'] += 1
+
+            self._suite['total_cpu_times'] += test_case['timer'].elapsed()
+
+
+    def _check_performance( self, test_case ):
+        # Compares the test case with its recent runs before recording it, and
+        # fails it if it regressed by more than the threshold, if one is given.
+        # The peak RSS is only compared when it was measured for the test
+        # itself, rather than being that of SCons
+        cpu_times = test_case['timer'].elapsed()
+        measures = {
+            'wall'   : cpu_times.wall,
+            'cpu'    : cpu_times.process,
+        }
+        if cpu_times.max_rss:
+            measures['max_rss'] = cpu_times.max_rss
 
-        self._suite['total_cpu_times'] += test_case['timer'].elapsed()
+        history = cuppa.test_history.history( self._scons_env['build_root'] )
+        key     = cuppa.test_history.key( self._scons_env, test_case['name'] )
 
-        sys.stdout.write('\n\n')
+        test_case['regressions'] = history.compare( key, measures )
 
+        # A run that fails is not recorded, otherwise after a few rebuilds the
+        # regressed runs would become the baseline and the test would pass
+        threshold = self._scons_env.get( 'test_regression_threshold' )
+        if threshold is not None:
+            for regression in test_case['regressions']:
+                if regression.change * 100 > threshold:
+                    return 'failed'
 
-    def _write_test_case( self, test_case ):
+        history.record( key, measures )
+        return 'success'
+
+
+    def _test_case_text( self, test_case ):
         expected = test_case['expected'] == test_case['status']
         passed   = test_case['status'] == "success"
         meaning  = test_case['status']
@@ -108,21 +165,31 @@ class TestSuite:
         label = " ".join( meaning.upper().split('_') )
 
         cpu_times = test_case['timer'].elapsed()
-        sys.stdout.write( self._colouriser.highlight( meaning, " = %s = " % label ) )
-        self._write_time( cpu_times )
+        text = self._colouriser.highlight( meaning, " = %s = " % label ) + self._time_text( cpu_times )
+
+        for regression in test_case.get( 'regressions', [] ):
+            text += '\n' + self._colouriser.colour( 'warning', " Performance regression: {}".format( regression ) )
+
+        return text
 
 
     def exit_suite( self ):
 
-        suite = self._suite
+        with self._lock:
+            suite = self._suite
+            tests = self._tests
+            self._tests = []
+            self._suite = {}
 
         total_tests  = suite['total_tests']
         passed_tests = suite['passed_tests'] + suite['expected_failures'] + suite['skipped_tests']
-        failed_tests = suite['failed_tests'] + suite['aborted_tests']
+        failed_tests = suite['failed_tests'] + suite['aborted_tests'] + suite['timeout_tests']
 
         expected_failures = suite['expected_failures']
         skipped_tests     = suite['skipped_tests']
         aborted_tests     = suite['aborted_tests']
+        timeout_tests     = suite['timeout_tests']
+        regressed_tests   = suite['regressed_tests']
 
         suite['status'] = 'passed'
         meaning = 'success'
@@ -131,41 +198,43 @@ class TestSuite:
             suite['status'] = 'failed'
             meaning = 'failed'
 
-        sys.stdout.write(
+        text = []
+
+        text.append(
             self._colouriser.emphasise( "\nTest Suite [{}] ".format( self._name ) )
         )
 
-        sys.stdout.write(
+        text.append(
             self._colouriser.highlight( meaning, " = {} = ".format( suite['status'].upper() ) )
         )
 
-        sys.stdout.write('\n')
+        text.append('\n')
 
-        for test in self._tests:
-            sys.stdout.write(
+        for test in tests:
+            text.append(
                 self._colouriser.emphasise( "\nTest case [{}]".format( test['name'] ) ) + '\n'
             )
-            self._write_test_case( test )
+            text.append( self._test_case_text( test ) )
 
-        sys.stdout.write('\n\n')
+        text.append('\n\n')
 
         if total_tests > 0:
             if suite['status'] == 'passed':
-                sys.stdout.write(
+                text.append(
                     self._colouriser.highlight(
                         meaning,
                         " ( %s of %s Test Cases Passed )" % ( passed_tests, total_tests )
                     )
                 )
             else:
-                sys.stdout.write(
+                text.append(
                     self._colouriser.highlight(
                         meaning,
                         " ( %s of %s Test Cases Failed )" % (failed_tests, total_tests)
                     )
                 )
         else:
-            sys.stdout.write(
+            text.append(
                 self._colouriser.colour(
                     'notice',
                     " ( No Test Cases Checked )"
@@ -173,7 +242,7 @@ class TestSuite:
             )
 
         if passed_tests > 0:
-            sys.stdout.write(
+            text.append(
                 self._colouriser.highlight(
                     meaning,
                     " ( %s %s Passed ) "
@@ -182,7 +251,7 @@ class TestSuite:
             )
 
         if failed_tests > 0:
-            sys.stdout.write(
+            text.append(
                 self._colouriser.highlight(
                     meaning,
                     " ( %s %s Failed ) "
@@ -192,7 +261,7 @@ class TestSuite:
 
         if expected_failures > 0:
             meaning = 'expected_failure'
-            sys.stdout.write(
+            text.append(
                 self._colouriser.highlight(
                     meaning,
                     " ( %s %s Expected ) "
@@ -202,7 +271,7 @@ class TestSuite:
 
         if skipped_tests > 0:
             meaning = 'skipped'
-            sys.stdout.write(
+            text.append(
                 self._colouriser.highlight(
                     meaning,
                     " ( %s %s Skipped ) "
@@ -212,7 +281,7 @@ class TestSuite:
 
         if aborted_tests > 0:
             meaning = 'aborted'
-            sys.stdout.write(
+            text.append(
                 self._colouriser.highlight(
                     meaning,
                     " ( %s %s Aborted ) "
@@ -220,50 +289,76 @@ class TestSuite:
                 )
             )
 
+        if timeout_tests > 0:
+            meaning = 'timeout'
+            text.append(
+                self._colouriser.highlight(
+                    meaning,
+                    " ( %s %s Timed Out ) "
+                    % (timeout_tests, timeout_tests > 1 and 'Test Cases' or 'Test Case')
+                )
+            )
 
-        sys.stdout.write('\n')
-        self._write_time( self._suite['total_cpu_times'], True )
+        if regressed_tests > 0:
+            meaning = 'warning'
+            text.append(
+                self._colouriser.highlight(
+                    meaning,
+                    " ( %s %s Regressed ) "
+                    % (regressed_tests, regressed_tests > 1 and 'Test Cases' or 'Test Case')
+                )
+            )
 
-        self._tests = []
-        self._suite = {}
 
-        sys.stdout.write('\n\n')
+        text.append('\n')
+        text.append( self._time_text( suite['total_cpu_times'], True ) )
+
+        text.append('\n\n')
 
+        write_atomically( "".join( text ) )
 
-    def _write( self, text, emphasise=False ):
+
+    def _text( self, text, emphasise=False ):
         if not emphasise:
-            sys.stdout.write( text )
+            return text
         else:
-            sys.stdout.write( self._colouriser.emphasise( text ) )
+            return self._colouriser.emphasise( text )
 
 
-    def _write_time( self, cpu_times, emphasise=False ):
+    def _time_text( self, cpu_times, emphasise=False ):
 
-        self._write( " Time:", emphasise )
+        text = self._text( " Time:", emphasise )
 
-        self._write(
+        text += self._text(
             " Wall [ {}".format( self._colouriser.emphasise_time_by_digit( duration_from_elapsed( cpu_times.wall ) ) ),
             emphasise
         )
 
-        self._write(
+        text += self._text(
             " ] CPU [ {}".format( self._colouriser.emphasise_time_by_digit( duration_from_elapsed( cpu_times.process ) ) ),
             emphasise
         )
 
-        percent = "{:.2f}".format( float(cpu_times.process) * 100 / cpu_times.wall )
+        percent = "{:.2f}".format( cpu_times.wall and float(cpu_times.process) * 100 / cpu_times.wall or 0.0 )
 
         wall_cpu_percent = "%6s%%" % percent.upper()
-        self._write(
+        text += self._text(
             " ] CPU/Wall [ {}".format( self._colouriser.colour( 'time', wall_cpu_percent ) ),
             emphasise
         )
 
-        self._write( " ]", emphasise )
+        if cpu_times.max_rss:
+            text += self._text(
+                " ] Peak RSS [ {}".format( self._colouriser.colour( 'time', megabytes_from_bytes( cpu_times.max_rss ) ) ),
+                emphasise
+            )
+
+        text += self._text( " ]", emphasise )
+        return text
 
 
     def message(self, line):
-        sys.stdout.write(
+        write_atomically(
             line + "\n"
         )
 
@@ -307,12 +402,15 @@ class RunProcessTestEmitter:
 
 class ProcessStdout:
 
-    def __init__( self, log ):
+    def __init__( self, log, echo=False ):
         self.log = open( log, "w" )
+        self.echo = echo
 
 
     def __call__( self, line ):
         self.log.write( line + '\n' )
+        if self.echo:
+            return line
 
 
     def __exit__( self, type, value, traceback ):
@@ -322,12 +420,15 @@ class ProcessStdout:
 
 class ProcessStderr:
 
-    def __init__( self, log ):
+    def __init__( self, log, echo=False ):
         self.log = open( log, "w" )
+        self.echo = echo
 
 
     def __call__( self, line ):
         self.log.write( line + '\n' )
+        if self.echo:
+            return line
 
 
     def __exit__( self, type, value, traceback ):
@@ -352,49 +453,65 @@ class RunProcessTest:
 
         test_suite = TestSuite.create( suite, env )
 
-        test_suite.enter_test( test, expected=self._expected )
+        test_case = test_suite.enter_test( test, expected=self._expected )
+
+        limits = cuppa.test_limits.TestLimits.from_env( env )
 
         try:
             return_code = self.__run_test( program_path,
                                            test_command,
-                                           working_dir )
-
-            if return_code < 0:
-                self.__write_file_to_stderr( stderr_from_program( program_path ) )
-                print >> sys.stderr, "Test was terminated by signal: ", -return_code
-                test_suite.exit_test( test, 'aborted' )
+                                           working_dir,
+                                           limits,
+                                           test_case['timer'],
+                                           env['test_tee'] )
+
+            if limits.exceeded( return_code ):
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( limits.exceeded( return_code ) + "\n", sys.stderr )
+                test_suite.exit_test( test_case, limits.timed_out and 'timeout' or 'aborted' )
+                return return_code or 1
+            elif return_code < 0:
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test was terminated by signal: {}\n".format( -return_code ), sys.stderr )
+                test_suite.exit_test( test_case, 'aborted' )
             elif return_code > 0:
-                self.__write_file_to_stderr( stderr_from_program( program_path ) )
-                print >> sys.stderr, "Test returned with error code: ", return_code
-                test_suite.exit_test( test, 'failed' )
+                write_file_atomically( stderr_from_program( program_path ), sys.stderr )
+                write_atomically( "Test returned with error code: {}\n".format( return_code ), sys.stderr )
+                test_suite.exit_test( test_case, 'failed' )
             else:
-                test_suite.exit_test( test, 'success' )
+                test_suite.exit_test( test_case, 'success' )
+                if test_case['status'] == 'failed':
+                    write_atomically( "Test performance regressed by more than {}%\n".format(
+                            env['test_regression_threshold'] ), sys.stderr )
+                    return 1
 
             return return_code
 
         except OSError, e:
-            print >> sys.stderr, "Execution of [", test_command, "] failed with error: ", e
+            write_atomically( "Execution of [{}] failed with error: {}\n".format( test_command, e ), sys.stderr )
+            test_suite.exit_test( test_case, 'aborted' )
             return 1
 
 
-    def __run_test( self, program_path, test_command, working_dir ):
-        process_stdout = ProcessStdout( stdout_from_program( program_path ) )
-        process_stderr = ProcessStderr( stderr_from_program( program_path ) )
+    def __run_test( self, program_path, test_command, working_dir, limits, timer, tee ):
+        process_stdout = ProcessStdout( stdout_from_program( program_path ), tee )
+        process_stderr = ProcessStderr( stderr_from_program( program_path ), tee )
 
-        return_code = IncrementalSubProcess.Popen2( process_stdout,
-                                                    process_stderr,
-                                                    shlex.split( test_command ),
-                                                    cwd=working_dir )
+        try:
+            # Unless the output is also shown, the test writes to its logs
+            # directly so that none of it passes through here
+            return_code = IncrementalSubProcess.Popen2( tee and process_stdout or process_stdout.log,
+                                                        tee and process_stderr or process_stderr.log,
+                                                        shlex.split( test_command ),
+                                                        cwd=working_dir,
+                                                        limits=limits,
+                                                        timer=timer )
+        finally:
+            process_stdout.log.close()
+            process_stderr.log.close()
         return return_code
 
 
-    def __write_file_to_stderr( self, file_name ):
-        error_file = open( file_name, "r" )
-        for line in error_file:
-            print >> sys.stderr, line
-        error_file.close()
-
-
 
 #def nanosecs_from_time( time_in_seconds ):
 #    seconds, subseconds = time_in_seconds.split('.')
@@ -405,6 +522,10 @@ class RunProcessTest:
 #    return int(seconds) * 1000000000 + int(nanoseconds)
 
 
+def megabytes_from_bytes( total_bytes ):
+    return "{:.1f} MB".format( float( total_bytes ) / ( 1024 * 1024 ) )
+
+
 def duration_from_elapsed( total_nanosecs ):
     secs, remainder      = divmod( total_nanosecs, 1000000000 )
     millisecs, remainder = divmod( remainder, 1000000 )
@@ -0,0 +1,108 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   SyntaxCheck
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import copy
+
+# Scons
+import SCons.Action
+import SCons.Builder
+import SCons.Errors
+import SCons.Script
+
+# Cuppa
+from cuppa.cpp.include_cost import compile_command, without_object_args
+from cuppa.cpp.include_scanner import HeaderScanner
+
+
+checked_extension = '.checked'
+
+
+def check_command( object_node, env ):
+    """Turns the command that compiles object_node into one that only checks
+    that its source compiles"""
+    command = compile_command( object_node, env )
+    if not command:
+        return None
+    check = without_object_args( command )
+    return check[:1] + [ '-fsyntax-only' ] + check[1:]
+
+
+
+class WriteCheckStamp(object):
+
+    def __call__( self, target, source, env ):
+        # Record the check so that it is only made again when the source, its
+        # headers or the command used to check it change
+        with open( target[0].abspath, 'w' ) as stamp:
+            stamp.write( env.subst( '$_CHECK_COMMAND', target=target, source=source ) + '\n' )
+        return None
+
+
+
+class CheckCommand(object):
+    """Expands to the command that checks the source of an object. It is
+    expanded lazily as the object has no builder when the check is created."""
+
+    def __call__( self, target, source, env, for_signature ):
+        object_node = target[0].attributes.checked_object
+        command = check_command( object_node, env )
+        if not command:
+            raise SCons.Errors.UserError( "cuppa: check: cannot check [{}] as it is not compiled by a command".format( source[0] ) )
+        return command
+
+
+
+class SyntaxCheckEmitter(object):
+
+    def __init__( self ):
+        self._action  = SCons.Action.Action( [
+                SCons.Action.CommandAction( '$_CHECK_COMMAND' ),
+                SCons.Action.Action( WriteCheckStamp(), cmdstr=None )
+        ] )
+        self._scanner = HeaderScanner()
+
+
+    def __call__( self, target, source, env ):
+        for object_node in target:
+            checked = env.File( object_node.abspath + checked_extension )
+            checked.attributes.checked_object = object_node
+            env.Command( checked, source, self._action, source_scanner=self._scanner )
+            # Only the checks are built by default, objects are never produced
+            # so nothing is linked, tested or covered
+            SCons.Script.Default( checked )
+        return target, source
+
+
+def _checked_builder( builder, emitter ):
+    if isinstance( builder, SCons.Builder.CompositeBuilder ):
+        return SCons.Builder.CompositeBuilder(
+                _checked_builder( builder.builder, emitter ),
+                builder.cmdgen
+        )
+    builder = copy.copy( builder )
+    builder._memo = {}
+    if builder.emitter:
+        builder.emitter = SCons.Builder.ListEmitter( [ builder.emitter, emitter ] )
+    else:
+        builder.emitter = emitter
+    return builder
+
+
+def install( env ):
+    emitter = SyntaxCheckEmitter()
+    for name in [ 'StaticObject', 'SharedObject' ]:
+        env['BUILDERS'][name] = _checked_builder( env['BUILDERS'][name], emitter )
+
+    env['BUILDERS']['Object'] = env['BUILDERS']['StaticObject']
+
+    env['_CHECK_COMMAND'] = CheckCommand()
+
+    # Each source is checked using the command that would compile it alone
+    env['batch_size'] = 0
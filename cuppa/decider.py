@@ -0,0 +1,191 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Decider
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import mmap
+import zlib
+import atexit
+import cPickle
+import multiprocessing.pool
+
+# Scons
+import SCons.Node.FS
+
+try:
+    import xxhash
+    xxhash_available = True
+except ImportError:
+    xxhash_available = False
+
+
+scons_deciders = [ 'MD5', 'MD5-timestamp', 'timestamp-newer', 'timestamp-match' ]
+
+# Each cuppa decider is the equivalent SCons decider using fast signatures
+cuppa_deciders = {
+    'fast'           : 'MD5',
+    'fast-timestamp' : 'MD5-timestamp',
+}
+
+chunk_size      = 1024*1024
+large_file_size = 4*1024*1024
+
+
+def names():
+    return scons_deciders + sorted( cuppa_deciders.keys() )
+
+
+def _mtime_nanosecs( stat ):
+    mtime_ns = getattr( stat, 'st_mtime_ns', None )
+    if mtime_ns is None:
+        mtime_ns = int( stat.st_mtime * 1000000000 )
+    return mtime_ns
+
+
+def _stamp( stat ):
+    return stat.st_ino, stat.st_size, _mtime_nanosecs( stat )
+
+
+def _hash_data( data ):
+    if xxhash_available:
+        digest = xxhash.xxh64()
+        for offset in xrange( 0, len(data), chunk_size ):
+            digest.update( buffer( data, offset, chunk_size ) )
+        return digest.hexdigest()
+
+    crc32   = 0
+    adler32 = 1
+    for offset in xrange( 0, len(data), chunk_size ):
+        chunk   = buffer( data, offset, chunk_size )
+        crc32   = zlib.crc32( chunk, crc32 )
+        adler32 = zlib.adler32( chunk, adler32 )
+    return "{:08x}{:08x}".format( crc32 & 0xffffffff, adler32 & 0xffffffff )
+
+
+def file_signature( path, size ):
+    with open( path, 'rb' ) as content:
+        if size >= large_file_size:
+            data = mmap.mmap( content.fileno(), 0, access=mmap.ACCESS_READ )
+            try:
+                return "{}{:x}".format( _hash_data( data ), size )
+            finally:
+                data.close()
+        return "{}{:x}".format( _hash_data( content.read() ), size )
+
+
+def _rehash( path ):
+    try:
+        stat = os.stat( path )
+        return path, _stamp( stat ), file_signature( path, stat.st_size )
+    except EnvironmentError:
+        return path, None, None
+
+
+
+class SignatureDatabase(object):
+
+    def __init__( self, path ):
+        self._path = os.path.abspath( path )
+        self._signatures = {}
+        self._changed = False
+        try:
+            with open( self._path, 'rb' ) as database:
+                self._signatures = cPickle.load( database )
+        except ( IOError, EOFError, cPickle.UnpicklingError ):
+            pass
+
+
+    def refresh( self, jobs ):
+        large_files = []
+        for path, ( stamp, signature ) in self._signatures.items():
+            try:
+                stat = os.stat( path )
+            except OSError:
+                del self._signatures[path]
+                self._changed = True
+                continue
+            if stamp != _stamp( stat ) and stat.st_size >= large_file_size:
+                large_files.append( path )
+
+        if not large_files:
+            return
+
+        pool = multiprocessing.pool.ThreadPool( max( min( jobs, len(large_files) ), 1 ) )
+        try:
+            for path, stamp, signature in pool.imap_unordered( _rehash, large_files ):
+                if stamp:
+                    self._signatures[path] = ( stamp, signature )
+                else:
+                    del self._signatures[path]
+            self._changed = True
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def signature( self, path ):
+        try:
+            stat = os.stat( path )
+        except OSError:
+            return ''
+
+        stamp = _stamp( stat )
+        entry = self._signatures.get( path )
+        if entry and entry[0] == stamp:
+            return entry[1]
+
+        try:
+            signature = file_signature( path, stat.st_size )
+        except IOError:
+            # A directory can be on disk where a File is expected
+            return ''
+
+        self._signatures[path] = ( stamp, signature )
+        self._changed = True
+        return signature
+
+
+    def save( self ):
+        if not self._changed:
+            return
+        directory = os.path.dirname( self._path )
+        if directory and not os.path.exists( directory ):
+            os.makedirs( directory )
+        temporary = self._path + '.tmp'
+        with open( temporary, 'wb' ) as database:
+            cPickle.dump( self._signatures, database, cPickle.HIGHEST_PROTOCOL )
+        os.rename( temporary, self._path )
+        self._changed = False
+
+
+
+def _file_csig_from( database ):
+
+    def get_csig( self ):
+        ninfo = self.get_ninfo()
+        try:
+            return ninfo.csig
+        except AttributeError:
+            pass
+
+        ninfo.csig = database.signature( self.rfile().abspath )
+        return ninfo.csig
+
+    return get_csig
+
+
+def set_decider( env, name, database_path, jobs ):
+    if name in cuppa_deciders:
+        database = SignatureDatabase( database_path )
+        database.refresh( jobs )
+        atexit.register( database.save )
+        SCons.Node.FS.File.get_csig = _file_csig_from( database )
+        name = cuppa_deciders[name]
+    env.Decider( name )
@@ -0,0 +1,237 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Deduplicate
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import shutil
+import hashlib
+import atexit
+import cPickle
+import threading
+
+# Scons
+import SCons.Action
+import SCons.Node
+import SCons.Node.FS
+import SCons.Subst
+
+from cuppa.cpp.include_scanner import depfile_from_object
+
+
+# Objects built with these flags record their own output path, for example to
+# locate profile data or split debug information, so they cannot be shared
+path_embedding_flags = [
+    '--coverage',
+    '-fprofile-arcs',
+    '-fprofile-generate',
+    '-fprofile-instr-generate',
+    '-gsplit-dwarf',
+]
+
+
+def _stamp( path ):
+    try:
+        stat = os.stat( path )
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def _command_lines( action, target, source, env, executor ):
+    while isinstance( action, SCons.Action.CommandGeneratorAction ) and not isinstance( action, SCons.Action.LazyAction ):
+        action = action._generate( target, source, env, 0, executor )
+    if not isinstance( action, SCons.Action.CommandAction ):
+        return None
+    return action.process( target, source, env, executor )[0]
+
+
+def _link( existing, path ):
+    if os.path.exists( path ):
+        os.remove( path )
+    try:
+        os.link( existing, path )
+    except OSError:
+        # Hard links are not possible across file systems
+        shutil.copy2( existing, path )
+
+
+
+class CompileDatabase(object):
+
+    def __init__( self, path ):
+        self._path = os.path.abspath( path )
+        self._objects = {}
+        self._changed = False
+        try:
+            with open( self._path, 'rb' ) as database:
+                self._objects = cPickle.load( database )
+        except ( IOError, EOFError, cPickle.UnpicklingError ):
+            pass
+
+
+    def find( self, key ):
+        entry = self._objects.get( key )
+        if entry and _stamp( entry[0] ) == entry[1]:
+            return entry[0]
+        return None
+
+
+    def add( self, key, path ):
+        self._objects[key] = ( path, _stamp( path ) )
+        self._changed = True
+
+
+    def save( self ):
+        if not self._changed:
+            return
+        directory = os.path.dirname( self._path )
+        if directory and not os.path.exists( directory ):
+            os.makedirs( directory )
+        temporary = self._path + '.tmp'
+        with open( temporary, 'wb' ) as database:
+            cPickle.dump( self._objects, database, cPickle.HIGHEST_PROTOCOL )
+        os.rename( temporary, self._path )
+        self._changed = False
+
+
+
+class Deduplicator(object):
+
+    def __init__( self, database ):
+        self._database    = database
+        self._condition   = threading.Condition()
+        self._in_progress = {}
+        self._keys        = {}
+        self._compiles    = 0
+        self._saved       = 0
+
+
+    def key( self, node ):
+        if not node.is_derived() or not node.has_builder():
+            return None
+
+        executor = node.get_executor()
+        if len( executor.batches ) != 1 or len( executor.get_all_targets() ) != 1:
+            return None
+
+        env = executor.get_build_env()
+        if node.get_suffix() not in [ env.subst( '$OBJSUFFIX' ), env.subst( '$SHOBJSUFFIX' ) ]:
+            return None
+
+        targets = executor.get_all_targets()
+        sources = executor.get_all_sources()
+        lines = []
+        for action in executor.get_action_list():
+            command_lines = _command_lines( action, targets, sources, env, executor )
+            if command_lines is None:
+                return None
+            lines.extend( [ ' '.join( str( arg ) for arg in line ) for line in command_lines ] )
+
+        command = '\n'.join( lines )
+        for flag in path_embedding_flags:
+            if flag in command:
+                return None
+
+        # Normalise the output path so that only the effective command remains
+        replacements = [ ( node.abspath, '$TARGET' ), ( node.path, '$TARGET' ) ]
+        if env.has_key( 'build_dir' ):
+            build_dir = env.fs.Top.Dir( env['build_dir'] )
+            replacements += [ ( build_dir.abspath, '$BUILD_DIR' ), ( build_dir.path, '$BUILD_DIR' ) ]
+
+        def normalise( text ):
+            for path, replacement in replacements:
+                text = text.replace( path, replacement )
+            return text
+
+        digest = hashlib.md5( normalise( command ) )
+        for path, signature in sorted( ( normalise( str( child ) ), child.get_csig() ) for child in node.children() ):
+            digest.update( '\n' + path + ' ' + signature )
+        return digest.hexdigest()
+
+
+    def _wait_for( self, key, owner ):
+        # The owner is released when it is pushed, or left claimed if it fails
+        with self._condition:
+            while self._in_progress.get( key ) is owner and owner.get_state() != SCons.Node.failed:
+                self._condition.wait( 0.1 )
+
+
+    def retrieve( self, node ):
+        key = self.key( node )
+        if not key:
+            return False
+
+        with self._condition:
+            self._keys[node] = key
+            owner = self._in_progress.get( key )
+            if not owner and not self._database.find( key ):
+                self._in_progress[key] = node
+                self._compiles += 1
+                return False
+
+        if owner:
+            self._wait_for( key, owner )
+
+        existing = self._database.find( key )
+        if not existing or existing == node.abspath:
+            with self._condition:
+                self._compiles += 1
+            return False
+
+        _link( existing, node.abspath )
+        if os.path.exists( depfile_from_object( existing ) ):
+            # Depfiles are rewritten in place so they must not be shared
+            shutil.copyfile( depfile_from_object( existing ), depfile_from_object( node.abspath ) )
+
+        print "cuppa: deduplicate: [{}] is identical to [{}]".format( node.path, os.path.relpath( existing ) )
+        with self._condition:
+            self._saved += 1
+        return True
+
+
+    def push( self, node ):
+        with self._condition:
+            key = self._keys.pop( node, None )
+            if key and self._in_progress.get( key ) is node:
+                del self._in_progress[key]
+                if os.path.exists( node.abspath ):
+                    self._database.add( key, node.abspath )
+            self._condition.notify_all()
+
+
+    def report( self ):
+        if self._saved:
+            print "cuppa: deduplicate: {} of {} compiles were saved by linking identical objects".format(
+                    self._saved, self._saved + self._compiles )
+
+
+
+def install( database_path ):
+    if not SCons.Action.execute_actions:
+        return
+
+    database = CompileDatabase( database_path )
+    deduplicator = Deduplicator( database )
+
+    retrieve_from_cache = SCons.Node.FS.File.retrieve_from_cache
+    push_to_cache       = SCons.Node.FS.File.push_to_cache
+
+    def retrieve( self ):
+        return retrieve_from_cache( self ) or deduplicator.retrieve( self )
+
+    def push( self ):
+        push_to_cache( self )
+        deduplicator.push( self )
+
+    SCons.Node.FS.File.retrieve_from_cache = retrieve
+    SCons.Node.FS.File.push_to_cache       = push
+
+    atexit.register( database.save )
+    atexit.register( deduplicator.report )
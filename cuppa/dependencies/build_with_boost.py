@@ -22,6 +22,7 @@ from SCons.Script import AddOption, Environment, File, AlwaysBuild, GetLaunchDir
 from cuppa.output_processor import IncrementalSubProcess
 
 import cuppa.build_platform
+import cuppa.cpp.interface_stub
 
 
 class BoostException(Exception):
@@ -154,9 +155,14 @@ class Boost:
         scm_system = scm and scm or self.__scm_system
         return [ scm_system.revision( self.values['home'] ) ]
 
+    def stamp( self ):
+        return "boost " + self.values['full_version']
+
     def __call__( self, env, toolchain, variant ):
         env.AppendUnique( SYSINCPATH = self.values['include'] )
         env.AppendUnique( CPPDEFINES = self.values['defines'] )
+        env.AppendUnique( STABLE_INCPATH = self.values['include'] )
+        env.AppendUnique( STABLE_INCPATH_STAMPS = [ self.stamp() ] )
 
 
     def numeric_version( self ):
@@ -200,6 +206,7 @@ class BoostSharedLibraryMethod:
             env.BuildWith( 'boost' )
         Boost = env['dependencies']['boost']
         library = BoostLibraryBuilder( Boost, verbose=self._verbose )( env, None, None, library, 'shared' )
+        cuppa.cpp.interface_stub.add_interface_stub( env, library )
         if self._build_once:
             return library
         else:
@@ -9,8 +9,11 @@
 #-------------------------------------------------------------------------------
 
 import cuppa.sconscript_progress
+import cuppa.cpp.interface_stub
 import os.path
 
+from SCons.Script import Flatten
+
 
 class BuildMethod:
 
@@ -23,10 +26,15 @@ class BuildMethod:
             exe += '_' + env['variant']
         env.AppendUnique( DYNAMICLIBS = env['LIBS'] )
 
+        libraries = env['DYNAMICLIBS'] + env['STATICLIBS']
+
         program = env.Program( exe,
                                source,
                                CPPPATH = env['SYSINCPATH'] + env['INCPATH'],
-                               LIBS = env['DYNAMICLIBS'] + env['STATICLIBS'] )
+                               LIBS = libraries )
+
+        # Only relink when the interface of a shared library we link with changes
+        cuppa.cpp.interface_stub.link_through_interface_stubs( env, program, Flatten( libraries ) )
 
         cuppa.sconscript_progress.SconscriptProgress.add( env, program )
 
@@ -0,0 +1,73 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   BuildLibraryMethod
+#-------------------------------------------------------------------------------
+
+import os.path
+
+import cuppa.cpp.interface_stub
+
+from SCons.Script import Flatten
+
+
+class BuildLibraryMethod:
+    """Builds a project library and adds it to the libraries that later calls
+    to Build and BuildTest link against.
+
+    Normally the library is static. In dbg builds with --shared-dev it is built
+    as a shared library in the final folder instead, where programs find it
+    using their -Wl,-rpath=. setting, so a change to the library relinks only
+    the library and not every program that uses it.
+    """
+
+    @classmethod
+    def shared( cls, env ):
+        return env['shared_dev'] and env['variant'].name() == 'dbg'
+
+
+    @classmethod
+    def build( cls, env, target, source, final_dir=None, visibility=None ):
+        if final_dir == None:
+            final_dir = env['final_dir']
+
+        if not cls.shared( env ):
+            library = env.StaticLibrary( target,
+                                         source,
+                                         CPPPATH = env['SYSINCPATH'] + env['INCPATH'] )
+            env.PrependUnique( STATICLIBS = library )
+            return library
+
+        visibility_flags = [ '-fvisibility-inlines-hidden' ]
+        if visibility:
+            visibility_flags.append( '-fvisibility=' + visibility )
+
+        # Record only the file name so programs look the library up through
+        # their rpath rather than by the path they were linked with. The
+        # library lists are fixed here as this library is about to join them.
+        dynamic_libraries = list( env['DYNAMICLIBS'] )
+        library = env.SharedLibrary( os.path.join( final_dir, target ),
+                                     source,
+                                     CPPPATH     = env['SYSINCPATH'] + env['INCPATH'],
+                                     DYNAMICLIBS = dynamic_libraries,
+                                     STATICLIBS  = list( env['STATICLIBS'] ),
+                                     SHCCFLAGS   = env['SHCCFLAGS'] + visibility_flags,
+                                     SHLINKFLAGS = env['SHLINKFLAGS'] + [ '-Wl,-soname,${TARGET.file}' ] )
+
+        cuppa.cpp.interface_stub.link_through_interface_stubs( env, library, Flatten( dynamic_libraries ) )
+        cuppa.cpp.interface_stub.add_interface_stub( env, library )
+
+        env.PrependUnique( DYNAMICLIBS = library )
+        return library
+
+
+    def __call__( self, env, target, source, final_dir=None, visibility=None ):
+        return self.build( env, target, source, final_dir=final_dir, visibility=visibility )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env'].AddMethod( cls(), "BuildLibrary" )
@@ -9,25 +9,50 @@
 #-------------------------------------------------------------------------------
 
 
+import os.path
+
+
 class BuildTestMethod:
 
     def __init__( self, default_test_runner=None ):
         self._default_runner = default_test_runner
 
 
-    def __call__( self, env, target, source, final_dir=None, data=None, append_variant=None, runner=None, expected='success' ):
-        program = env.Build( target, source, final_dir=final_dir, append_variant=append_variant )
-        if env['variant_actions'].has_key('test') or env['variant_actions'].has_key('cov'):
-            if not runner:
-                runner = self._default_runner
+    def __call__( self, env, target, source, final_dir=None, data=None, append_variant=None, runner=None, expected='success', timeout=None ):
+        if not runner:
+            runner = self._default_runner
 
-            env.Test( program, final_dir=final_dir, data=data, runner=runner, expected=expected )
+        if env['variant'].name() == 'pgo-use' and env['toolchain'].supports_pgo():
+            program = self._build_profile_guided( env, target, source, final_dir, data, append_variant, runner, expected, timeout )
+        else:
+            program = env.Build( target, source, final_dir=final_dir, append_variant=append_variant )
+
+        if env['variant_actions'].has_key('test') or env['variant_actions'].has_key('cov'):
+            env.Test( program, final_dir=final_dir, data=data, runner=runner, expected=expected, timeout=timeout )
             if 'cov' in env['variant_actions']:
                 env.Coverage( program, source, final_dir=final_dir )
 
         return program
 
 
+    def _build_profile_guided( self, env, target, source, final_dir, data, append_variant, runner, expected, timeout ):
+        toolchain   = env['toolchain']
+        variant     = env['variant']
+        profile_dir = env.Dir( os.path.join( 'pgo', target ) ).abspath
+
+        training_env     = variant.training_env( env, toolchain, profile_dir )
+        training_program = training_env.Build( target + '.pgo-gen', source, final_dir=final_dir, append_variant=append_variant )
+        training         = training_env.Test( training_program, final_dir=final_dir, data=data, runner=runner, expected=expected, timeout=timeout )
+
+        optimised_env = variant.optimised_env( env, toolchain, profile_dir )
+        program       = optimised_env.Build( target, source, final_dir=final_dir, append_variant=append_variant )
+
+        merge_profiles = toolchain.profile_merger()
+        merge_profiles( optimised_env, training, training_program, program, profile_dir )
+
+        return program
+
+
     @classmethod
     def add_to_env( cls, args ):
         args['env'].AddMethod( cls( args['env']['default_runner'] ), "BuildTest" )
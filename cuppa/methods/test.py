@@ -9,6 +9,8 @@
 #-------------------------------------------------------------------------------
 
 import cuppa.sconscript_progress
+import cuppa.cpp.interface_stub
+import cuppa.test_schedule
 from SCons.Script import Flatten
 
 class TestMethod(object):
@@ -17,7 +19,7 @@ class TestMethod(object):
         self._default_runner = default_test_runner
 
 
-    def __call__( self, env, source, final_dir=None, data=None, runner=None, expected='success' ):
+    def __call__( self, env, source, final_dir=None, data=None, runner=None, expected='success', timeout=None ):
         if final_dir == None:
             final_dir = env['final_dir']
         if not runner:
@@ -30,8 +32,17 @@ class TestMethod(object):
         if data:
             sources = Flatten( [ source, data ] )
 
-        test = env.TestBuilder( [], sources )
+        if timeout:
+            test = env.TestBuilder( [], sources, test_timeout=timeout )
+        else:
+            test = env.TestBuilder( [], sources )
+
+        # Programs are not relinked when only the implementation of a shared
+        # library changes so the test must depend on the libraries directly
+        for program in Flatten( [ source ] ):
+            env.Depends( test, cuppa.cpp.interface_stub.stubbed_libraries_of( program ) )
         cuppa.sconscript_progress.SconscriptProgress.add( env, test )
+        cuppa.test_schedule.add( test, getattr( test_builder, 'exclusive', False ) )
 
         return test
 
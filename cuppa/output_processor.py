@@ -17,6 +17,9 @@ import imp
 import threading
 import shlex
 
+import cuppa.timer
+import cuppa.child_usage
+
 
 
 def command_available( command ):
@@ -30,6 +33,23 @@ def command_available( command ):
 
 
 
+_output_lock = threading.Lock()
+
+
+def write_atomically( text, stream=None ):
+    """Writes text as one block so that it is not interleaved with the output
+    of other actions running at the same time"""
+    with _output_lock:
+        ( stream or sys.stdout ).write( text )
+
+
+def write_file_atomically( path, stream=None ):
+    """Writes the contents of the file at path, unchanged, as one block"""
+    with open( path, "r" ) as contents:
+        write_atomically( contents.read(), stream )
+
+
+
 class AutoFlushFile:
 
     def __init__( self, f ):
@@ -68,27 +88,72 @@ class IncrementalSubProcess:
     @classmethod
     def Popen2( cls, stdout_processor, stderr_processor, args_list, **kwargs ):
 
-        kwargs['stdout'] = subprocess.PIPE
-        kwargs['stderr'] = subprocess.PIPE
+        # Optional limits, such as a cuppa.test_limits.TestLimits, on the process
+        limits = kwargs.pop( 'limits', None )
+        if limits:
+            kwargs.update( limits.popen_kwargs() )
+
+        # An optional cuppa.timer.Timer to add the CPU times of the process to.
+        # The process is then run from a small launcher so that its peak RSS
+        # can be measured too
+        timer = kwargs.pop( 'timer', None )
+        usage_path = None
+        if timer:
+            args_list, usage_path = cuppa.child_usage.command( args_list )
+
+        # A processor may instead be an open file, in which case the output is
+        # written to it by the process directly rather than passing through
+        # the processor line by line
+        kwargs['stdout'] = cls._is_file( stdout_processor ) and stdout_processor or subprocess.PIPE
+        kwargs['stderr'] = cls._is_file( stderr_processor ) and stderr_processor or subprocess.PIPE
+        for processor in [ stdout_processor, stderr_processor ]:
+            if cls._is_file( processor ):
+                processor.flush()
 
         sys.stdout = AutoFlushFile( sys.__stdout__ )
         sys.stderr = AutoFlushFile( sys.__stderr__ )
 
-        process = subprocess.Popen(
-            args_list,
-            **kwargs
-        )
+        try:
+            process = subprocess.Popen(
+                args_list,
+                **kwargs
+            )
+        except:
+            if usage_path:
+                cuppa.child_usage.read( usage_path )
+            raise
+
+        if limits:
+            limits.watch( process )
+
+        try:
+            stderr_thread = None
+            if process.stderr:
+                stderr_consumer = LineConsumer( process.stderr.readline, stderr_processor )
+                stderr_thread = threading.Thread( target=stderr_consumer )
+                stderr_thread.start()
+            if process.stdout:
+                stdout_consumer = LineConsumer( process.stdout.readline, stdout_processor )
+                stdout_consumer()
+            if stderr_thread:
+                stderr_thread.join()
+
+            return_code, cpu_times = cuppa.timer.wait_for( process )
+        finally:
+            if limits:
+                limits.stop()
+            usage = usage_path and cuppa.child_usage.read( usage_path )
+
+        if timer:
+            if usage:
+                cpu_times = cuppa.timer.CpuTimes.from_rusage( usage )
+            timer.add_child( cpu_times )
+        return return_code
 
-        stderr_consumer = LineConsumer( process.stderr.readline, stderr_processor )
-        stdout_consumer = LineConsumer( process.stdout.readline, stdout_processor )
 
-        stderr_thread = threading.Thread( target=stderr_consumer )
-        stderr_thread.start()
-        stdout_consumer();
-        stderr_thread.join()
-
-        process.wait()
-        return process.returncode
+    @classmethod
+    def _is_file( cls, processor ):
+        return hasattr( processor, 'fileno' )
 
 
     @classmethod
@@ -108,14 +173,15 @@ class Processor:
         env['SPAWN'] = output_processor.spawn
 
 
-    def spawn( self, sh, escape, cmd, args, env ):
+    def spawn( self, sh, escape, cmd, args, env, cwd=None ):
 
         processor = SpawnedProcessor( self.scons_env )
 
         returncode = IncrementalSubProcess.Popen(
             processor.process,
             [ arg.strip('"') for arg in args ],
-            env=env
+            env=env,
+            cwd=cwd
         )
 
         summary = processor.summary( returncode )
@@ -78,6 +78,8 @@ class Darwin:
         CLOCK_MONOTONIC_COARSE      = 6 # Monotonic system-wide clock, updated only on ticks.
         CLOCK_BOOTTIME              = 7 # Monotonic system-wide clock that includes time spent in suspension.
 
+        RUSAGE_MAXRSS_UNIT          = 1 # ru_maxrss is given in bytes.
+
 
     @classmethod
     def constants( cls ):
@@ -97,6 +97,8 @@ class Linux:
         CLOCK_MONOTONIC_COARSE      = 6 # Monotonic system-wide clock, updated only on ticks.
         CLOCK_BOOTTIME              = 7 # Monotonic system-wide clock that includes time spent in suspension.
 
+        RUSAGE_MAXRSS_UNIT          = 1024 # ru_maxrss is given in kilobytes.
+
 
     @classmethod
     def constants( cls ):
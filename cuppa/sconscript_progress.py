@@ -5,6 +5,8 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 
+import threading
+
 import SCons.Script
 
 
@@ -14,9 +16,14 @@ class SconscriptProgress:
     started   = {}
     finished  = {}
 
+    # Callbacks are registered, and progress reported, from actions that may
+    # run at the same time when building with -j
+    _lock = threading.RLock()
+
     @classmethod
     def register_callback( cls, env, callback ):
-        cls._callbacks( env ).add( callback )
+        with cls._lock:
+            cls._callbacks( env ).add( callback )
 
 
 #    @classmethod
@@ -37,28 +44,35 @@ class SconscriptProgress:
 
 
     @classmethod
-    def Started( cls, target, source, env ):
-        for callback in cls._callbacks( env ):
-            callback( 'started', env, cls._sconscript(env), target, source )
+    def _progress( cls, progress, sconscripts, target, source, env ):
+        with cls._lock:
+            callbacks = list( cls._callbacks( env ) )
 
-        del cls.started[cls._sconscript(env)]
+        for callback in callbacks:
+            callback( progress, env, cls._sconscript(env), target, source )
+
+        with cls._lock:
+            del sconscripts[cls._sconscript(env)]
 
 
     @classmethod
-    def Finished( cls, target, source, env ):
-        for callback in cls._callbacks( env ):
-            callback( 'finished', env, cls._sconscript(env), target, source )
+    def Started( cls, target, source, env ):
+        cls._progress( 'started', cls.started, target, source, env )
+
 
-        del cls.finished[cls._sconscript(env)]
+    @classmethod
+    def Finished( cls, target, source, env ):
+        cls._progress( 'finished', cls.finished, target, source, env )
 
 
     @classmethod
     def add( cls, env, target ):
         sconscript = cls._sconscript(env)
-        if sconscript not in cls.started:
-            cls.started[sconscript] = env.Command( 'Started', [], cls.Started )
-        if sconscript not in cls.finished:
-            cls.finished[sconscript] = env.Command( 'Finished', [], cls.Finished )
-        env.Requires( target, cls.started[sconscript] )
-        env.Depends( cls.finished[sconscript], target )
+        with cls._lock:
+            if sconscript not in cls.started:
+                cls.started[sconscript] = env.Command( 'Started', [], cls.Started )
+            if sconscript not in cls.finished:
+                cls.finished[sconscript] = env.Command( 'Finished', [], cls.Finished )
+            env.Requires( target, cls.started[sconscript] )
+            env.Depends( cls.finished[sconscript], target )
 
@@ -0,0 +1,183 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   TestHistory
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import atexit
+import cPickle
+import threading
+
+# Cuppa
+from cuppa.timer import nanosecs_multiple
+
+
+# The number of recent runs of a test its baseline is taken from
+baseline_runs = 10
+
+# The fewest runs a baseline is taken from before a test is compared with it
+minimum_runs = 5
+
+# How many scaled median absolute deviations above the median a measure must
+# be to be taken as a regression
+significance = 3.0
+
+# The smallest fraction above the median a measure must be to be taken as a
+# regression, so that tests with very steady measures are not flagged for noise
+minimum_change = 0.05
+
+# The smallest difference from the median of each measure that is taken as a
+# regression, so that very short or small tests are not flagged for jitter
+minimum_difference = {
+    'wall'   : nanosecs_multiple // 100,
+    'cpu'    : nanosecs_multiple // 100,
+    'max_rss': 1024 * 1024,
+}
+
+# The version of the format the history is saved in. Histories saved with an
+# earlier version are discarded, such as those from before the peak RSS was
+# measured for the test rather than for SCons
+_format_version = 2
+
+# Scales the median absolute deviation so that it estimates the standard
+# deviation of normally distributed measures
+_mad_scale = 1.4826
+
+
+def median( values ):
+    values = sorted( values )
+    middle = len( values ) // 2
+    if len( values ) % 2:
+        return float( values[middle] )
+    return ( values[middle-1] + values[middle] ) / 2.0
+
+
+def median_absolute_deviation( values, centre ):
+    return median( [ abs( value - centre ) for value in values ] )
+
+
+
+class Regression(object):
+
+    _names = {
+        'wall'   : "Wall time",
+        'cpu'    : "CPU time",
+        'max_rss': "Peak RSS",
+    }
+
+
+    def __init__( self, measure, value, baseline, runs ):
+        self.measure  = measure
+        self.value    = value
+        self.baseline = baseline
+        self.runs     = runs
+        self.change   = baseline and ( value - baseline ) / baseline or 0.0
+
+
+    def _text( self, value ):
+        if self.measure == 'max_rss':
+            return "{:.1f} MB".format( float( value ) / ( 1024 * 1024 ) )
+        return "{:.3f}s".format( float( value ) / nanosecs_multiple )
+
+
+    def __str__( self ):
+        return "{} of {} is {:.1f}% above its median of {} over the last {} runs".format(
+                self._names.get( self.measure, self.measure ),
+                self._text( self.value ),
+                self.change * 100,
+                self._text( self.baseline ),
+                self.runs )
+
+
+
+class TestHistory(object):
+    """The wall time, CPU time and peak RSS of recent runs of each test, kept
+    between builds for each toolchain and variant a test is built with, that
+    each run is compared with to find performance regressions"""
+
+    def __init__( self, path ):
+        self._path    = os.path.abspath( path )
+        self._tests   = {}
+        self._changed = False
+        self._lock    = threading.Lock()
+        try:
+            with open( self._path, 'rb' ) as history:
+                version, tests = cPickle.load( history )
+            if version == _format_version:
+                self._tests = tests
+        except ( IOError, EOFError, cPickle.UnpicklingError, TypeError, ValueError ):
+            pass
+
+
+    def compare( self, key, measures ):
+        """Returns a Regression for each of the measures that is significantly
+        above the median of the recent runs of the test"""
+        with self._lock:
+            runs = list( self._tests.get( key, [] ) )
+
+        if len( runs ) < minimum_runs:
+            return []
+
+        regressions = []
+        for measure in sorted( measures ):
+            value  = measures[measure]
+            values = [ run[measure] for run in runs if run.get( measure ) ]
+            if not value or len( values ) < minimum_runs:
+                continue
+            centre    = median( values )
+            deviation = _mad_scale * median_absolute_deviation( values, centre )
+            threshold = max(
+                    significance * deviation,
+                    centre * minimum_change,
+                    minimum_difference.get( measure, 0 ) )
+            if value > centre + threshold:
+                regressions.append( Regression( measure, value, centre, len( values ) ) )
+        return regressions
+
+
+    def record( self, key, measures ):
+        with self._lock:
+            runs = self._tests.setdefault( key, [] )
+            runs.append( dict( measures ) )
+            del runs[:-baseline_runs]
+            self._changed = True
+
+
+    def save( self ):
+        with self._lock:
+            if not self._changed:
+                return
+            directory = os.path.dirname( self._path )
+            if directory and not os.path.exists( directory ):
+                os.makedirs( directory )
+            temporary = self._path + '.tmp'
+            with open( temporary, 'wb' ) as history:
+                cPickle.dump( ( _format_version, self._tests ), history, cPickle.HIGHEST_PROTOCOL )
+            os.rename( temporary, self._path )
+            self._changed = False
+
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def history( build_root ):
+    """The TestHistory kept under the build_root, which is saved when the
+    build ends"""
+    global _history
+    with _history_lock:
+        if not _history:
+            _history = TestHistory( os.path.join( build_root, '.cuppa_test_history' ) )
+            atexit.register( _history.save )
+        return _history
+
+
+def key( env, test ):
+    return ( os.path.join( env['sconscript_build_dir'], test ), env['toolchain'].name(), env['variant_dir'] )
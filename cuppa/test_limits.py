@@ -0,0 +1,210 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   TestLimits
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import signal
+import resource
+import threading
+import ctypes
+import ctypes.util
+
+# Scons
+import SCons.Job
+
+
+# Seconds a test is given to stop after it is asked to before it is killed
+grace_period = 5
+
+
+# The process groups of the tests that are running. A test in its own process
+# group no longer receives the signals sent to the terminal's process group,
+# such as Ctrl-C, so SCons passes them on.
+_process_groups = set()
+_process_groups_lock = threading.Lock()
+
+
+def _signal_process_groups( signal_number ):
+    with _process_groups_lock:
+        for process_group in _process_groups:
+            try:
+                os.killpg( process_group, signal_number )
+            except OSError:
+                pass
+
+
+def _affinity_setter():
+    """Returns a function that pins the calling process to a list of CPUs, or
+    None where the platform cannot do so"""
+    if hasattr( os, 'sched_setaffinity' ):
+        return lambda cpus: os.sched_setaffinity( 0, cpus )
+
+    path = ctypes.util.find_library( 'c' )
+    if not path:
+        return None
+    try:
+        sched_setaffinity = ctypes.CDLL( path, use_errno=True ).sched_setaffinity
+    except ( OSError, AttributeError ):
+        return None
+
+    def set_affinity( cpus ):
+        mask = ( ctypes.c_uint64 * ( max( cpus ) // 64 + 1 ) )()
+        for cpu in cpus:
+            mask[ cpu // 64 ] |= 1 << ( cpu % 64 )
+        if sched_setaffinity( 0, ctypes.sizeof( mask ), ctypes.byref( mask ) ) != 0:
+            error = ctypes.get_errno()
+            raise OSError( error, os.strerror( error ) )
+
+    return set_affinity
+
+
+
+class TestLimits(object):
+    """Limits the wall time, memory and CPU time a test process may use, and
+    the CPUs it may run on. A test is run in its own process group so that,
+    when it runs out of time, any processes it started are stopped with it."""
+
+    def __init__( self, timeout=None, memory_limit=None, cpu_limit=None, cpus=None ):
+        self.timeout       = timeout
+        self.memory_limit  = memory_limit
+        self.cpu_limit     = cpu_limit
+        self.cpus          = cpus
+        self.timed_out     = False
+        self._timers       = []
+        self._set_affinity = None
+        self._process      = None
+        self._stopped      = False
+        self._lock         = threading.Lock()
+
+
+    @classmethod
+    def from_env( cls, env ):
+        return cls( env.get( 'test_timeout' ), env.get( 'test_memory_limit' ), env.get( 'test_cpu_limit' ) )
+
+
+    def popen_kwargs( self ):
+        if self.cpus:
+            # Looked up before the child is forked as it may run ldconfig
+            self._set_affinity = _affinity_setter()
+        if not self.timeout and not self.memory_limit and not self.cpu_limit and not self._set_affinity:
+            return {}
+        return { 'preexec_fn': self._limit_child }
+
+
+    def _limit_child( self ):
+        # Called in the child process before the test is started
+        if self.timeout:
+            os.setpgrp()
+        if self.memory_limit:
+            memory = int( self.memory_limit ) * 1024 * 1024
+            resource.setrlimit( resource.RLIMIT_AS, ( memory, memory ) )
+        if self.cpu_limit:
+            # SIGXCPU at the soft limit, and SIGKILL at the hard limit if that
+            # is ignored
+            cpu = int( self.cpu_limit )
+            resource.setrlimit( resource.RLIMIT_CPU, ( cpu, cpu + 1 ) )
+        if self._set_affinity:
+            self._set_affinity( self.cpus )
+
+
+    def watch( self, process ):
+        if self.timeout:
+            with self._lock:
+                self._process = process
+                with _process_groups_lock:
+                    _process_groups.add( process.pid )
+                self._start( self.timeout, self._expired, process )
+
+
+    def _start( self, seconds, function, process ):
+        # Called with the lock held
+        timer = threading.Timer( seconds, function, [ process ] )
+        timer.daemon = True
+        self._timers.append( timer )
+        timer.start()
+
+
+    def _expired( self, process ):
+        with self._lock:
+            if self._stopped:
+                return
+            self.timed_out = True
+            self._signal( process, signal.SIGTERM )
+            self._start( grace_period, self._kill, process )
+
+
+    def _kill( self, process ):
+        with self._lock:
+            if not self._stopped:
+                self._signal( process, signal.SIGKILL )
+
+
+    @classmethod
+    def _signal( cls, process, signal_number ):
+        try:
+            os.killpg( process.pid, signal_number )
+        except OSError:
+            pass
+
+
+    def stop( self ):
+        """Stops watching the process. If it has not been waited for, such as
+        when the runner failed, its process group is killed."""
+        with self._lock:
+            self._stopped = True
+            for timer in self._timers:
+                timer.cancel()
+            if self._process:
+                with _process_groups_lock:
+                    _process_groups.discard( self._process.pid )
+                if self._process.returncode is None:
+                    self._signal( self._process, signal.SIGKILL )
+
+
+    def exceeded( self, return_code ):
+        """Describes the limit a test that ended with return_code ran into, if
+        it ran into one that can be told from how it ended"""
+        if self.timed_out:
+            return "Test timed out after {} seconds".format( self.timeout )
+        if self.cpu_limit and return_code in [ -signal.SIGXCPU, -signal.SIGKILL ]:
+            return "Test exceeded its CPU limit of {} seconds".format( self.cpu_limit )
+        return None
+
+
+
+_installed = False
+
+
+def install():
+    """Passes the signals that stop SCons on to the process groups of the
+    tests that are running, as they are not in the terminal's process group"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    setup_sig_handler = SCons.Job.Jobs._setup_sig_handler
+    scons_pid = os.getpid()
+
+    def _setup_sig_handler( self ):
+        setup_sig_handler( self )
+        for signal_number in [ signal.SIGINT, signal.SIGTERM, signal.SIGHUP ]:
+            handler = signal.getsignal( signal_number )
+            if not callable( handler ):
+                continue
+
+            def forward( signum, stack, handler=handler ):
+                if os.getpid() == scons_pid:
+                    _signal_process_groups( signum )
+                handler( signum, stack )
+
+            signal.signal( signal_number, forward )
+
+    SCons.Job.Jobs._setup_sig_handler = _setup_sig_handler
@@ -0,0 +1,401 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   TestSchedule
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os
+import json
+import atexit
+import cPickle
+import threading
+
+# Scons
+import SCons.Action
+import SCons.Script
+import SCons.Taskmaster
+
+# Cuppa
+from cuppa.timer import wall_time_nanosecs, nanosecs_multiple
+
+
+# The number of recent runs of a test used to estimate how long it will take
+recent_runs = 5
+
+
+def _seconds( nanosecs ):
+    return float( nanosecs ) / nanosecs_multiple
+
+
+
+class TestDurations(object):
+    """The wall time of recent runs of each test, and of each of its shards
+    where the test was split, kept between builds"""
+
+    def __init__( self, path ):
+        self._path    = os.path.abspath( path )
+        self._tests   = {}
+        self._changed = False
+        try:
+            with open( self._path, 'rb' ) as durations:
+                self._tests = cPickle.load( durations )
+        except ( IOError, EOFError, cPickle.UnpicklingError ):
+            pass
+
+
+    def expected( self, test ):
+        runs = self._tests.get( test, {} ).get( 'runs' )
+        if not runs:
+            return None
+        return sum( runs ) // len( runs )
+
+
+    def shards( self, test ):
+        return self._tests.get( test, {} ).get( 'shards', [] )
+
+
+    def record( self, test, wall ):
+        runs = self._tests.setdefault( test, {} ).setdefault( 'runs', [] )
+        runs.append( wall )
+        del runs[:-recent_runs]
+        self._changed = True
+
+
+    def record_shards( self, test, walls ):
+        self._tests.setdefault( test, {} )['shards'] = list( walls )
+        self._changed = True
+
+
+    def save( self ):
+        if not self._changed:
+            return
+        directory = os.path.dirname( self._path )
+        if directory and not os.path.exists( directory ):
+            os.makedirs( directory )
+        temporary = self._path + '.tmp'
+        with open( temporary, 'wb' ) as durations:
+            cPickle.dump( self._tests, durations, cPickle.HIGHEST_PROTOCOL )
+        os.rename( temporary, self._path )
+        self._changed = False
+
+
+
+def longest_first( durations, jobs ):
+    """Returns the start and end of each ( ready, duration ) pair when the
+    longest of those that are ready is run on whichever of the jobs becomes
+    free first, none starting before it is ready"""
+    free    = [ 0 ] * max( jobs, 1 )
+    pending = list( durations )
+    runs    = []
+    while pending:
+        job = free.index( min( free ) )
+        now = max( free[job], min( ready for ready, duration in pending ) )
+        ready, duration = max(
+                [ item for item in pending if item[0] <= now ],
+                key=lambda item: ( item[1], -item[0] ) )
+        pending.remove( ( ready, duration ) )
+        runs.append( ( now, now + duration ) )
+        free[job] = now + duration
+    return runs
+
+
+def tail( runs ):
+    """The time from the start of the last run to start until every run has
+    ended, during which jobs become free with no further work to start"""
+    if not runs:
+        return 0
+    return max( end for start, end in runs ) - max( start for start, end in runs )
+
+
+
+class ExclusiveLock(object):
+    """Held by any number of tasks at once, except by a task that must run on
+    its own. Such a task waits until no other task is running, and no task is
+    started while it runs."""
+
+    def __init__( self ):
+        self._condition = threading.Condition( threading.Lock() )
+        self._shared    = 0
+        self._exclusive = False
+
+
+    def acquire( self, exclusive=False ):
+        with self._condition:
+            if exclusive:
+                while self._exclusive or self._shared:
+                    self._condition.wait()
+                self._exclusive = True
+            else:
+                while self._exclusive:
+                    self._condition.wait()
+                self._shared += 1
+
+
+    def release( self, exclusive=False ):
+        with self._condition:
+            if exclusive:
+                self._exclusive = False
+            else:
+                self._shared -= 1
+            self._condition.notify_all()
+
+
+
+class TestSchedule(object):
+    """Starts the tests that took longest in previous builds as early as their
+    dependencies allow, so that a long test is not left to run on its own at
+    the end of the build"""
+
+    def __init__( self, durations ):
+        self._durations  = durations
+        self._tests      = {}
+        self._priorities = None
+        self._lock       = threading.Lock()
+        self._runs       = {}
+        self._built      = {}
+        self._first      = None
+        self._exclusive  = set()
+        self.lock        = ExclusiveLock()
+
+
+    def add( self, test, exclusive=False ):
+        # Every target of a test is built by the same action, so each gets the
+        # priority of the test
+        for node in test:
+            self._tests[node] = str( test[0] )
+            if exclusive:
+                self._exclusive.add( node )
+
+
+    def exclusive( self, targets ):
+        for node in targets:
+            if node in self._exclusive:
+                return True
+        return False
+
+
+    def test_of( self, targets ):
+        for node in targets:
+            if node in self._tests:
+                return self._tests[node]
+        return None
+
+
+    def _prioritise( self, node, duration, priorities ):
+        pending = [ node ]
+        while pending:
+            node = pending.pop()
+            if priorities.get( node, 0 ) >= duration:
+                continue
+            priorities[node] = duration
+
+            # Directories holding the node are visited before it when it is
+            # built as part of a directory, such as the default '.'
+            directory = getattr( node, 'dir', None )
+            while directory and priorities.get( directory, 0 ) < duration:
+                priorities[directory] = duration
+                directory = directory.dir
+
+            if node.has_builder():
+                pending.extend( node.children( scan=0 ) )
+
+
+    def priorities( self ):
+        if self._priorities is None:
+            self._priorities = {}
+            for node, test in self._tests.items():
+                duration = self._durations.expected( test )
+                if duration:
+                    self._prioritise( node, duration, self._priorities )
+        return self._priorities
+
+
+    def order( self, order ):
+        def ordered( nodes ):
+            # The last node is visited first, and the sort leaves nodes of the
+            # same priority in the order they were given. Tests that must run
+            # on their own are visited after everything else.
+            priorities = self.priorities()
+            return sorted(
+                    order( nodes ),
+                    key=lambda node: ( node not in self._exclusive, priorities.get( node, 0 ) ) )
+        return ordered
+
+
+    def executing( self ):
+        with self._lock:
+            if self._first is None:
+                self._first = wall_time_nanosecs()
+
+
+    def built( self, targets ):
+        with self._lock:
+            end = wall_time_nanosecs()
+            for node in targets:
+                self._built[node] = end
+
+
+    def started( self, test, targets ):
+        # A test is ready to run once the last of its dependencies built in
+        # this build has been, or else from when the build started
+        with self._lock:
+            ready = self._first
+            for node in targets:
+                for child in node.children( scan=0 ):
+                    ready = max( ready, self._built.get( child, ready ) )
+            self._runs[test] = { 'ready': ready, 'start': wall_time_nanosecs() }
+
+
+    def finished( self, test, passed ):
+        with self._lock:
+            run = self._runs[test]
+            run['end'] = wall_time_nanosecs()
+            # Failures often end early so they are not taken as the duration
+            if passed:
+                run['expected'] = self._durations.expected( test )
+                self._durations.record( test, run['end'] - run['start'] )
+
+
+    def record_shards( self, test, walls ):
+        with self._lock:
+            self._durations.record_shards( test, walls )
+
+
+    def report( self, path, jobs ):
+        runs = dict( ( test, run ) for test, run in self._runs.items() if 'end' in run )
+        if len( runs ) < 2:
+            return
+
+        # Both schedules are measured from when the first test was ready, and
+        # in the expected one no test starts before it was ready in this build
+        first = min( run['ready'] for run in runs.values() )
+        actual = [ ( run['start'] - first, run['end'] - first ) for run in runs.values() ]
+
+        # Tests without an expected duration are expected to take as long as
+        # they did
+        expected = longest_first(
+                [ ( run['ready'] - first, run.get( 'expected' ) or ( run['end'] - run['start'] ) ) for run in runs.values() ],
+                jobs )
+
+        tests = []
+        for test, run in sorted( runs.items(), key=lambda item: item[1]['start'] ):
+            entry = {
+                'test'    : os.path.relpath( test ),
+                'ready'   : _seconds( run['ready'] - first ),
+                'start'   : _seconds( run['start'] - first ),
+                'seconds' : _seconds( run['end'] - run['start'] ),
+                'expected': run.get( 'expected' ) and _seconds( run['expected'] ),
+            }
+            shards = self._durations.shards( test )
+            if shards:
+                entry['shards'] = [ _seconds( shard ) for shard in shards ]
+            tests.append( entry )
+
+        report = {
+            'jobs'            : jobs,
+            'seconds'         : _seconds( max( end for start, end in actual ) ),
+            'expected_seconds': _seconds( max( end for start, end in expected ) ),
+            'tail'            : _seconds( tail( actual ) ),
+            'expected_tail'   : _seconds( tail( expected ) ),
+            'tests'           : tests,
+        }
+        with open( path + '.json', 'w' ) as schedule:
+            json.dump( report, schedule, indent=2, sort_keys=True )
+
+        print "cuppa: test schedule: {} tests took {:.2f}s (expected {:.2f}s) with a tail of {:.2f}s (expected {:.2f}s) over {} jobs, see [{}.json]".format(
+                len( runs ),
+                report['seconds'],
+                report['expected_seconds'],
+                report['tail'],
+                report['expected_tail'],
+                jobs,
+                os.path.relpath( path ) )
+
+
+
+def _scheduled_task( task_class, schedule ):
+
+    class ScheduledTask( task_class ):
+
+        def execute( self ):
+            exclusive = schedule.exclusive( self.targets )
+            schedule.executing()
+            schedule.lock.acquire( exclusive )
+            try:
+                self._timed_execute()
+            finally:
+                schedule.lock.release( exclusive )
+                schedule.built( self.targets )
+
+
+        def _timed_execute( self ):
+            test = schedule.test_of( self.targets )
+            if not test:
+                return task_class.execute( self )
+            schedule.started( test, self.targets )
+            passed = False
+            try:
+                task_class.execute( self )
+                passed = True
+            finally:
+                schedule.finished( test, passed )
+
+
+        def postprocess( self ):
+            # Parents that were waiting on the targets are made candidates
+            # again in no particular order, so order them as well
+            candidates = self.tm.candidates
+            waiting = len( candidates )
+            task_class.postprocess( self )
+            candidates[waiting:] = schedule.order( lambda nodes: nodes )( candidates[waiting:] )
+
+    return ScheduledTask
+
+
+_schedule = None
+
+
+def add( test, exclusive=False ):
+    """Adds a test to the schedule. An exclusive test is run on its own, after
+    the other tasks that can be run before it."""
+    if _schedule:
+        _schedule.add( test, exclusive )
+
+
+def record_shards( test_node, walls ):
+    """Records the wall time of each shard of a test that was split"""
+    if _schedule:
+        _schedule.record_shards( str( test_node ), walls )
+
+
+def install( build_root ):
+    global _schedule
+    if _schedule or not SCons.Action.execute_actions or SCons.Script.GetOption( 'clean' ):
+        return
+
+    durations = TestDurations( os.path.join( build_root, '.cuppa_test_durations' ) )
+    _schedule = TestSchedule( durations )
+
+    taskmaster = SCons.Taskmaster.Taskmaster
+
+    class ScheduledTaskmaster( taskmaster ):
+
+        def __init__( self, targets=[], tasker=None, order=None, trace=None ):
+            if tasker is None:
+                tasker = SCons.Taskmaster.OutOfDateTask
+            if order is None:
+                order = lambda nodes: nodes
+            taskmaster.__init__( self, targets, _scheduled_task( tasker, _schedule ), _schedule.order( order ), trace )
+
+    SCons.Taskmaster.Taskmaster = ScheduledTaskmaster
+
+    def report():
+        durations.save()
+        _schedule.report( os.path.join( build_root, 'test-schedule' ), SCons.Script.GetOption( 'num_jobs' ) or 1 )
+
+    atexit.register( report )
@@ -1,4 +1,3 @@
-
 #          Copyright Jamie Allsop 2013-2014
 # Distributed under the Boost Software License, Version 1.0.
 #    (See accompanying file LICENSE_1_0.txt or copy at
@@ -10,30 +9,97 @@
 
 # Python Standard Library Imports
 import os
+import errno
 import timeit
-import time
+import ctypes
+import ctypes.util
+
+# Custom
+import cuppa.build_platform
 
 
 nanosecs_multiple = 1000000000
 
 
+class _Timespec( ctypes.Structure ):
+    _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+
+
+def _monotonic_clock():
+    """Returns a function giving the time in nanoseconds from a monotonic clock
+    using clock_gettime(), or None where that is not available"""
+    try:
+        constants = cuppa.build_platform.constants()
+        clock_ids = [ constants.CLOCK_MONOTONIC_RAW, constants.CLOCK_MONOTONIC ]
+    except Exception:
+        return None
+
+    # clock_gettime() is in librt for glibc older than 2.17
+    for library in [ 'c', 'rt' ]:
+        path = ctypes.util.find_library( library )
+        if not path:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL( path, use_errno=True ).clock_gettime
+        except ( OSError, AttributeError ):
+            continue
+        clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER( _Timespec ) ]
+        clock_gettime.restype  = ctypes.c_int
+
+        for clock_id in clock_ids:
+            if clock_gettime( clock_id, ctypes.byref( _Timespec() ) ) == 0:
+
+                def monotonic_nanosecs( clock_id=clock_id ):
+                    now = _Timespec()
+                    clock_gettime( clock_id, ctypes.byref( now ) )
+                    return now.tv_sec * nanosecs_multiple + now.tv_nsec
+
+                return monotonic_nanosecs
+    return None
+
+
+_monotonic_nanosecs = None
+
+
 def wall_time_nanosecs():
-    return int( timeit.default_timer()*nanosecs_multiple )
+    """The time from a monotonic clock that is not adjusted for frequency
+    scaling where the platform has one, otherwise from timeit's clock"""
+    global _monotonic_nanosecs
+    if _monotonic_nanosecs is None:
+        _monotonic_nanosecs = _monotonic_clock() or ( lambda: int( timeit.default_timer()*nanosecs_multiple ) )
+    return _monotonic_nanosecs()
 
 
 def process_times_nanosecs():
-    process = time.clock()
     user, system, children_user, children_system, real = os.times()
-    return int( process*nanosecs_multiple), int( user*nanosecs_multiple ), int( system*nanosecs_multiple )
+    return int( ( user + system )*nanosecs_multiple ), int( user*nanosecs_multiple ), int( system*nanosecs_multiple )
+
+
+def _maxrss_unit():
+    try:
+        return cuppa.build_platform.constants().RUSAGE_MAXRSS_UNIT
+    except Exception:
+        return 1024
 
 
 class CpuTimes:
 
-    def __init__( self, wall, process, system, user ):
+    def __init__( self, wall, process, system, user, max_rss=0 ):
         self.wall    = wall
         self.process = process
         self.system  = system
         self.user    = user
+        self.max_rss = max_rss
+
+
+    @classmethod
+    def from_rusage( cls, rusage, with_max_rss=True ):
+        """The CPU times and peak resident set size, in bytes, of an rusage as
+        returned by os.wait4() or resource.getrusage()"""
+        user    = int( rusage.ru_utime*nanosecs_multiple )
+        system  = int( rusage.ru_stime*nanosecs_multiple )
+        max_rss = with_max_rss and rusage.ru_maxrss * _maxrss_unit() or 0
+        return cls( 0, user + system, system, user, max_rss )
 
 
     def __add__( self, other ):
@@ -42,10 +108,11 @@ class CpuTimes:
                 self.wall    + other.wall,
                 self.process + other.process,
                 self.system  + other.system,
-                self.user    + other.user
+                self.user    + other.user,
+                max( self.max_rss, other.max_rss )
             )
         else:
-            raise TypeError("Unsupported operand type(s) for +: '{}' and '{}'").format(self.__class__, type(other))
+            raise TypeError("Unsupported operand type(s) for +: '{}' and '{}'".format(self.__class__, type(other)))
 
 
     def __sub__( self, other ):
@@ -54,24 +121,42 @@ class CpuTimes:
                 self.wall    - other.wall,
                 self.process - other.process,
                 self.system  - other.system,
-                self.user    - other.user
+                self.user    - other.user,
+                self.max_rss
             )
         else:
-            raise TypeError("Unsupported operand type(s) for -: '{}' and '{}'").format(self.__class__, type(other))
+            raise TypeError("Unsupported operand type(s) for -: '{}' and '{}'".format(self.__class__, type(other)))
+
+
+def wait_for( process ):
+    """Waits for a subprocess.Popen process to end and returns its return code
+    and the CpuTimes it used. The times include those of every descendant the
+    process waited for. No peak resident set size is given as on Linux it
+    carries over from the process that forked the child, here SCons itself, so
+    use cuppa.child_usage to measure it."""
+    while True:
+        try:
+            pid, status, rusage = os.wait4( process.pid, 0 )
+            break
+        except OSError, error:
+            if error.errno == errno.EINTR:
+                continue
+            if error.errno == errno.ECHILD:
+                # Already reaped, so its usage can no longer be told
+                process.wait()
+                return process.returncode, CpuTimes( 0, 0, 0, 0 )
+            raise
+    process._handle_exitstatus( status )
+    return process.returncode, CpuTimes.from_rusage( rusage, with_max_rss=False )
 
 
 class Timer:
+    """Times an activity by the wall time it takes and the CPU time of the
+    child processes it ran, which are added with add_child()"""
 
     @classmethod
     def _current_time( cls ):
-        wall = wall_time_nanosecs()
-        process, user, system = process_times_nanosecs()
-        return CpuTimes( wall, process, system, user )
-
-
-    @classmethod
-    def _elapsed_time( cls, current, start ):
-        return current - start
+        return wall_time_nanosecs()
 
 
     def __init__( self ):
@@ -81,12 +166,17 @@ class Timer:
     def elapsed( self ):
         if not self._stopped:
             self._current = self._current_time()
-        return self._elapsed_time( self._current, self._start )
+        return CpuTimes( self._current - self._start, 0, 0, 0 ) + self._children
+
+
+    def add_child( self, cpu_times ):
+        self._children += cpu_times
 
 
     def start( self ):
-        self._stopped = False
-        self._start = self._current_time()
+        self._stopped  = False
+        self._start    = self._current_time()
+        self._children = CpuTimes( 0, 0, 0, 0 )
 
 
     def stop( self ):
@@ -22,8 +22,17 @@ import cuppa.build_platform
 from cuppa.cpp.create_version_file_cpp import CreateVersionHeaderCpp, CreateVersionFileCpp
 from cuppa.cpp.run_boost_test import RunBoostTestEmitter, RunBoostTest
 from cuppa.cpp.run_process_test import RunProcessTestEmitter, RunProcessTest
+from cuppa.cpp.run_gtest_test import RunGtestTestEmitter, RunGtestTest
+from cuppa.cpp.run_bench_test import RunBenchTestEmitter, RunBenchTest
 from cuppa.cpp.run_gcov_coverage import RunGcovCoverageEmitter, RunGcovCoverage
+from cuppa.cpp.profile_guided import MergeProfraw
 from cuppa.output_processor import command_available
+import cuppa.cpp.include_scanner
+import cuppa.cpp.batch_compile
+import cuppa.cpp.include_cost
+import cuppa.cpp.include_paths
+import cuppa.cpp.link_acceleration
+import cuppa.cpp.native_target
 
 
 
@@ -130,11 +139,16 @@ class Clang(object):
             self.values['CXX'] = "clang++-{}".format( self._version )
             self.values['CC']  = "clang-{}".format( self._version )
 
-        env = SCons.Script.DefaultEnvironment()
+        # LTO and PGO are initialised when a variant first asks for them, as
+        # that probes for tools, so LTO keeps the release link flags from
+        # before any link acceleration is added
+        self._release_link_cxx_flags = self.values['release_link_cxx_flags']
 
-        SYSINCPATHS = '${_concat(\"' + self.values['sys_inc_prefix'] + '\", SYSINCPATH, \"'+ self.values['sys_inc_suffix'] + '\", __env__, RDirs, TARGET, SOURCE)}'
+        env = SCons.Script.DefaultEnvironment()
 
-        self.values['_CPPINCFLAGS'] = '$( ' + SYSINCPATHS + ' ${_concat(INCPREFIX, INCPATH, INCSUFFIX, __env__, RDirs, TARGET, SOURCE)} $)'
+        self.values['_CPPINCFLAGS']          = self._include_flags( 'RDirs' )
+        self.values['_CPPINCFLAGS_ABSOLUTE'] = self._include_flags( 'AbsoluteRDirs' )
+        self.values['_CPPINCFLAGS_RECORDED'] = self._include_flags( 'RecordedRDirs' )
 
         if cuppa.build_platform.name() == "Linux":
             self.values['_LIBFLAGS'] = self._linux_lib_flags( env )
@@ -142,6 +156,12 @@ class Clang(object):
             self.values['_LIBFLAGS'] = env['_LIBFLAGS']
 
 
+    def _include_flags( self, rdirs ):
+        SYSINCPATHS = '${_concat(\"' + self.values['sys_inc_prefix'] + '\", SYSINCPATH, \"'+ self.values['sys_inc_suffix'] + '\", __env__, ' + rdirs + ', TARGET, SOURCE)}'
+
+        return '$( ' + SYSINCPATHS + ' ${_concat(INCPREFIX, INCPATH, INCSUFFIX, __env__, ' + rdirs + ', TARGET, SOURCE)} $)'
+
+
     def __getitem__( self, key ):
         return self.values.get( key )
 
@@ -176,6 +196,56 @@ class Clang(object):
         env['LIBS']         = []
         env['STATICLIBS']   = []
         env['DYNAMICLIBS']  = self.values['dynamic_libraries']
+        env['STABLE_INCPATH']        = []
+        env['STABLE_INCPATH_STAMPS'] = []
+
+        if env['depfiles']:
+            env.Append( CCFLAGS = self.values['depfile_flags'] )
+
+        cuppa.cpp.include_scanner.install( env, env['depfiles'] )
+
+        if env['compile_time_trace']:
+            env.Append( CCFLAGS = self.values['compile_time_trace_flags'] )
+
+        if env['batch_size'] > 1:
+            cuppa.cpp.batch_compile.install( env, self.values['_CPPINCFLAGS_ABSOLUTE'] )
+
+        if env['include_cost']:
+            cuppa.cpp.include_cost.install( env )
+
+        if env['include_paths']:
+            cuppa.cpp.include_paths.install( env, self.values['_CPPINCFLAGS_RECORDED'] )
+
+        if env['fast_link']:
+            self._initialise_link_acceleration()
+            if self.values['archive_flags']:
+                env['ARFLAGS'] = self.values['archive_flags']
+
+
+    def _initialise_link_acceleration( self ):
+        if 'link_acceleration' in self.values:
+            return
+
+        acceleration = cuppa.cpp.link_acceleration.LinkAcceleration( self.values['CXX'], [ 'lld', 'gold' ] )
+        self.values['link_acceleration'] = acceleration
+
+        self.values['debug_cxx_flags']        = self.values['debug_cxx_flags']        + acceleration.compile_flags()
+        self.values['debug_c_flags']          = self.values['debug_c_flags']          + acceleration.compile_flags()
+        self.values['debug_link_cxx_flags']   = self.values['debug_link_cxx_flags']   + acceleration.link_flags()
+        self.values['release_link_cxx_flags'] = self.values['release_link_cxx_flags'] + acceleration.link_flags()
+        self.values['archive_flags']          = acceleration.archive_flags()
+
+        print "cuppa: fast link for [{}] uses {}".format( self.values['name'], acceleration.description() )
+
+
+    def native_target( self ):
+        if 'native_target' not in self.values:
+            self.values['native_target'] = cuppa.cpp.native_target.NativeTarget( self.values['CXX'] )
+        return self.values['native_target']
+
+
+    def supports_native( self ):
+        return self.native_target().available()
 
 
     def variants( self ):
@@ -199,10 +269,14 @@ class Clang(object):
             return RunProcessTest( expected ), RunProcessTestEmitter( final_dir )
         elif tester=='boost':
             return RunBoostTest( expected ), RunBoostTestEmitter( final_dir )
+        elif tester=='gtest':
+            return RunGtestTest( expected ), RunGtestTestEmitter( final_dir )
+        elif tester=='bench':
+            return RunBenchTest( expected ), RunBenchTestEmitter( final_dir )
 
 
     def test_runners( self ):
-        return [ 'process', 'boost' ]
+        return [ 'process', 'boost', 'gtest', 'bench' ]
 
 
     def coverage_runner( self, program, final_dir ):
@@ -251,12 +325,87 @@ class Clang(object):
         self.values['release_link_cxx_flags'] = CommonLinkCxxFlags
         self.values['coverage_link_cxx_flags'] = CommonLinkCxxFlags + [ '--coverage' ]
 
+        self.values['depfile_flags'] = [ '-MD', '-MF', '${TARGET}.d' ]
+
+        # -ftime-trace, which also times headers and template instantiations,
+        # arrived in LLVM 9 so earlier versions only report their phases
+        if re.match( 'clang[3-8]', toolchain ):
+            self.values['compile_time_trace_flags'] = [ '-ftime-report' ]
+        else:
+            self.values['compile_time_trace_flags'] = [ '-ftime-trace' ]
+
         DynamicLibraries = []
         if cuppa.build_platform.name() == "Linux":
             DynamicLibraries = [ 'pthread', 'rt' ]
         self.values['dynamic_libraries'] = DynamicLibraries
 
 
+    def _initialise_lto( self ):
+        if 'lto_ar' in self.values:
+            return
+
+        self.values['lto_ar']     = None
+        self.values['lto_ranlib'] = None
+
+        # ThinLTO, and with it parallel backends and caching, arrived in LLVM 3.9
+        thin_lto = not re.match( 'clang3[2-8]', self.values['name'] )
+
+        if cuppa.cpp.link_acceleration.linker_available( self.values['CXX'], 'lld' ):
+            link_flags = [ '-fuse-ld=lld' ]
+            if thin_lto:
+                link_flags += [ '-Wl,--thinlto-jobs=$LTO_JOBS', '-Wl,--thinlto-cache-dir=$LTO_CACHE_DIR' ]
+        elif cuppa.cpp.link_acceleration.linker_available( self.values['CXX'], 'gold' ):
+            link_flags = [ '-fuse-ld=gold' ]
+            if thin_lto:
+                link_flags += [ '-Wl,-plugin-opt,jobs=$LTO_JOBS', '-Wl,-plugin-opt,cache-dir=$LTO_CACHE_DIR' ]
+        else:
+            return
+
+        lto_flag = thin_lto and '-flto=thin' or '-flto'
+
+        self.values['lto_cxx_flags']      = self.values['release_cxx_flags'] + [ lto_flag ]
+        self.values['lto_c_flags']        = self.values['release_c_flags'] + [ lto_flag ]
+        self.values['lto_link_cxx_flags'] = self._release_link_cxx_flags + [ lto_flag ] + link_flags
+
+        for suffix in [ "-{}".format( self._version ), "" ]:
+            if command_available( "llvm-ar{} --version".format( suffix ) ):
+                self.values['lto_ar']     = "llvm-ar{}".format( suffix )
+                self.values['lto_ranlib'] = "llvm-ranlib{}".format( suffix )
+                break
+
+
+    def supports_lto( self ):
+        self._initialise_lto()
+        return 'lto_cxx_flags' in self.values
+
+
+    def _initialise_pgo( self ):
+        if 'profdata' in self.values:
+            return
+
+        self.values['profdata'] = None
+        for suffix in [ "-{}".format( self._version ), "" ]:
+            if command_available( "llvm-profdata{} --version".format( suffix ) ):
+                self.values['profdata'] = "llvm-profdata{}".format( suffix )
+                break
+
+        if not self.values['profdata']:
+            return
+
+        self.values['pgo_generate_flags'] = [ '-fprofile-instr-generate=$PGO_PROFILE_DIR/%p.profraw' ]
+        self.values['pgo_use_flags']      = [ '-fprofile-instr-use=$PGO_PROFILE' ]
+
+
+    def supports_pgo( self ):
+        self._initialise_pgo()
+        return 'pgo_generate_flags' in self.values
+
+
+    def profile_merger( self ):
+        self._initialise_pgo()
+        return MergeProfraw( self.values['profdata'] )
+
+
     def __get_clang_coverage( self, object_dir, source ):
         # -l = --long-file-names
         # -p = --preserve-paths
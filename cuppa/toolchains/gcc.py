@@ -21,8 +21,17 @@ from exceptions import Exception
 from cuppa.cpp.create_version_file_cpp import CreateVersionHeaderCpp, CreateVersionFileCpp
 from cuppa.cpp.run_boost_test import RunBoostTestEmitter, RunBoostTest
 from cuppa.cpp.run_process_test import RunProcessTestEmitter, RunProcessTest
+from cuppa.cpp.run_gtest_test import RunGtestTestEmitter, RunGtestTest
+from cuppa.cpp.run_bench_test import RunBenchTestEmitter, RunBenchTest
 from cuppa.cpp.run_gcov_coverage import RunGcovCoverageEmitter, RunGcovCoverage
+from cuppa.cpp.profile_guided import MergeGcda
 from cuppa.output_processor import command_available
+import cuppa.cpp.include_scanner
+import cuppa.cpp.batch_compile
+import cuppa.cpp.include_cost
+import cuppa.cpp.include_paths
+import cuppa.cpp.link_acceleration
+import cuppa.cpp.native_target
 import cuppa.build_platform
 
 
@@ -132,11 +141,16 @@ class Gcc(object):
         self.values['CXX'] = "g++-{}".format( self._version )
         self.values['CC']  = "gcc-{}".format( self._version )
 
-        env = SCons.Script.DefaultEnvironment()
+        # LTO and PGO are initialised when a variant first asks for them, as
+        # that probes for tools, so LTO keeps the release link flags from
+        # before any link acceleration is added
+        self._release_link_cxx_flags = self.values['release_link_cxx_flags']
 
-        SYSINCPATHS = '${_concat(\"' + self.values['sys_inc_prefix'] + '\", SYSINCPATH, \"'+ self.values['sys_inc_suffix'] + '\", __env__, RDirs, TARGET, SOURCE)}'
+        env = SCons.Script.DefaultEnvironment()
 
-        self.values['_CPPINCFLAGS'] = '$( ' + SYSINCPATHS + ' ${_concat(INCPREFIX, INCPATH, INCSUFFIX, __env__, RDirs, TARGET, SOURCE)} $)'
+        self.values['_CPPINCFLAGS']          = self._include_flags( 'RDirs' )
+        self.values['_CPPINCFLAGS_ABSOLUTE'] = self._include_flags( 'AbsoluteRDirs' )
+        self.values['_CPPINCFLAGS_RECORDED'] = self._include_flags( 'RecordedRDirs' )
 
         if cuppa.build_platform.name() == "Linux":
             self.values['_LIBFLAGS'] = self._linux_lib_flags( env )
@@ -144,6 +158,12 @@ class Gcc(object):
             self.values['_LIBFLAGS'] = env['_LIBFLAGS']
 
 
+    def _include_flags( self, rdirs ):
+        SYSINCPATHS = '${_concat(\"' + self.values['sys_inc_prefix'] + '\", SYSINCPATH, \"'+ self.values['sys_inc_suffix'] + '\", __env__, ' + rdirs + ', TARGET, SOURCE)}'
+
+        return '$( ' + SYSINCPATHS + ' ${_concat(INCPREFIX, INCPATH, INCSUFFIX, __env__, ' + rdirs + ', TARGET, SOURCE)} $)'
+
+
     def __getitem__( self, key ):
         return self.values.get( key )
 
@@ -176,6 +196,56 @@ class Gcc(object):
         env['LIBS']         = []
         env['STATICLIBS']   = []
         env['DYNAMICLIBS']  = self.values['dynamic_libraries']
+        env['STABLE_INCPATH']        = []
+        env['STABLE_INCPATH_STAMPS'] = []
+
+        if env['depfiles']:
+            env.Append( CCFLAGS = self.values['depfile_flags'] )
+
+        cuppa.cpp.include_scanner.install( env, env['depfiles'] )
+
+        if env['compile_time_trace']:
+            env.Append( CCFLAGS = self.values['compile_time_trace_flags'] )
+
+        if env['batch_size'] > 1:
+            cuppa.cpp.batch_compile.install( env, self.values['_CPPINCFLAGS_ABSOLUTE'] )
+
+        if env['include_cost']:
+            cuppa.cpp.include_cost.install( env )
+
+        if env['include_paths']:
+            cuppa.cpp.include_paths.install( env, self.values['_CPPINCFLAGS_RECORDED'] )
+
+        if env['fast_link']:
+            self._initialise_link_acceleration()
+            if self.values['archive_flags']:
+                env['ARFLAGS'] = self.values['archive_flags']
+
+
+    def _initialise_link_acceleration( self ):
+        if 'link_acceleration' in self.values:
+            return
+
+        acceleration = cuppa.cpp.link_acceleration.LinkAcceleration( self.values['CXX'], [ 'gold', 'lld' ] )
+        self.values['link_acceleration'] = acceleration
+
+        self.values['debug_cxx_flags']        = self.values['debug_cxx_flags']        + acceleration.compile_flags()
+        self.values['debug_c_flags']          = self.values['debug_c_flags']          + acceleration.compile_flags()
+        self.values['debug_link_cxx_flags']   = self.values['debug_link_cxx_flags']   + acceleration.link_flags()
+        self.values['release_link_cxx_flags'] = self.values['release_link_cxx_flags'] + acceleration.link_flags()
+        self.values['archive_flags']          = acceleration.archive_flags()
+
+        print "cuppa: fast link for [{}] uses {}".format( self.values['name'], acceleration.description() )
+
+
+    def native_target( self ):
+        if 'native_target' not in self.values:
+            self.values['native_target'] = cuppa.cpp.native_target.NativeTarget( self.values['CXX'] )
+        return self.values['native_target']
+
+
+    def supports_native( self ):
+        return self.native_target().available()
 
 
     def variants( self ):
@@ -199,10 +269,14 @@ class Gcc(object):
             return RunProcessTest( expected ), RunProcessTestEmitter( final_dir )
         elif tester=='boost':
             return RunBoostTest( expected ), RunBoostTestEmitter( final_dir )
+        elif tester=='gtest':
+            return RunGtestTest( expected ), RunGtestTestEmitter( final_dir )
+        elif tester=='bench':
+            return RunBenchTest( expected ), RunBenchTestEmitter( final_dir )
 
 
     def test_runners( self ):
-        return [ 'process', 'boost' ]
+        return [ 'process', 'boost', 'gtest', 'bench' ]
 
 
     def coverage_runner( self, program, final_dir ):
@@ -244,12 +318,59 @@ class Gcc(object):
         self.values['release_link_cxx_flags']  = CommonLinkCxxFlags
         self.values['coverage_link_cxx_flags'] = CommonLinkCxxFlags + [ '--coverage' ]
 
+        self.values['depfile_flags'] = [ '-MD', '-MF', '${TARGET}.d' ]
+
+        self.values['compile_time_trace_flags'] = [ '-ftime-report' ]
+
         DynamicLibraries = []
         if cuppa.build_platform.name() == "Linux":
             DynamicLibraries = [ 'pthread', 'rt' ]
         self.values['dynamic_libraries'] = DynamicLibraries
 
 
+    def _initialise_lto( self ):
+        if 'lto_ar' in self.values:
+            return
+
+        self.values['lto_ar']     = None
+        self.values['lto_ranlib'] = None
+
+        if not re.match( 'gcc4[6-9]', self.values['name'] ):
+            return
+
+        self.values['lto_cxx_flags']      = self.values['release_cxx_flags'] + [ '-flto' ]
+        self.values['lto_c_flags']        = self.values['release_c_flags'] + [ '-flto' ]
+        self.values['lto_link_cxx_flags'] = self._release_link_cxx_flags + [ '-O3', '-flto=$LTO_JOBS', '-fuse-linker-plugin' ]
+
+        for suffix in [ "-{}".format( self._version ), "" ]:
+            if command_available( "gcc-ar{} --version".format( suffix ) ):
+                self.values['lto_ar']     = "gcc-ar{}".format( suffix )
+                self.values['lto_ranlib'] = "gcc-ranlib{}".format( suffix )
+                break
+
+
+    def supports_lto( self ):
+        self._initialise_lto()
+        return 'lto_cxx_flags' in self.values
+
+
+    def _initialise_pgo( self ):
+        if not re.match( 'gcc4[3-9]', self.values['name'] ):
+            return
+
+        self.values['pgo_generate_flags'] = [ '-fprofile-generate' ]
+        self.values['pgo_use_flags']      = [ '-fprofile-use', '-fprofile-correction' ]
+
+
+    def supports_pgo( self ):
+        self._initialise_pgo()
+        return 'pgo_generate_flags' in self.values
+
+
+    def profile_merger( self ):
+        return MergeGcda()
+
+
     def __get_gcc_coverage( self, object_dir, source ):
         # -l = --long-file-names
         # -p = --preserve-paths
@@ -0,0 +1,33 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Check
+#-------------------------------------------------------------------------------
+
+# Scons
+import SCons.Script
+
+class Check:
+
+    @classmethod
+    def name( cls ):
+        return cls.__name__.lower()
+
+
+    @classmethod
+    def add_options( cls ):
+        SCons.Script.AddOption(
+                '--check', dest=cls.name(), action='store_true',
+                help='Check that every source compiles using -fsyntax-only, without producing objects,'
+                     ' linking, testing or coverage' )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env']['actions'][cls.name()] = cls()
+
+
@@ -37,4 +37,7 @@ class Cov:
         env.Append( CFLAGS      = toolchain['coverage_c_flags'] )
         env.AppendUnique( LINKFLAGS   = toolchain['coverage_link_cxx_flags'] )
         env.AppendUnique( DYNAMICLIBS = toolchain['coverage_libs'] )
+
+        # Coverage output is named after the source paths recorded in the objects
+        env['batch_size'] = 0
         return env
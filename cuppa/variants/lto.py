@@ -0,0 +1,56 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Lto
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os.path
+
+# Scons
+import SCons.Script
+
+class Lto:
+
+    @classmethod
+    def name( cls ):
+        return cls.__name__.lower()
+
+
+    @classmethod
+    def add_options( cls ):
+        SCons.Script.AddOption(
+                '--lto', dest=cls.name(), action='store_true',
+                help='Build a release (optimised) binary using link-time optimisation' )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env']['variants'][cls.name()] = cls()
+
+
+    @classmethod
+    def create( cls, env, toolchain ):
+        if not toolchain.supports_lto():
+            print "cuppa: toolchain [{}] does not support link-time optimisation, building [{}] as a release binary".format(
+                    toolchain.name(), cls.name() )
+            env.Append( CXXFLAGS  = toolchain['release_cxx_flags'] )
+            env.Append( CFLAGS    = toolchain['release_c_flags'] )
+            env.AppendUnique( LINKFLAGS = toolchain['release_link_cxx_flags'] )
+            return env
+
+        env.Append( CXXFLAGS  = toolchain['lto_cxx_flags'] )
+        env.Append( CFLAGS    = toolchain['lto_c_flags'] )
+        env.AppendUnique( LINKFLAGS = toolchain['lto_link_cxx_flags'] )
+
+        env['LTO_JOBS']      = max( SCons.Script.GetOption( 'num_jobs' ), 1 )
+        env['LTO_CACHE_DIR'] = os.path.abspath( os.path.join( env['build_root'], 'lto_cache', toolchain.name() ) )
+
+        if toolchain['lto_ar']:
+            env['AR']     = toolchain['lto_ar']
+            env['RANLIB'] = toolchain['lto_ranlib']
+        return env
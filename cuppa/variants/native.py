@@ -0,0 +1,54 @@
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   Native
+#-------------------------------------------------------------------------------
+
+# Scons
+import SCons.Script
+
+class Native:
+
+    @classmethod
+    def name( cls ):
+        return cls.__name__.lower()
+
+
+    @classmethod
+    def add_options( cls ):
+        SCons.Script.AddOption(
+                '--native', dest=cls.name(), action='store_true',
+                help='Build a release (optimised) binary tuned for the instruction set of the build host' )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env']['variants'][cls.name()] = cls()
+
+
+    @classmethod
+    def create( cls, env, toolchain ):
+        env.Append( CXXFLAGS  = toolchain['release_cxx_flags'] )
+        env.Append( CFLAGS    = toolchain['release_c_flags'] )
+        env.AppendUnique( LINKFLAGS = toolchain['release_link_cxx_flags'] )
+
+        if not toolchain.supports_native():
+            print "cuppa: toolchain [{}] cannot detect the native target, building [{}] as a release binary".format(
+                    toolchain.name(), cls.name() )
+            return env
+
+        target = toolchain.native_target()
+        env.Append( CCFLAGS   = target.compile_flags() )
+        env.Append( LINKFLAGS = target.compile_flags() )
+
+        # Builds for different instruction sets must never share a build folder.
+        # Hosts at the same x86-64 level can still resolve to different -march
+        # values, so name the folder after the -march that is actually used
+        env['variant_dir']  = "{}-{}".format( cls.name(), target.march )
+        env['build_target'] = target.identity()
+
+        print "cuppa: native target for [{}] is [{}]".format( toolchain.name(), target.identity() )
+        return env
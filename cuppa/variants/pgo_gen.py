@@ -0,0 +1,54 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   PgoGen
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os.path
+
+# Scons
+import SCons.Script
+
+class PgoGen:
+
+    @classmethod
+    def name( cls ):
+        return 'pgo-gen'
+
+
+    @classmethod
+    def add_options( cls ):
+        SCons.Script.AddOption(
+                '--pgo-gen', dest=cls.name(), action='store_true',
+                help='Build a release binary instrumented to generate a profile for profile-guided optimisation' )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env']['variants'][cls.name()] = cls()
+
+
+    @classmethod
+    def create( cls, env, toolchain ):
+        env.Append( CXXFLAGS  = toolchain['release_cxx_flags'] )
+        env.Append( CFLAGS    = toolchain['release_c_flags'] )
+        env.AppendUnique( LINKFLAGS = toolchain['release_link_cxx_flags'] )
+
+        if not toolchain.supports_pgo():
+            print "cuppa: toolchain [{}] does not support profile-guided optimisation, building [{}] as a release binary".format(
+                    toolchain.name(), cls.name() )
+            return env
+
+        env.Append( CCFLAGS   = toolchain['pgo_generate_flags'] )
+        env.Append( LINKFLAGS = toolchain['pgo_generate_flags'] )
+
+        env['PGO_PROFILE_DIR'] = os.path.abspath( os.path.join( env['build_root'], 'pgo_profiles', toolchain.name() ) )
+
+        # Profiles are matched to sources using the paths recorded in the objects
+        env['batch_size'] = 0
+        return env
@@ -0,0 +1,68 @@
+
+#          Copyright Jamie Allsop 2014-2014
+# Distributed under the Boost Software License, Version 1.0.
+#    (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+#-------------------------------------------------------------------------------
+#   PgoUse
+#-------------------------------------------------------------------------------
+
+# Python Standard
+import os.path
+
+# Scons
+import SCons.Script
+
+class PgoUse:
+
+    @classmethod
+    def name( cls ):
+        return 'pgo-use'
+
+
+    @classmethod
+    def add_options( cls ):
+        SCons.Script.AddOption(
+                '--pgo-use', dest=cls.name(), action='store_true',
+                help='Build a release binary optimised using a profile from training runs of an instrumented'
+                     ' build. Programs built using BuildTest() are used for training' )
+
+
+    @classmethod
+    def add_to_env( cls, args ):
+        args['env']['variants'][cls.name()] = cls()
+
+
+    @classmethod
+    def create( cls, env, toolchain ):
+        env.Append( CXXFLAGS  = toolchain['release_cxx_flags'] )
+        env.Append( CFLAGS    = toolchain['release_c_flags'] )
+        env.AppendUnique( LINKFLAGS = toolchain['release_link_cxx_flags'] )
+
+        if not toolchain.supports_pgo():
+            print "cuppa: toolchain [{}] does not support profile-guided optimisation, building [{}] as a release binary".format(
+                    toolchain.name(), cls.name() )
+        return env
+
+
+    @classmethod
+    def training_env( cls, env, toolchain, profile_dir ):
+        env = env.Clone()
+        env.Append( CCFLAGS   = toolchain['pgo_generate_flags'] )
+        env.Append( LINKFLAGS = toolchain['pgo_generate_flags'] )
+        env['OBJSUFFIX']       = '.pgo-gen' + env['OBJSUFFIX']
+        env['SHOBJSUFFIX']     = '.pgo-gen' + env['SHOBJSUFFIX']
+        env['PGO_PROFILE_DIR'] = profile_dir
+        return env
+
+
+    @classmethod
+    def optimised_env( cls, env, toolchain, profile_dir ):
+        env = env.Clone()
+        env.Append( CCFLAGS = toolchain['pgo_use_flags'] )
+        env['PGO_PROFILE'] = os.path.join( profile_dir, 'merged.profdata' )
+
+        # Profiles are matched to sources using the paths recorded in the objects
+        env['batch_size'] = 0
+        return env